@@ -0,0 +1,284 @@
+'''Benchmark of RemoteMultiCommand against a simulated fleet
+
+Runs launch_multicommand or launch_list_of_commands over fleets of MockRemoteServer of several
+sizes, with several concurrency levels, and reports the throughput, the percentiles of the
+time spent in each server, the utilisation of the workers and the peak memory. Each scenario
+runs in its own process, so the peak memory of one does not hide the others. No network
+access is needed.
+
+Example::
+
+    python benchmarks/bench_multicommand.py --servers 200 1000 --concurrency 10 50 \
+        --latency 0.02 --hang-rate 0.01 --connect-timeout 1 --command-timeout 1
+
+'''
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from remote_multicommand import RemoteMultiCommand
+from remote_multicommand.concurrency import AdaptiveConcurrency
+from remote_multicommand.hosts import HostCache
+from remote_multicommand.relay import RelayAgent
+from mock_fleet import MockRemoteServer
+
+RELAY_AUTHKEY = 'benchmark'
+# Seconds a relay is given to start listening
+RELAY_START_TIMEOUT = 30
+# Seconds between the checks of the process of a scenario while waiting for its measures
+POLL_INTERVAL = 1
+COLUMNS = ('engine', 'mode', 'relays', 'servers', 'concurrency', 'limit', 'elapsed', 'throughput',
+           'p50', 'p95', 'p99', 'utilisation', 'failures', 'timeouts', 'rss_mb', 'workers_rss_mb')
+
+
+def parse_args(argv=None):
+    '''Parses the command line of the benchmark'''
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--servers', type=int, nargs='+', default=[100, 500],
+                        help='fleet sizes')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 50],
+                        help='values of num_of_process')
+    parser.add_argument('--engine', nargs='+', default=['processes'],
+                        choices=['processes', 'threads'])
+    parser.add_argument('--mode', nargs='+', default=['multicommand'],
+                        choices=['multicommand', 'list', 'pipeline', 'reuse', 'script'],
+                        help='launch_multicommand, or launch_list_of_commands with a barrier '
+                        'per command, pipelined, reusing the connections or sending the '
+                        'commands as a script')
+    parser.add_argument('--commands', default='hostname;uname -r;whoami',
+                        help='command (the first one in the multicommand mode) or script')
+    parser.add_argument('--output', default=None,
+                        help='output option of the launch: a number of bytes or "discard"')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.2)
+    parser.add_argument('--output-size', type=int, default=64)
+    parser.add_argument('--distinct-outputs', type=int, default=1)
+    parser.add_argument('--unreachable-rate', type=float, default=0)
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--hang-rate', type=float, default=0)
+    parser.add_argument('--hang-time', type=float, default=3600)
+    parser.add_argument('--connect-timeout', type=float, default=None)
+    parser.add_argument('--command-timeout', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='connections the simulated bastion handles at once')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='adjust the servers in flight with AdaptiveConcurrency, up to '
+                        'the concurrency')
+    parser.add_argument('--server-has-dns', action='store_true',
+                        help='check the hostname of the servers at each connection and '
+                        'command, as RemoteServer does by default')
+    parser.add_argument('--host-cache', action='store_true',
+                        help='resolve the servers ahead and skip the hostname checks of the '
+                        'servers already verified, with HostCache')
+    parser.add_argument('--relays', type=int, nargs='+', default=[0],
+                        help='numbers of relay agents started on localhost (0 to connect '
+                        'to the servers directly)')
+    parser.add_argument('--json', default=None, help='file where the results are written')
+    return parser.parse_args(argv)
+
+
+def fleet_options(options, **kwargs):
+    '''Returns the options of a RemoteMultiCommand connected to the simulated fleet'''
+    kwargs.update({
+        'remote_server_class': MockRemoteServer,
+        'connect_timeout': options.connect_timeout,
+        'command_timeout': options.command_timeout,
+        'latency': options.latency,
+        'jitter': options.jitter,
+        'output_size': options.output_size,
+        'distinct_outputs': options.distinct_outputs,
+        'unreachable_rate': options.unreachable_rate,
+        'failure_rate': options.failure_rate,
+        'hang_rate': options.hang_rate,
+        'hang_time': options.hang_time,
+        'seed': options.seed,
+        'capacity': options.capacity,
+        'server_has_dns': options.server_has_dns,
+        })
+    return kwargs
+
+
+def build_multicommand(options, **kwargs):
+    '''Returns a RemoteMultiCommand connected to the simulated fleet described by options'''
+    rm_cmd = RemoteMultiCommand(None, **fleet_options(options, **kwargs))
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    return rm_cmd
+
+
+def serve_relay(options, engine, conn):
+    '''Runs a relay agent serving the simulated fleet, sending its address through conn'''
+    agent = RelayAgent(('127.0.0.1', 0), RELAY_AUTHKEY, None,
+                       **fleet_options(options, engine=engine))
+    agent.log.setLevel(logging.CRITICAL)
+    conn.send(agent.address)
+    agent.serve_forever()
+
+
+def start_relays(options, engine, num_of_relays):
+    '''Starts relay agents on localhost
+
+    Returns:
+        :obj:`list`: processes of the relays
+    Returns:
+        :obj:`list`: addresses of the relays
+
+    '''
+    processes = []
+    addresses = []
+    try:
+        for _ in range(num_of_relays):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_relay,
+                                              args=(options, engine, child_conn))
+            process.start()
+            processes.append(process)
+            if not parent_conn.poll(RELAY_START_TIMEOUT):
+                raise RuntimeError('The relay did not start (exit status '
+                                   +str(process.exitcode)+')')
+            addresses.append(parent_conn.recv())
+    except BaseException:
+        stop_relays(processes)
+        raise
+    return processes, addresses
+
+
+def stop_relays(processes):
+    '''Terminates the relay agents started by start_relays'''
+    for process in processes:
+        process.terminate()
+        process.join()
+
+
+def fleet_names(num_of_servers):
+    '''Returns the names of a simulated fleet
+
+    Loopback addresses are used, so the lookup done before connecting does not reach a name
+    server and each /24 can be taken as a subnet.
+
+    '''
+    return ['127.%d.%d.%d' % (index >> 16 & 255, index >> 8 & 255, (index & 255))
+            for index in range(num_of_servers)]
+
+
+def run_scenario(options, engine, mode, num_of_relays, num_of_servers, num_of_process, conn):
+    '''Runs one scenario and sends its measures through conn
+
+    With relays, num_of_process servers are kept in flight by each relay. If the scenario
+    fails, its traceback is sent instead, under the key 'error'.
+
+    '''
+    relays = []
+    try:
+        relays, addresses = start_relays(options, engine, num_of_relays)
+        fleet = fleet_names(num_of_servers)
+        output = options.output
+        if output is not None and output != 'discard':
+            output = int(output)
+        if relays:
+            rm_cmd = RemoteMultiCommand(None, relays=addresses, relay_authkey=RELAY_AUTHKEY)
+            rm_cmd.log.setLevel(logging.CRITICAL)
+        else:
+            rm_cmd = build_multicommand(options, engine=engine,
+                                        concurrency=AdaptiveConcurrency() if options.adaptive
+                                        else None,
+                                        host_cache=HostCache() if options.host_cache else None)
+        if mode == 'multicommand':
+            rm_cmd.launch_multicommand(options.commands.split(';')[0], num_of_process, fleet,
+                                       output=output)
+        else:
+            rm_cmd.launch_list_of_commands(options.commands, num_of_process, fleet,
+                                           pipeline=(mode == 'pipeline'),
+                                           reuse_connection=(mode == 'reuse'), output=output,
+                                           as_script=(mode == 'script'))
+        rm_cmd.close()
+        # Stopped before measuring, so their memory is accounted
+        stop_relays(relays)
+        stats = rm_cmd.last_run_stats
+        measures = dict((key, stats[key]) for key in ('elapsed', 'throughput', 'p50', 'p95',
+                                                      'p99', 'utilisation', 'failures',
+                                                      'timeouts'))
+        measures.update({
+            'engine': engine,
+            'mode': mode,
+            'relays': num_of_relays,
+            'servers': num_of_servers,
+            'concurrency': num_of_process,
+            # Limit of servers in flight at the end of the launch
+            'limit': min(rm_cmd.concurrency.limit(), num_of_process) if rm_cmd.concurrency
+                     else num_of_process,
+            # ru_maxrss is in kilobytes on Linux; the workers include the relays
+            'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,
+            'workers_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024.0,
+            })
+    except Exception:
+        conn.send({'error': traceback.format_exc()})
+    else:
+        conn.send(measures)
+    finally:
+        # Left running, the relays would keep this process from exiting
+        stop_relays(relays)
+        conn.close()
+
+
+def wait_measures(process, conn):
+    '''Returns the measures sent by the process of a scenario
+
+    Raises RuntimeError if the scenario failed, or if its process exited without sending them.
+
+    '''
+    while not conn.poll(POLL_INTERVAL):
+        if process.exitcode is not None and not conn.poll():
+            raise RuntimeError('The scenario exited with status '+str(process.exitcode)
+                               +' without its measures')
+    measures = conn.recv()
+    process.join()
+    if 'error' in measures:
+        raise RuntimeError('The scenario failed:\n'+measures['error'])
+    return measures
+
+
+def format_row(values):
+    '''Formats a line of the table of results'''
+    cells = []
+    for value in values:
+        if isinstance(value, float):
+            value = '%.3f' % value
+        cells.append(str(value).rjust(15))
+    return ''.join(cells)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    results = []
+    print(format_row(COLUMNS))
+    for engine in options.engine:
+        for mode in options.mode:
+            for num_of_relays in options.relays:
+                for num_of_servers in options.servers:
+                    for num_of_process in options.concurrency:
+                        parent_conn, child_conn = multiprocessing.Pipe()
+                        process = multiprocessing.Process(target=run_scenario,
+                                                          args=(options, engine, mode,
+                                                                num_of_relays, num_of_servers,
+                                                                num_of_process, child_conn))
+                        process.start()
+                        measures = wait_measures(process, parent_conn)
+                        results.append(measures)
+                        print(format_row([measures[column] for column in COLUMNS]))
+                        sys.stdout.flush()
+    if options.json:
+        with open(options.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
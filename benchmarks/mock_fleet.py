@@ -0,0 +1,322 @@
+'''Simulated fleet of servers for the benchmarks
+
+MockRemoteServer replaces ssh_paramiko.RemoteServer through the remote_server_class option of
+RemoteMultiCommand, so the scheduling, pooling and result handling can be measured offline::
+
+    rm_cmd = RemoteMultiCommand(None, remote_server_class=MockRemoteServer, latency=0.05,
+                                failure_rate=0.01, hang_rate=0.001)
+
+'''
+import hashlib
+import logging
+import os
+import re
+import shlex
+import threading
+from loggers import Loggers
+
+BUFFER_SIZE = 32768
+# Token, index and command of each step of a script of RemoteMultiCommand.execute_script
+SCRIPT_STEP = re.compile(r"printf '%s %d\\n' (\S+) (\d+)\nerr=\$\( \{ (.*?)\n\} 2>&1", re.DOTALL)
+
+
+def _draw(*keys):
+    '''Returns a number in [0, 1) that only depends on keys'''
+    digest = hashlib.md5('|'.join(str(key) for key in keys)).hexdigest()
+    return int(digest[:8], 16)/float(0x100000000)
+
+
+class MockClient(object):
+    '''Stand-in for the paramiko.SSHClient of RemoteServer: closing it releases hung calls'''
+    def __init__(self, server):
+        self.server = server
+
+    def close(self):
+        self.server.closed.set()
+
+    def open_sftp(self):
+        if not self.server.opt_args['remote_root']:
+            raise IOError('mock: no remote_root to keep the files in')
+        return MockSFTP(self.server)
+
+
+class MockSFTPFile(file):
+    '''Stand-in for a paramiko.SFTPFile'''
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def prefetch(self, file_size=None):
+        pass
+
+
+class MockSFTP(object):
+    '''Stand-in for a paramiko.SFTPClient, keeping the files of each server in a folder'''
+    def __init__(self, server):
+        self.server = server
+
+    def open(self, path, mode='r'):
+        self.server._wait(1, self.server.opt_args['seed'], 'sftp', self.server.server, path)
+        return MockSFTPFile(self.server.local_path(path), mode)
+
+    # Errors are raised as IOError, as paramiko does
+
+    def chmod(self, path, mode):
+        try:
+            os.chmod(self.server.local_path(path), mode)
+        except OSError as error:
+            raise IOError(*error.args)
+
+    def remove(self, path):
+        try:
+            os.remove(self.server.local_path(path))
+        except OSError as error:
+            raise IOError(*error.args)
+
+    def rename(self, old_path, new_path):
+        try:
+            os.rename(self.server.local_path(old_path), self.server.local_path(new_path))
+        except OSError as error:
+            raise IOError(*error.args)
+
+    def close(self):
+        pass
+
+
+class MockChannel(object):
+    '''Stand-in for a paramiko channel, delivering the output of a command in chunks'''
+    def __init__(self, server):
+        self.server = server
+        self.stdout_left = 0
+        self.stderr = []
+
+    def settimeout(self, timeout):
+        pass
+
+    def exec_command(self, cmd):
+        if cmd.startswith('exec 3>&1\n'):
+            stdout, error = self.server.run_script(cmd)
+            self.stdout = [stdout] if stdout else []
+            self.stdout_left = len(stdout)
+            self.stderr = [error] if error else []
+            return
+        ret, size, error = self.server.run(cmd)
+        self.stdout = None
+        self.stdout_left = size if ret else 0
+        self.stderr = [error] if error else []
+
+    def recv_ready(self):
+        return self.stdout_left > 0
+
+    def recv(self, nbytes):
+        if self.stdout is not None:
+            self.stdout_left = 0
+            return self.stdout.pop()
+        chunk = min(nbytes, BUFFER_SIZE, self.stdout_left)
+        self.stdout_left -= chunk
+        return 'x'*chunk
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, nbytes):
+        return self.stderr.pop()
+
+    def exit_status_ready(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class MockTransport(object):
+    '''Stand-in for the paramiko.Transport of RemoteServer'''
+    def __init__(self, server):
+        self.server = server
+
+    def open_session(self):
+        return MockChannel(self.server)
+
+
+class MockRemoteServer(Loggers):
+    '''Simulates RemoteServer without any network access
+
+    The behaviour of each server and command is drawn from its name and the seed, so a fleet
+    behaves the same way in every run and in every worker.
+
+    Arguments:
+        key_ssh(:obj:`str`): ignored
+        latency(:obj:`float`, optional, *default* =0.05): seconds of a network round trip;
+            connecting takes three of them and each command one
+        jitter(:obj:`float`, optional, *default* =0.2): maximum random variation of the
+            latency, as a fraction of it
+        output_size(:obj:`int`, optional, *default* =64): bytes of output of each command
+        distinct_outputs(:obj:`int`, optional, *default* =1): number of different outputs
+            a command returns across the fleet
+        unreachable_rate(:obj:`float`, optional, *default* =0): fraction of servers refusing
+            the connection
+        failure_rate(:obj:`float`, optional, *default* =0): fraction of commands failing
+        hang_rate(:obj:`float`, optional, *default* =0): fraction of servers that accept the
+            connection and then hang
+        hang_time(:obj:`float`, optional, *default* =3600): seconds a hung server blocks,
+            unless its connection is closed
+        seed(:obj:`int`, optional, *default* =0): seed of the fleet
+        capacity(:obj:`int`, optional, *default* =None): connections the simulated bastion
+            in front of the fleet handles at once; beyond it the connections of a worker
+            process slow down proportionally, and beyond twice it they are reset (no limit if
+            None)
+        server_has_dns(:obj:`bool`, optional, *default* =False): if True, the hostname of the
+            server is checked as RemoteServer does, taking two more round trips to connect
+            and to close the connection and one more per command
+        remote_root(:obj:`str`, optional, *default* =None): folder where the files of the
+            servers are kept, in a folder per server, for the file transfers and the sha1sum
+            command
+
+    Any other RemoteServer option is accepted and ignored.
+
+    '''
+    # Connections being established by all the instances of the process
+    connecting = [0]
+    connecting_lock = threading.Lock()
+
+    def __init__(self, key_ssh, **kwargs):
+        opt_args = {
+            'latency': 0.05,
+            'jitter': 0.2,
+            'output_size': 64,
+            'distinct_outputs': 1,
+            'unreachable_rate': 0,
+            'failure_rate': 0,
+            'hang_rate': 0,
+            'hang_time': 3600,
+            'seed': 0,
+            'capacity': None,
+            'server_has_dns': False,
+            'remote_root': None
+            }
+        opt_args.update(kwargs)
+        super(MockRemoteServer, self).__init__('mock_fleet')
+        self.opt_args = opt_args
+        self.ssh_time_out = 4
+        self.server = None
+        self.server_has_dns = opt_args['server_has_dns']
+        self.closed = threading.Event()
+        self.ssh_client = MockClient(self)
+        self.transport = MockTransport(self)
+        self.sftp_client = None
+
+    def set_log_level(self, log_level):
+        self.log.setLevel(getattr(logging, log_level))
+
+    def _wait(self, round_trips, *keys):
+        '''Waits for a number of round trips, or until the connection is closed'''
+        latency = self.opt_args['latency']*(1+self.opt_args['jitter']*(2*_draw(*keys)-1))
+        self.closed.wait(round_trips*latency)
+
+    def _hangs(self, server):
+        return _draw(self.opt_args['seed'], 'hang', server) < self.opt_args['hang_rate']
+
+    def connect_server(self, server, ping=True):
+        self.closed.clear()
+        if _draw(self.opt_args['seed'], 'unreachable', server) < \
+           self.opt_args['unreachable_rate']:
+            self._wait(1, self.opt_args['seed'], 'connect', server)
+            return False, '[Errno 111] Connection refused'
+        capacity = self.opt_args['capacity']
+        if capacity:
+            with self.connecting_lock:
+                self.connecting[0] += 1
+                load = float(self.connecting[0])/capacity
+            try:
+                if load > 2:
+                    self._wait(1, self.opt_args['seed'], 'connect', server)
+                    return False, '[Errno 104] Connection reset by peer'
+                self._wait(3*max(load, 1), self.opt_args['seed'], 'connect', server)
+            finally:
+                with self.connecting_lock:
+                    self.connecting[0] -= 1
+        else:
+            self._wait(3, self.opt_args['seed'], 'connect', server)
+        if self._hangs(server):
+            self.closed.wait(self.opt_args['hang_time'])
+            return False, 'Error reading SSH protocol banner'
+        if self.server_has_dns:
+            self._wait(2, self.opt_args['seed'], 'hostname', server)
+        if self.closed.is_set():
+            return False, 'Connection closed'
+        self.server = server
+        return True, ''
+
+    def run(self, cmd):
+        '''Simulates a command in the connected server
+
+        Returns:
+            ret (:obj:`bool`): True if the command succeeded
+        Returns:
+            size (:obj:`int`): bytes of output
+        Returns:
+            error (:obj:`str`): standard error
+
+        '''
+        self._wait(1, self.opt_args['seed'], 'exec', self.server, cmd)
+        if self.closed.is_set():
+            return False, 0, 'Socket Timeout'
+        if _draw(self.opt_args['seed'], 'fail', self.server, cmd) < self.opt_args['failure_rate']:
+            return False, 0, 'mock: command failed in '+str(self.server)
+        return True, self.opt_args['output_size'], ''
+
+    def run_script(self, script):
+        '''Simulates a script sent by RemoteMultiCommand.execute_script in a single round trip
+
+        Returns:
+            stdout (:obj:`str`): standard output, with the marks of each command
+        Returns:
+            error (:obj:`str`): standard error of the failed command
+
+        '''
+        stdout = []
+        self._wait(1, self.opt_args['seed'], 'exec', self.server, script)
+        for token, index, cmd in SCRIPT_STEP.findall(script):
+            if self.closed.is_set():
+                return ''.join(stdout), 'Socket Timeout'
+            stdout.append(token+' '+index+'\n')
+            if _draw(self.opt_args['seed'], 'fail', self.server, cmd) < \
+               self.opt_args['failure_rate']:
+                stdout.append('\n'+token+' '+index+' 1\n')
+                return ''.join(stdout), 'mock: command failed in '+str(self.server)
+            stdout.append('x'*self.opt_args['output_size']+'\n'+token+' '+index+' 0\n')
+        return ''.join(stdout), ''
+
+    def local_path(self, path):
+        '''Returns where the file path of the connected server is kept'''
+        folder = os.path.join(self.opt_args['remote_root'], self.server)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass
+        return os.path.join(folder, path.lstrip('/').replace('/', '_'))
+
+    def execute_cmd(self, cmd, timeout=20):
+        if self.server_has_dns:
+            self._wait(1, self.opt_args['seed'], 'hostname', self.server)
+        ret, size, error = self.run(cmd)
+        if not ret:
+            return False, error, error
+        if self.opt_args['remote_root'] and cmd.startswith('sha1sum '):
+            path = shlex.split(cmd)[1]
+            try:
+                with open(self.local_path(path), 'rb') as remote_file:
+                    return True, hashlib.sha1(remote_file.read()).hexdigest()+'  '+path+'\n', ''
+            except IOError:
+                error = 'sha1sum: '+path+': No such file or directory'
+                return False, error, error
+        variant = int(_draw(self.opt_args['seed'], 'output', self.server, cmd)
+                      *self.opt_args['distinct_outputs'])
+        output = (str(variant)+' '+cmd+'\n').rjust(size, 'x')[-size:] if size else ''
+        return True, output, ''
+
+    def close_connection(self):
+        if self.server_has_dns:
+            self._wait(2, self.opt_args['seed'], 'hostname', self.server)
+        self.server = None
+        return True
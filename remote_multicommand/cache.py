@@ -0,0 +1,120 @@
+import shelve
+import time
+from collections import OrderedDict
+from .relay import pack_result, unpack_result
+
+
+class ResultCache(object):
+    '''Cache of the results of read-only commands, by server and command
+
+    The results expire after ttl seconds, and the least recently used ones are evicted
+    beyond max_entries. Only the successful results are kept. The cache is kept in memory,
+    or in a shelve file if a path is given, so it is shared by the successive runs of a tool;
+    the file must not be written by two processes at the same time.
+
+    Arguments:
+        ttl(:obj:`float`, optional, *default* =300): seconds a result is valid
+        max_entries(:obj:`int`, optional, *default* =100000): maximum number of results kept
+        path(:obj:`str`, optional, *default* =None): path of the shelve file keeping the
+            results (kept in memory if None)
+
+    '''
+    def __init__(self, ttl=300, max_entries=100000, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        if path is None:
+            self.storage = {}
+        else:
+            self.storage = shelve.open(path, protocol=2)
+        # Keys by order of use, the least recently used first
+        self.order = OrderedDict(
+            (key, None) for key, _ in sorted(self.storage.iteritems(),
+                                             key=lambda item: item[1][0]))
+        self.prune()
+
+    @staticmethod
+    def _key(server, cmd):
+        return server+'\0'+cmd
+
+    def get(self, server, cmd):
+        '''Returns the result of a command in a server, or None if it is missing or expired
+
+        Arguments:
+            server (:obj:`str`): server
+            cmd (:obj:`str`): command
+
+        Returns:
+            :obj:`dict`: result of the command, in the format returned by
+            :meth:`RemoteMultiCommand.execute_command`
+
+        '''
+        key = self._key(server, cmd)
+        if key not in self.order:
+            self.misses += 1
+            return None
+        stored, packed = self.storage[key]
+        if time.time()-stored > self.ttl:
+            self._delete(key)
+            self.misses += 1
+            return None
+        self.order[key] = self.order.pop(key)
+        self.hits += 1
+        return unpack_result(packed)[1]
+
+    def put(self, server, cmd_dict):
+        '''Keeps the result of a command in a server, if it succeeded
+
+        Arguments:
+            server (:obj:`str`): server
+            cmd_dict (:obj:`dict`): result of the command, as returned by
+                :meth:`RemoteMultiCommand.execute_command`
+
+        '''
+        if not cmd_dict['result']:
+            return
+        key = self._key(server, cmd_dict['command'])
+        self.order.pop(key, None)
+        self.order[key] = None
+        self.storage[key] = (time.time(), pack_result(server, cmd_dict))
+        while len(self.order) > self.max_entries:
+            self._delete(next(iter(self.order)))
+
+    def invalidate(self, server=None, cmd=None):
+        '''Forgets the results of a server, of a command, of both or all of them
+
+        Arguments:
+            server (:obj:`str`, *default* = None): server (any if None)
+            cmd (:obj:`str`, *default* = None): command (any if None)
+
+        '''
+        for key in list(self.order):
+            key_server, key_cmd = key.split('\0', 1)
+            if (server is None or key_server == server) and (cmd is None or key_cmd == cmd):
+                self._delete(key)
+
+    def prune(self):
+        '''Forgets the expired results'''
+        now = time.time()
+        for key in list(self.order):
+            if now-self.storage[key][0] > self.ttl:
+                self._delete(key)
+
+    def _delete(self, key):
+        del self.order[key]
+        del self.storage[key]
+
+    def sync(self):
+        '''Writes the results to the shelve file, if any'''
+        if self.path is not None:
+            self.storage.sync()
+
+    def close(self):
+        '''Closes the shelve file, if any'''
+        if self.path is not None:
+            self.storage.close()
+
+    def __len__(self):
+        return len(self.order)
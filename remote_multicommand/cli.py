@@ -0,0 +1,219 @@
+'''Command line interface of remote_multicommand
+
+Runs a command, or a script of commands, in the servers read from a file or from the standard
+input, one per line. Each result is written as a JSON line as soon as it is ready, followed by
+a line with the summary of the run::
+
+    cat servers.txt | remote-multicommand -k ~/.ssh/id_rsa -c uptime -n 200 > results.jsonl
+    remote-multicommand -k ~/.ssh/id_rsa -s upgrade.sh -f servers.txt --max-output 4096
+
+The servers are read only as workers become available, and the results are not kept, so the
+memory used does not grow with the number of servers (with --max-output or
+--discard-output, the output of a command is not held as a whole either). The exit status is
+0 if every command succeeded and 1 otherwise. The logs, written to the standard output by the
+library, are sent to the standard error instead.
+
+'''
+import argparse
+import errno
+import getpass
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from .hosts import HostCache
+from .remote_multicommand import RemoteMultiCommand
+
+# Number of servers processed at the same time by default
+NUM_OF_PROCESS = 50
+
+
+def parse_args(argv=None):
+    '''Parses the command line'''
+    parser = argparse.ArgumentParser(
+        prog='remote-multicommand',
+        description='Executes commands in multiple servers in parallel, writing a JSON line '
+        'per result')
+    command = parser.add_mutually_exclusive_group(required=True)
+    command.add_argument('-c', '--command', help='command executed in each server')
+    command.add_argument('-s', '--script', help='file with the commands executed in each '
+                         'server, one per line or separated by ";" (comments are ignored)')
+    parser.add_argument('-f', '--servers', default='-',
+                        help='file with the servers, one per line (standard input if "-")')
+    parser.add_argument('-k', '--key', default=None, help='ssh private key')
+    parser.add_argument('-u', '--username', default='root')
+    parser.add_argument('--password', action='store_true',
+                        help='asks the password of the user instead of using a key')
+    parser.add_argument('-p', '--port', type=int, default=22, help='ssh port')
+    parser.add_argument('--no-dns', action='store_true',
+                        help='the servers are not registered in a DNS domain with their '
+                        'hostname, which is then not checked')
+    parser.add_argument('-n', '--processes', type=int, default=NUM_OF_PROCESS,
+                        help='servers processed at the same time')
+    parser.add_argument('--engine', choices=('processes', 'threads'), default='processes')
+    parser.add_argument('--connect-timeout', type=float, default=None)
+    parser.add_argument('--command-timeout', type=float, default=None)
+    parser.add_argument('--run-timeout', type=float, default=None)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--max-output', type=int, default=None,
+                        help='bytes of the output of each command kept, from its beginning '
+                        'and its end')
+    output.add_argument('--discard-output', action='store_true',
+                        help='does not keep the output of the commands')
+    parser.add_argument('--reuse-connection', action='store_true',
+                        help='issues the commands of a script through one connection')
+    parser.add_argument('--as-script', action='store_true',
+                        help='sends the commands of a script in a single round trip')
+    parser.add_argument('--resolve', action='store_true',
+                        help='resolves the servers ahead, failing the unresolvable ones '
+                        'without connecting them')
+    parser.add_argument('--relay', action='append', default=None, metavar='HOST:PORT',
+                        help='relay agent the servers are handed to (can be repeated)')
+    parser.add_argument('--relay-authkey', default=None, help='key shared with the relays')
+    parser.add_argument('--log-level', default='CRITICAL',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+                        help='log level of the ssh connections')
+    options = parser.parse_args(argv)
+    if options.servers == '-' and options.script == '-':
+        parser.error('the servers and the script cannot both be read from the standard input')
+    if options.processes < 1:
+        parser.error('at least one server must be processed at a time (-n)')
+    if options.relay and not options.relay_authkey:
+        parser.error('the relays need --relay-authkey')
+    if not options.key and not options.password and not options.relay:
+        parser.error('an ssh key or a password is needed')
+    return options
+
+
+def read_servers(servers_file):
+    '''Yields the servers of a file, one per line, skipping empty lines and comments'''
+    for line in servers_file:
+        server = line.split('#', 1)[0].strip()
+        if server:
+            yield server
+
+
+def _text(value):
+    '''Decodes the strings of a value as UTF-8, replacing the bytes that are not valid'''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return OrderedDict((_text(key), _text(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value]
+    return value
+
+
+def result_line(server, cmd_dict):
+    '''Returns the JSON line of the result of a command in a server
+
+    The strings are decoded as UTF-8, the bytes that are not valid being replaced by U+FFFD.
+
+    Arguments:
+        server (:obj:`str`): server where the command was executed
+        cmd_dict (:obj:`dict`): result of the command, as returned by
+            :meth:`RemoteMultiCommand.execute_command`
+
+    '''
+    record = OrderedDict()
+    record['server'] = server
+    for field in ('command', 'access', 'result', 'output', 'timeout', 'timing'):
+        record[field] = cmd_dict[field]
+    return json.dumps(_text(record))+'\n'
+
+
+def build_multicommand(options):
+    '''Returns the RemoteMultiCommand described by the options of the command line
+
+    The ssh and pool libraries are only loaded from here on.
+
+    '''
+    kwargs = {
+        'engine': options.engine,
+        'connect_timeout': options.connect_timeout,
+        'command_timeout': options.command_timeout,
+        'run_timeout': options.run_timeout,
+        'username': options.username,
+        'ssh_port': options.port,
+        'server_has_dns': not options.no_dns,
+        }
+    if options.password:
+        kwargs['password'] = getpass.getpass('Password of '+options.username+': ')
+    if options.resolve:
+        kwargs['host_cache'] = HostCache()
+    if options.relay:
+        kwargs['relays'] = options.relay
+        kwargs['relay_authkey'] = options.relay_authkey
+    return RemoteMultiCommand(options.key, **kwargs)
+
+
+def main(argv=None):
+    '''Runs the command line, returning its exit status'''
+    options = parse_args(argv)
+    start = time.time()
+    if options.discard_output:
+        output = 'discard'
+    else:
+        output = options.max_output
+    servers_file = sys.stdin if options.servers == '-' else open(options.servers)
+    # The results keep the standard output for themselves, while the logs of this process
+    # and of the workers, which write to the file descriptor 1, go to the standard error
+    sys.stdout.flush()
+    stdout_fd = os.dup(1)
+    results_file = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    rm_cmd = None
+    num_of_results = 0
+    failed = 0
+    try:
+        rm_cmd = build_multicommand(options)
+        if options.command is not None:
+            results = rm_cmd.iter_multicommand(options.command, options.processes,
+                                               read_servers(servers_file), options.log_level,
+                                               output=output)
+        else:
+            script_file = sys.stdin if options.script == '-' else open(options.script)
+            with script_file:
+                script = script_file.read()
+            results = rm_cmd.iter_list_of_commands(
+                script, options.processes, read_servers(servers_file), options.log_level,
+                reuse_connection=options.reuse_connection, output=output,
+                as_script=options.as_script)
+        for server, cmd_dict in results:
+            num_of_results += 1
+            if not cmd_dict['result']:
+                failed += 1
+            results_file.write(result_line(server, cmd_dict))
+            results_file.flush()
+        summary = OrderedDict()
+        summary['results'] = num_of_results
+        summary['failed'] = failed
+        summary['elapsed'] = time.time()-start
+        summary['stats'] = rm_cmd.last_run_stats
+        results_file.write(json.dumps({'summary': _text(summary)})+'\n')
+        results_file.close()
+    except IOError as error:
+        if error.errno != errno.EPIPE:
+            raise
+        # The reader of the results went away, as head does
+        return 1
+    finally:
+        if rm_cmd is not None:
+            rm_cmd.close()
+        if servers_file is not sys.stdin:
+            servers_file.close()
+        try:
+            results_file.close()
+        except IOError:
+            # The results not written when the reader went away are lost anyway
+            pass
+        # The standard output is given back, as main may be called from a program
+        sys.stdout.flush()
+        os.dup2(stdout_fd, 1)
+        os.close(stdout_fd)
+    return 0 if not failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import time
+from collections import deque
+
+
+class AdaptiveConcurrency(object):
+    '''Adjusts the number of servers in flight to the health of the connections
+
+    The limit starts low and doubles at each round of connections (a round being as many
+    connections as the limit) while they stay healthy. After the first sign of trouble it
+    grows by increase per round (additive increase), and it is multiplied by decrease
+    (multiplicative decrease) whenever the connections degrade: when the error rate of the
+    last connections exceeds max_error_rate, or when their average connection time exceeds
+    latency_factor times the best one seen. It is never decreased twice in the same round.
+
+    Optionally, the servers in flight in each group, as the ones behind a bastion or in a
+    subnet, are capped by group_limit. The limit is kept between launches, and each of its
+    changes is kept in self.history.
+
+    Arguments:
+        initial(:obj:`int`, optional, *default* =4): initial limit
+        minimum(:obj:`int`, optional, *default* =1): minimum limit
+        maximum(:obj:`int`, optional, *default* =None): maximum limit (num_of_process of the
+            launch is the maximum anyway)
+        increase(:obj:`float`, optional, *default* =1): servers added to the limit per round
+        decrease(:obj:`float`, optional, *default* =0.5): factor of the limit when the
+            connections degrade
+        max_error_rate(:obj:`float`, optional, *default* =0.1): maximum fraction of failed
+            connections
+        latency_factor(:obj:`float`, optional, *default* =2): maximum ratio between the
+            average connection time and the best one
+        window(:obj:`int`, optional, *default* =20): number of connections the error rate is
+            computed on
+        group_of(:obj:`callable`, optional, *default* =None): function returning the group of
+            a server, or None if it is in none
+        group_limit(:obj:`int`, optional, *default* =None): maximum servers in flight in a
+            group
+        history_size(:obj:`int`, optional, *default* =10000): changes of the limit kept
+
+    '''
+    def __init__(self, initial=4, minimum=1, maximum=None, increase=1, decrease=0.5,
+                 max_error_rate=0.1, latency_factor=2, window=20, group_of=None,
+                 group_limit=None, history_size=10000):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+        self.group_of = group_of
+        self.group_limit = group_limit
+        self.outcomes = deque(maxlen=window)
+        self.in_flight = {}
+        self.history = deque(maxlen=history_size)
+        self.reset()
+
+    def reset(self):
+        '''Starts over from the initial limit, keeping the history'''
+        self.value = float(max(self.initial, self.minimum))
+        self.slow_start = True
+        self.outcomes.clear()
+        # Moving average and best average of the connection time
+        self.latency = None
+        self.best_latency = None
+        self.since_decrease = 0
+        self.history.append((time.time(), self.limit()))
+
+    def begin(self):
+        '''Forgets the servers in flight, at the beginning of a launch'''
+        self.in_flight = {}
+
+    def limit(self):
+        '''Returns the number of servers that can be in flight'''
+        if self.maximum is not None:
+            return int(min(self.value, self.maximum))
+        return int(self.value)
+
+    def group(self, server):
+        '''Returns the group of a server, or None if its group is not capped'''
+        if self.group_of is None or self.group_limit is None:
+            return None
+        return self.group_of(server)
+
+    def has_room(self, group):
+        '''Tells if a group, as returned by :meth:`group`, is below its cap'''
+        return group is None or self.in_flight.get(group, 0) < self.group_limit
+
+    def started(self, group):
+        '''Accounts a server of a group put in flight'''
+        if group is not None:
+            self.in_flight[group] = self.in_flight.get(group, 0)+1
+
+    def finished(self, group, success, connect_time=None):
+        '''Accounts a server finished, adjusting the limit to the outcome of its connection
+
+        Arguments:
+            group (:obj:`str`): group of the server, as returned by :meth:`group`
+            success (:obj:`bool`): if the server could be connected in time
+            connect_time (:obj:`float`, *default* = None): seconds taken to connect
+
+        '''
+        if group is not None:
+            self.in_flight[group] -= 1
+            if not self.in_flight[group]:
+                del self.in_flight[group]
+        self.outcomes.append(success)
+        self.since_decrease += 1
+        if success and connect_time is not None:
+            if self.latency is None:
+                self.latency = connect_time
+            else:
+                self.latency = 0.8*self.latency+0.2*connect_time
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+        errors = self.outcomes.count(False)
+        degraded = (errors and float(errors)/self.outcomes.maxlen > self.max_error_rate) or \
+                   (self.latency is not None and
+                    self.latency > self.latency_factor*self.best_latency)
+        previous = self.limit()
+        if degraded:
+            if self.since_decrease >= self.value:
+                self.value = max(self.minimum, self.value*self.decrease)
+                self.slow_start = False
+                self.since_decrease = 0
+                self.outcomes.clear()
+                # The connection time is measured again at the new limit
+                self.latency = None
+        elif self.maximum is None or self.value < self.maximum:
+            if self.slow_start:
+                self.value += 1
+            else:
+                self.value += float(self.increase)/self.value
+        if self.limit() != previous:
+            self.history.append((time.time(), self.limit()))
@@ -0,0 +1,234 @@
+import shelve
+import socket
+import threading
+import time
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from .retry import ipv4_subnet
+
+# Lookups done at the same time when resolving a list of servers
+RESOLVE_THREADS = 32
+# Servers read ahead from a list of servers and resolved together
+RESOLVE_BATCH = 1000
+# Error of the servers that cannot be resolved, as reported by RemoteServer
+NOT_RESOLVED = 'Server is not registered in DNS'
+
+# Caches of the worker processes, by their settings
+_process_caches = {}
+_process_lock = threading.Lock()
+
+
+def resolve(server):
+    '''Returns the address of a server, or None if it cannot be resolved'''
+    try:
+        return socket.gethostbyname(server)
+    except socket.error:
+        return None
+
+
+def _process_cache(ttl, negative_ttl, num_of_threads):
+    '''Returns the cache of the calling process with the given settings'''
+    key = (ttl, negative_ttl, num_of_threads)
+    with _process_lock:
+        if key not in _process_caches:
+            _process_caches[key] = HostCache(ttl, negative_ttl, None, num_of_threads)
+        return _process_caches[key]
+
+
+class HostCache(object):
+    '''Cache of the addresses of the servers and of their verification
+
+    The servers are resolved concurrently, before being connected, and their addresses are
+    kept for ttl seconds (negative_ttl seconds for the ones that cannot be resolved), so a
+    server is looked up once for all the commands issued to it. A server is verified once it
+    has been connected with server_has_dns set, which checks that its hostname is the one
+    expected; it is then connected by its address without checking its hostname again.
+
+    The cache is kept in memory, or in a shelve file if a path is given, so it is shared by
+    the successive runs of a tool; the file must not be written by two processes at the same
+    time. The workers of the thread engine share the cache, while each worker process keeps
+    its own one in memory, which is handed what this one knows of a server along with each of
+    its tasks (see :meth:`entry` and :meth:`seed`).
+
+    Arguments:
+        ttl(:obj:`float`, optional, *default* =3600): seconds an address is kept
+        negative_ttl(:obj:`float`, optional, *default* =60): seconds a server that cannot be
+            resolved is remembered
+        path(:obj:`str`, optional, *default* =None): path of the shelve file keeping the
+            addresses (kept in memory if None)
+        num_of_threads(:obj:`int`, optional, *default* =RESOLVE_THREADS): lookups done at the
+            same time
+
+    '''
+    def __init__(self, ttl=3600, negative_ttl=60, path=None, num_of_threads=RESOLVE_THREADS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self.num_of_threads = num_of_threads
+        self.lock = threading.Lock()
+        # Time of the lookup, address and verification, by server
+        if path is None:
+            self.storage = {}
+        else:
+            self.storage = shelve.open(path, protocol=2)
+        self.prune()
+
+    def __reduce__(self):
+        # Sent to a worker process, the cache becomes the one of that process
+        return _process_cache, (self.ttl, self.negative_ttl, self.num_of_threads)
+
+    def _expired(self, entry, now):
+        resolved, address, _ = entry
+        return now-resolved > (self.ttl if address is not None else self.negative_ttl)
+
+    def get(self, server):
+        '''Returns what is known of a server, or None if it is missing or expired
+
+        Arguments:
+            server (:obj:`str`): server
+
+        Returns:
+            address (:obj:`str`): address of the server, None if it cannot be resolved
+        Returns:
+            verified (:obj:`bool`): if the hostname of the server was verified
+
+        '''
+        with self.lock:
+            entry = self.storage.get(server)
+            if entry is None or self._expired(entry, time.time()):
+                return None
+            return entry[1:]
+
+    def lookup(self, server):
+        '''Returns what is known of a server, resolving it if needed
+
+        Returns:
+            the address and the verification of the server, as returned by :meth:`get`
+
+        '''
+        known = self.get(server)
+        if known is not None:
+            return known
+        address = resolve(server)
+        self._put(server, address)
+        return address, False
+
+    def entry(self, server):
+        '''Returns the entry of a server, as handed to the cache of another process
+
+        Returns:
+            :obj:`tuple`: time of the lookup, address and verification of the server, or None
+            if it is not known
+
+        '''
+        with self.lock:
+            return self.storage.get(server)
+
+    def seed(self, server, entry):
+        '''Records the entry of a server known by another process, unless a newer one is known
+
+        Arguments:
+            server (:obj:`str`): server
+            entry (:obj:`tuple`): entry of the server, as returned by :meth:`entry`
+
+        '''
+        with self.lock:
+            known = self.storage.get(server)
+            if known is None or known[0] < entry[0] or known[1:] == (entry[1], False):
+                self.storage[server] = entry
+
+    def _put(self, server, address):
+        with self.lock:
+            self.storage[server] = (time.time(), address, False)
+
+    def unresolvable(self, server):
+        '''Tells if a server is known not to be resolvable'''
+        known = self.get(server)
+        return known is not None and known[0] is None
+
+    def verify(self, server):
+        '''Records that the hostname of a server was verified'''
+        with self.lock:
+            entry = self.storage.get(server)
+            if entry is not None and entry[1] is not None and not entry[2]:
+                self.storage[server] = (entry[0], entry[1], True)
+
+    def resolve(self, servers):
+        '''Resolves the servers missing or expired, at the same time
+
+        Arguments:
+            servers (:obj:`iterable`): servers
+
+        Returns:
+            :obj:`int`: number of servers looked up
+
+        '''
+        missing = list(set(server for server in servers if self.get(server) is None))
+        if len(missing) < 2:
+            for server in missing:
+                self._put(server, resolve(server))
+            return len(missing)
+        pool = ThreadPool(min(self.num_of_threads, len(missing)))
+        try:
+            for server, address in zip(missing, pool.imap(resolve, missing)):
+                self._put(server, address)
+        finally:
+            pool.close()
+        return len(missing)
+
+    def resolve_ahead(self, servers, batch=RESOLVE_BATCH):
+        '''Yields the servers, resolving them in batches before they are yielded
+
+        Arguments:
+            servers (:obj:`iterable`): servers, read batch servers ahead
+            batch (:obj:`int`, *default* = RESOLVE_BATCH): servers resolved together
+
+        '''
+        servers = iter(servers)
+        while True:
+            servers_batch = list(islice(servers, batch))
+            if not servers_batch:
+                return
+            self.resolve(servers_batch)
+            for server in servers_batch:
+                yield server
+
+    def subnet(self, server, prefix=24):
+        '''Returns the subnet of the address of a server
+
+        Can be the subnet_of of :class:`retry.CircuitBreaker` or the group_of of
+        :class:`concurrency.AdaptiveConcurrency` for servers given by their names.
+
+        '''
+        known = self.get(server)
+        return ipv4_subnet(known[0] if known is not None and known[0] else server, prefix)
+
+    def invalidate(self, server=None):
+        '''Forgets a server, or all of them'''
+        with self.lock:
+            if server is None:
+                self.storage.clear()
+            else:
+                self.storage.pop(server, None)
+
+    def prune(self):
+        '''Forgets the expired servers'''
+        now = time.time()
+        with self.lock:
+            for server in list(self.storage.keys()):
+                if self._expired(self.storage[server], now):
+                    del self.storage[server]
+
+    def sync(self):
+        '''Writes the addresses to the shelve file, if any'''
+        if self.path is not None:
+            with self.lock:
+                self.storage.sync()
+
+    def close(self):
+        '''Closes the shelve file, if any'''
+        if self.path is not None:
+            self.storage.close()
+
+    def __len__(self):
+        return len(self.storage)
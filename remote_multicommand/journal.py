@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from .results import TIMING_FIELDS
+
+# Records kept in memory before being written, unless FLUSH_INTERVAL seconds pass first
+FLUSH_BATCH = 200
+FLUSH_INTERVAL = 1.0
+# Encoding of the strings in the journal, which maps every byte of the outputs to a character
+ENCODING = 'latin-1'
+
+
+class Journal(object):
+    '''Append-only journal of the results of a launch, one JSON object per line
+
+    The first line describes the launch; each of the following ones holds the result of a
+    command in a server, in the order they finished. The records are written in batches,
+    so the journal does not slow down the launch. A batch is written once it is full, or
+    once its first record has waited for interval seconds: when the next record comes, or
+    when :meth:`flush_due` is called, which the scheduler does while it waits for results.
+    A journal cut short by a crash loses the records of the last interval.
+
+    Arguments:
+        path (:obj:`str`): path of the journal, appended to if it already exists
+        batch (:obj:`int`, optional, *default* =FLUSH_BATCH): records written at once
+        interval (:obj:`float`, optional, *default* =FLUSH_INTERVAL): maximum seconds a
+            record waits to be written
+        fsync (:obj:`bool`, optional, *default* =False): if True, each batch is synced to
+            the disk
+
+    '''
+    def __init__(self, path, batch=FLUSH_BATCH, interval=FLUSH_INTERVAL, fsync=False):
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.fsync = fsync
+        self.journal_file = open(path, 'ab')
+        if self.journal_file.tell() and not self._ends_with_newline():
+            # The last record was cut short, the next one starts in a new line
+            self.journal_file.write('\n')
+        self.pending = []
+        self.last_flush = time.time()
+
+    def _ends_with_newline(self):
+        with open(self.path, 'rb') as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == '\n'
+
+    def _write(self, record):
+        self.pending.append(json.dumps(record, encoding=ENCODING)+'\n')
+        if len(self.pending) >= self.batch:
+            self.flush()
+        else:
+            self.flush_due()
+
+    def due(self):
+        '''Returns the time when the records kept in memory must be written, None if there
+        are none'''
+        return self.last_flush+self.interval if self.pending else None
+
+    def flush_due(self):
+        '''Writes the records kept in memory if they have waited for the interval'''
+        if self.pending and time.time() >= self.last_flush+self.interval:
+            self.flush()
+
+    def start(self, launch):
+        '''Records the beginning of a launch
+
+        Arguments:
+            launch (:obj:`dict`): parameters of the launch
+
+        '''
+        record = dict(launch)
+        record['started'] = time.time()
+        self._write(record)
+        self.flush()
+
+    def resume(self):
+        '''Records that the launch was resumed'''
+        self._write({'resumed': time.time()})
+        self.flush()
+
+    def record(self, server, cmd_dict):
+        '''Records the result of a command
+
+        Arguments:
+            server (:obj:`str`): server where the command was executed
+            cmd_dict (:obj:`dict`): result of the command, as returned by
+                :meth:`RemoteMultiCommand.execute_command`
+
+        '''
+        self._write({
+            'server': server,
+            'command': cmd_dict['command'],
+            'access': cmd_dict['access'],
+            'result': cmd_dict['result'],
+            'output': cmd_dict['output'],
+            'timeout': cmd_dict['timeout'],
+            'timing': [cmd_dict['timing'][field] for field in TIMING_FIELDS]
+            })
+
+    def flush(self):
+        '''Writes the records kept in memory'''
+        if self.pending:
+            self.journal_file.write(''.join(self.pending))
+            self.pending = []
+            self.journal_file.flush()
+            if self.fsync:
+                os.fsync(self.journal_file.fileno())
+        self.last_flush = time.time()
+
+    def close(self):
+        '''Writes the records kept in memory and closes the journal'''
+        self.flush()
+        self.journal_file.close()
+
+
+def _to_str(value):
+    return value.encode(ENCODING) if isinstance(value, unicode) else value
+
+
+def read_journal(path):
+    '''Reads a journal
+
+    Lines that can not be parsed, as the last one of a journal cut short, are skipped.
+
+    Arguments:
+        path (:obj:`str`): path of the journal
+
+    Returns:
+        launch (:obj:`dict`): parameters of the launch, as recorded by :meth:`Journal.start`
+    Returns:
+        results (:obj:`generator`): server and result of each command recorded, in the
+            format returned by :meth:`RemoteMultiCommand.execute_command`
+
+    '''
+    journal_file = open(path, 'rb')
+    launch = None
+    for line in journal_file:
+        try:
+            launch = json.loads(line, encoding=ENCODING)
+            break
+        except ValueError:
+            continue
+    if launch is None or 'script' not in launch:
+        journal_file.close()
+        raise ValueError('Not a journal of a launch: '+path)
+    launch['script'] = [_to_str(cmd) for cmd in launch['script']]
+    launch['servers'] = [_to_str(server) for server in launch['servers']]
+    launch['output'] = _to_str(launch['output'])
+
+    def results():
+        with journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line, encoding=ENCODING)
+                except ValueError:
+                    continue
+                if 'server' not in record:
+                    continue
+                cmd_dict = OrderedDict()
+                cmd_dict['command'] = _to_str(record['command'])
+                cmd_dict['access'] = record['access']
+                cmd_dict['result'] = record['result']
+                cmd_dict['output'] = _to_str(record['output'])
+                cmd_dict['timeout'] = record['timeout']
+                cmd_dict['timing'] = OrderedDict(zip(TIMING_FIELDS, record['timing']))
+                yield _to_str(record['server']), cmd_dict
+    return launch, results()
@@ -0,0 +1,176 @@
+import socket
+import time
+from collections import OrderedDict
+
+# Phases timed in each result, besides its start and end timestamps
+PHASES = ('dns', 'connect', 'exec', 'close')
+
+
+class PhaseTimer(object):
+    '''Measures the phases of the execution of a command in a server
+
+    Arguments:
+        start(:obj:`float`, optional, *default* =None): timestamp when the execution started
+            (now if None)
+
+    '''
+    def __init__(self, start=None):
+        self.timing = OrderedDict()
+        self.timing['start'] = time.time() if start is None else start
+        for phase in PHASES:
+            self.timing[phase] = None
+        self.timing['end'] = None
+        self.phase_start = None
+        self.phase_name = None
+
+    def phase(self, name):
+        '''Returns a context manager timing the phase name
+
+        Arguments:
+            name (:obj:`str`): one of PHASES
+
+        '''
+        self.phase_name = name
+        return self
+
+    def __enter__(self):
+        self.phase_start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timing[self.phase_name] = time.time()-self.phase_start
+        self.timing['end'] = time.time()
+
+    def as_dict(self):
+        '''Returns the timing of the execution
+
+        Returns:
+            :obj:`OrderedDict`: start and end timestamps and the duration in seconds of each
+                phase (None for the phases not executed)
+
+        '''
+        if self.timing['end'] is None:
+            self.timing['end'] = time.time()
+        return self.timing
+
+
+def percentile(values, fraction):
+    '''Returns the value below which a fraction of the sorted values lie
+
+    Arguments:
+        values (:obj:`list`): sorted values
+        fraction (:obj:`float`): between 0 and 1
+
+    '''
+    if not values:
+        return None
+    return values[min(int(fraction*len(values)), len(values)-1)]
+
+
+class RunStats(object):
+    '''Aggregates the timing of the results of a launch
+
+    Arguments:
+        slowest(:obj:`int`, optional, *default* =5): number of slowest servers reported
+
+    '''
+    def __init__(self, slowest=5):
+        self.slowest = slowest
+        self.start = time.time()
+        self.end = None
+        self.server_time = {}
+        self.phase_time = dict((phase, 0.0) for phase in PHASES)
+        self.commands = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.busy_time = 0.0
+        self.capacity_time = 0.0
+
+    def add(self, server, cmd_dict):
+        '''Accounts the result of a command
+
+        Arguments:
+            server (:obj:`str`): server where the command was executed
+            cmd_dict (:obj:`dict`): result of the command, with its 'timing'
+
+        '''
+        timing = cmd_dict['timing']
+        elapsed = timing['end']-timing['start']
+        self.server_time[server] = self.server_time.get(server, 0.0)+elapsed
+        self.busy_time += elapsed
+        for phase in PHASES:
+            if timing[phase]:
+                self.phase_time[phase] += timing[phase]
+        self.commands += 1
+        if not cmd_dict['result']:
+            self.failures += 1
+        if cmd_dict['timeout']:
+            self.timeouts += 1
+
+    def add_capacity(self, num_of_workers, elapsed):
+        '''Accounts the time a number of workers were available
+
+        Arguments:
+            num_of_workers (:obj:`int`): workers available
+            elapsed (:obj:`float`): seconds they were available
+
+        '''
+        self.capacity_time += num_of_workers*elapsed
+
+    def summary(self):
+        '''Returns the statistics of the launch
+
+        Returns:
+            :obj:`OrderedDict`: number of servers, commands, failures and timeouts, elapsed
+                time, throughput in servers per second, 50th, 95th and 99th percentiles of
+                the time spent in each server, slowest servers, total time of each phase and
+                utilisation of the workers (fraction of their time spent in a server)
+
+        '''
+        if self.end is None:
+            self.end = time.time()
+        elapsed = self.end-self.start
+        times = sorted(self.server_time.values())
+        stats = OrderedDict()
+        stats['servers'] = len(self.server_time)
+        stats['commands'] = self.commands
+        stats['failures'] = self.failures
+        stats['timeouts'] = self.timeouts
+        stats['elapsed'] = elapsed
+        stats['throughput'] = len(self.server_time)/elapsed if elapsed else None
+        stats['p50'] = percentile(times, 0.50)
+        stats['p95'] = percentile(times, 0.95)
+        stats['p99'] = percentile(times, 0.99)
+        stats['slowest'] = sorted(self.server_time.items(), key=lambda item: -item[1])\
+                           [:self.slowest]
+        stats['phases'] = OrderedDict((phase, self.phase_time[phase]) for phase in PHASES)
+        stats['utilisation'] = self.busy_time/self.capacity_time if self.capacity_time \
+                               else None
+        return stats
+
+
+class StatsdSink(object):
+    '''Sends the statistics of each launch to a StatsD server as gauges
+
+    Can be given as the metrics_sink of a RemoteMultiCommand.
+
+    Arguments:
+        host(:obj:`str`, optional, *default* ='localhost'): StatsD server
+        port(:obj:`int`, optional, *default* =8125): StatsD port
+        prefix(:obj:`str`, optional, *default* ='remote_multicommand'): prefix of the metrics
+
+    '''
+    def __init__(self, host='localhost', port=8125, prefix='remote_multicommand'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, stats):
+        metrics = [(name, value) for name, value in stats.iteritems()
+                   if isinstance(value, (int, float)) and not isinstance(value, bool)]
+        metrics.extend(('phases.'+phase, value) for phase, value in stats['phases'].iteritems())
+        for name, value in metrics:
+            try:
+                self.sock.sendto(self.prefix+'.'+name+':'+str(value)+'|g', self.address)
+            except socket.error:
+                pass
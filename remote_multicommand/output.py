@@ -0,0 +1,197 @@
+import re
+import select
+import socket
+import time
+from collections import deque
+
+BUFFER_SIZE = 32768
+
+
+class OutputCapture(object):
+    '''Keeps a bounded copy of the output of a command while it is received
+
+    Only the first and the last bytes of the output are kept in memory, along with the
+    count of the bytes left out. The output can also be written to a file as it arrives.
+
+    Arguments:
+        max_bytes(:obj:`int`, optional, *default* =None): maximum number of bytes kept in
+            memory, half from the beginning and half from the end of the output (no limit
+            if None; nothing is kept if 0)
+        output_file(:obj:`file`, optional, *default* =None): file where the whole output
+            is written
+
+    '''
+    def __init__(self, max_bytes=None, output_file=None):
+        self.max_bytes = max_bytes
+        self.output_file = output_file
+        self.head = []
+        self.head_size = 0
+        self.tail = deque()
+        self.tail_size = 0
+        self.size = 0
+
+    def write(self, data):
+        '''Adds a chunk of output
+
+        Arguments:
+            data (:obj:`str`): chunk of output
+
+        '''
+        self.size += len(data)
+        if self.output_file:
+            self.output_file.write(data)
+        if self.max_bytes is None:
+            self.head.append(data)
+            return
+        head_max = self.max_bytes//2
+        if self.head_size < head_max:
+            kept = data[:head_max-self.head_size]
+            self.head.append(kept)
+            self.head_size += len(kept)
+            data = data[len(kept):]
+        tail_max = self.max_bytes-head_max
+        if data and tail_max:
+            self.tail.append(data[-tail_max:])
+            self.tail_size += len(self.tail[-1])
+            while self.tail_size-len(self.tail[0]) >= tail_max:
+                self.tail_size -= len(self.tail.popleft())
+
+    def getvalue(self):
+        '''Returns the output kept, with a note of the bytes left out if it was truncated'''
+        head = ''.join(self.head)
+        tail = ''.join(self.tail)
+        if self.max_bytes is not None:
+            tail = tail[max(0, len(tail)-(self.max_bytes-self.max_bytes//2)):]
+        truncated = self.size-len(head)-len(tail)
+        if truncated <= 0:
+            return head+tail
+        return head+'\n[... '+str(truncated)+' bytes truncated ...]\n'+tail
+
+
+class ScriptOutput(object):
+    '''Splits the standard output of a script by command while it is received
+
+    The script is the one sent by RemoteMultiCommand.execute_script, which marks the
+    beginning and the end of each command, with its exit status, in its output. The output of
+    each command is handed to its own capture, so it is bounded as the one of a single
+    command; a mark split between two chunks is held back until it is complete.
+
+    Arguments:
+        token (:obj:`str`): token of the marks of the script
+        num_of_cmds (:obj:`int`): number of commands of the script
+        new_capture (:obj:`callable`): returns the :class:`OutputCapture` of a command,
+            given its index in the script, when the command begins
+
+    '''
+    def __init__(self, token, num_of_cmds, new_capture):
+        self.token = token
+        self.num_of_cmds = num_of_cmds
+        self.new_capture = new_capture
+        self.captures = []
+        self.statuses = []
+        self.pending = ''
+
+    def write(self, data):
+        '''Adds a chunk of output of the script
+
+        Arguments:
+            data (:obj:`str`): chunk of output
+
+        '''
+        data = self.pending+data
+        while True:
+            index = len(self.statuses)
+            if len(self.captures) == index:
+                # Looking for the beginning of the next command
+                if index >= self.num_of_cmds:
+                    self.pending = ''
+                    return
+                mark = self.token+' '+str(index)+'\n'
+                begin = data.find(mark)
+                if begin < 0:
+                    self.pending = data[max(0, len(data)-len(mark)+1):]
+                    return
+                data = data[begin+len(mark):]
+                self.captures.append(self.new_capture(index))
+                continue
+            end = re.compile('\n'+self.token+' '+str(index)+r' (\d*)\n').search(data)
+            if end is None:
+                # The end mark, with an exit status of up to 3 digits, may be incomplete
+                held = len(data)-len(self.token)-len(str(index))-6
+                if held > 0:
+                    self.captures[index].write(data[:held])
+                    data = data[held:]
+                self.pending = data
+                return
+            self.captures[index].write(data[:end.start()])
+            self.statuses.append(end.group(1))
+            data = data[end.end():]
+
+    def steps(self, std_error):
+        '''Yields the result of each command run, once the whole output has been received
+
+        Arguments:
+            std_error (:obj:`str`): standard error of the script, which is the one of its
+                last command
+
+        Yields:
+            tuple containing whether each command run succeeded, its standard output (or its
+            standard error if it failed) and its exit status (None if it did not finish)
+
+        '''
+        for index, capture in enumerate(self.captures):
+            if index >= len(self.statuses):
+                # Interrupted
+                yield False, std_error or 'Script interrupted', None
+                return
+            if std_error and index+1 >= len(self.captures):
+                # The last command run wrote to the standard error
+                yield False, std_error, self.statuses[index]
+                return
+            yield True, capture.getvalue(), self.statuses[index]
+
+
+def stream_command(transport, cmd, stdout, stderr, timeout=20):
+    '''Executes a command handing its output to stdout and stderr as it arrives
+
+    Unlike RemoteServer.execute_cmd, the output is never held as a whole in memory, and the
+    server is not checked again before the command (which is already done when connecting).
+
+    Arguments:
+        transport (:obj:`paramiko.Transport`): transport of an open ssh connection
+        cmd (:obj:`str`): command
+        stdout (:obj:`OutputCapture`): receives the standard output
+        stderr (:obj:`OutputCapture`): receives the standard error
+        timeout (:obj:`int`, *default* = 20): maximum time waiting for data from the server
+
+    Returns:
+        ret (:obj:`bool`): True if command successfully executed (nothing written to the
+            standard error, as in RemoteServer.execute_cmd), False otherwise
+
+    '''
+    # Imported when needed, so importing the package stays fast
+    from paramiko import SSHException
+    try:
+        chan = transport.open_session()
+        chan.settimeout(timeout)
+        chan.exec_command(cmd)
+        last_data = time.time()
+        while True:
+            if chan.recv_ready():
+                stdout.write(chan.recv(BUFFER_SIZE))
+                last_data = time.time()
+            elif chan.recv_stderr_ready():
+                stderr.write(chan.recv_stderr(BUFFER_SIZE))
+                last_data = time.time()
+            elif chan.exit_status_ready():
+                break
+            elif time.time()-last_data > timeout:
+                raise socket.timeout('no data received in '+str(timeout)+' seconds')
+            else:
+                # The channel is only signaled by the standard output
+                select.select([chan], [], [], 0.1)
+        chan.close()
+    except (SSHException, socket.error) as ssh_error:
+        stderr.write('Socket Timeout: '+str(ssh_error))
+        return False
+    return stderr.size == 0
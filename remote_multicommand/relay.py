@@ -0,0 +1,370 @@
+import os
+import socket
+import threading
+import time
+import zlib
+import Queue
+from collections import OrderedDict
+from itertools import count
+from multiprocessing.connection import AuthenticationError, Listener, answer_challenge, \
+     deliver_challenge
+import _multiprocessing
+from .results import TIMING_FIELDS, dedup_output
+
+# Servers handed to a relay in each message
+SHARD_CHUNK = 256
+# Results sent back by a relay in each message, unless RESULTS_INTERVAL seconds pass first
+RESULTS_BATCH = 100
+RESULTS_INTERVAL = 0.5
+# Seconds to connect to a relay
+CONNECT_TIMEOUT = 10
+
+
+def parse_address(address):
+    '''Turns 'host:port' into the (host, port) address of a relay'''
+    if isinstance(address, basestring):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+def connect(address, authkey, timeout=CONNECT_TIMEOUT):
+    '''Returns a connection to a relay
+
+    Unlike multiprocessing.connection.Client, gives up at once if the relay refuses it.
+
+    Arguments:
+        address (:obj:`tuple`): host and port of the relay
+        authkey (:obj:`str`): key shared with the relay
+        timeout (:obj:`float`, *default* = CONNECT_TIMEOUT): maximum time to connect
+
+    '''
+    sock = socket.create_connection(address, timeout)
+    try:
+        sock.settimeout(None)
+        conn = _multiprocessing.Connection(os.dup(sock.fileno()))
+    finally:
+        sock.close()
+    try:
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+    except:
+        conn.close()
+        raise
+    return conn
+
+
+def pack_result(server, cmd_dict):
+    '''Turns the result of a command into a tuple, as sent by the relays'''
+    return (server, cmd_dict['command'], cmd_dict['access'], cmd_dict['result'],
+            cmd_dict['output'], cmd_dict['timeout'],
+            tuple(cmd_dict['timing'][field] for field in TIMING_FIELDS))
+
+
+def unpack_result(packed):
+    '''Turns a tuple sent by a relay back into the server and the result of a command'''
+    server, cmd, access, result, output, timeout, timing = packed
+    cmd_dict = OrderedDict()
+    cmd_dict['command'] = cmd
+    cmd_dict['access'] = access
+    cmd_dict['result'] = result
+    cmd_dict['output'] = output
+    cmd_dict['timeout'] = timeout
+    cmd_dict['timing'] = OrderedDict(zip(TIMING_FIELDS, timing))
+    return server, cmd_dict
+
+
+class RelayAgent(object):
+    '''Runs, near its servers, the launches handed by a controller
+
+    The relay listens for controllers and runs each launch with its own RemoteMultiCommand,
+    built from the ssh key and the options given here, as the servers of its shard arrive.
+    The results are sent back in batches as they finish, each distinct output only once if
+    the controller keeps them.
+
+    Arguments:
+        address (:obj:`tuple`): host and port where the relay listens (port 0 picks a free
+            one, found afterwards in self.address)
+        authkey (:obj:`str`): key shared with the controllers, required since the launches
+            received are unpickled
+        ssh_key (:obj:`str`): path of the ssh private key of the relay
+        kwargs: options of the RemoteMultiCommand of the relay
+
+    '''
+    def __init__(self, address, authkey, ssh_key, **kwargs):
+        from .remote_multicommand import RemoteMultiCommand
+        if not authkey:
+            # Without it, anyone reaching the relay could run code in it
+            raise ValueError('A relay needs an authkey to authenticate its controllers')
+        self.listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self.listener.address
+        self.rm_cmd = RemoteMultiCommand(ssh_key, **kwargs)
+        self.log = self.rm_cmd.log
+        self.jobs = count(1)
+
+    def serve_forever(self):
+        '''Serves the controllers, one launch at a time'''
+        try:
+            while True:
+                self.serve_once()
+        finally:
+            self.rm_cmd.close()
+            self.listener.close()
+
+    def serve_once(self):
+        '''Waits for a controller and runs its launch'''
+        try:
+            conn = self.listener.accept()
+        except (AuthenticationError, EOFError, IOError) as error:
+            self.log.error('Rejected a controller: '+str(error))
+            return
+        try:
+            self._run(conn)
+        except (EOFError, IOError) as error:
+            self.log.error('Lost the controller: '+str(error))
+        finally:
+            conn.close()
+
+    def _receive_servers(self, conn, servers):
+        '''Puts the servers sent by the controller in the queue servers, then None'''
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'end':
+                    break
+                for server in message[1]:
+                    servers.put(server)
+        except (EOFError, IOError):
+            pass
+        servers.put(None)
+
+    def _run(self, conn):
+        '''Runs the launch of a controller'''
+        _, job = conn.recv()
+        servers = Queue.Queue()
+        receiver = threading.Thread(target=self._receive_servers, args=(conn, servers))
+        receiver.daemon = True
+        receiver.start()
+        token = ('relay', next(self.jobs))
+        servers_list = iter(servers.get, None)
+        try:
+            if 'script' in job:
+                results = self.rm_cmd.iter_list_of_commands(job['script'], job['num_of_process'],
+                                                            servers_list, job['ssh_log_level'],
+                                                            job['reuse_connection'],
+                                                            output=job['output'],
+                                                            start=job.get('start'),
+                                                            as_script=job.get('as_script',
+                                                                              False))
+            else:
+                results = self.rm_cmd.iter_multicommand(job['cmd'], job['num_of_process'],
+                                                        servers_list, job['ssh_log_level'],
+                                                        output=job['output'])
+            batch = []
+            last_sent = time.time()
+            for server, cmd_dict in results:
+                if job.get('dedup', True):
+                    dedup_output(cmd_dict, token)
+                batch.append(pack_result(server, cmd_dict))
+                if len(batch) >= RESULTS_BATCH or time.time()-last_sent >= RESULTS_INTERVAL:
+                    conn.send(('results', batch))
+                    batch = []
+                    last_sent = time.time()
+            if batch:
+                conn.send(('results', batch))
+        except (EOFError, IOError):
+            raise
+        except Exception as error:
+            self.log.error('Launch failed: '+repr(error))
+            conn.send(('error', repr(error)))
+            return
+        conn.send(('done', self.rm_cmd.last_run_stats))
+
+
+class RelayFanout(object):
+    '''Hands the servers of a launch to relays and gathers their results
+
+    Arguments:
+        relays (:obj:`list`): addresses of the relays, as (host, port) or 'host:port'
+        authkey (:obj:`str`): key shared with the relays
+        relay_of (:obj:`callable`, optional, *default* =None): function returning the address
+            of the relay of a server, one of relays (a stable hash of the server if None)
+        log (:obj:`logging.Logger`, optional, *default* =None): logger of the errors
+
+    '''
+    def __init__(self, relays, authkey, relay_of=None, log=None):
+        self.relays = [parse_address(relay) for relay in relays]
+        self.indexes = dict((relay, index) for index, relay in enumerate(self.relays))
+        self.authkey = authkey
+        self.relay_of = relay_of
+        self.log = log
+
+    def _relay_index(self, server):
+        if self.relay_of is None:
+            return (zlib.crc32(server) & 0xffffffff) % len(self.relays)
+        return self.indexes[parse_address(self.relay_of(server))]
+
+    def run(self, job, servers, deadline=None):
+        '''Runs a launch in the relays
+
+        When the deadline is reached, the relays are left and the servers they have not
+        returned anything of yet, as well as the ones not handed to them yet, are reported
+        as timed out.
+
+        Arguments:
+            job (:obj:`dict`): launch, as run by :class:`RelayAgent`
+            servers (:obj:`iterable`): servers, consumed as they are handed to the relays
+            deadline (:obj:`float`, *default* = None): timestamp when the launch is given up
+
+        Yields:
+            ('result', packed result) for each result received, ('failed', server, reason)
+            for each server whose relay failed before returning any result, ('timeout',
+            server, reason) for each server given up at the deadline, and ('stats', relay,
+            statistics) for each relay finished
+
+        '''
+        events = Queue.Queue()
+        lock = threading.Lock()
+        conns = [None]*len(self.relays)
+        # Why each relay failed, and the servers it has not returned anything of yet
+        failures = [None]*len(self.relays)
+        pending = [set() for _ in self.relays]
+        for index, relay in enumerate(self.relays):
+            try:
+                conns[index] = connect(relay, self.authkey)
+                conns[index].send(('job', job))
+            except (AuthenticationError, EOFError, IOError) as error:
+                failures[index] = 'Cannot reach relay '+str(relay)+': '+str(error)
+                if self.log:
+                    self.log.error(failures[index])
+        readers = []
+        for index, conn in enumerate(conns):
+            if conn is not None:
+                reader = threading.Thread(target=self._receive, args=(index, conn, events))
+                reader.daemon = True
+                reader.start()
+                readers.append(reader)
+        feeder = threading.Thread(target=self._feed,
+                                  args=(servers, conns, failures, pending, lock, events))
+        feeder.daemon = True
+        feeder.start()
+        running = len(readers)+1
+        fed = False
+        try:
+            while running:
+                try:
+                    if deadline is None:
+                        event = events.get()
+                    else:
+                        event = events.get(True, max(deadline-time.time(), 0))
+                except Queue.Empty:
+                    for event in self._give_up(failures, pending, lock, events, fed):
+                        yield event
+                    return
+                if event[0] == 'results':
+                    with lock:
+                        for packed in event[2]:
+                            pending[event[1]].discard(packed[0])
+                    for packed in event[2]:
+                        yield 'result', packed
+                elif event[0] == 'failed':
+                    yield event
+                elif event[0] == 'fed':
+                    running -= 1
+                    fed = True
+                    if event[1] is not None:
+                        raise event[1]
+                else:
+                    running -= 1
+                    if event[0] == 'done':
+                        yield 'stats', self.relays[event[1]], event[2]
+                        continue
+                    with lock:
+                        failures[event[1]] = 'Relay '+str(self.relays[event[1]])+' failed: '+\
+                                             event[2]
+                        lost, pending[event[1]] = pending[event[1]], set()
+                    if self.log:
+                        self.log.error(failures[event[1]])
+                    for server in lost:
+                        yield 'failed', server, failures[event[1]]
+        finally:
+            for conn in conns:
+                if conn is not None:
+                    conn.close()
+
+    def _give_up(self, failures, pending, lock, events, fed):
+        '''Yields the servers left when the deadline is reached as timed out
+
+        The servers the feeder hands afterwards, until it is done unless fed is True, are
+        reported as failed by it, and the results still coming from the relays are ignored.
+
+        '''
+        reason = 'Run deadline reached'
+        if self.log:
+            self.log.error(reason+', leaving the relays')
+        with lock:
+            for index in range(len(failures)):
+                failures[index] = reason
+            lost = set().union(*pending)
+            for servers in pending:
+                servers.clear()
+        for server in lost:
+            yield 'timeout', server, reason
+        while not fed:
+            event = events.get()
+            if event[0] == 'failed':
+                yield ('timeout',)+event[1:] if event[2] == reason else event
+            elif event[0] == 'fed':
+                if event[1] is not None:
+                    raise event[1]
+                return
+
+    def _feed(self, servers, conns, failures, pending, lock, events):
+        '''Hands the servers to their relays in chunks'''
+        chunks = [[] for _ in conns]
+        try:
+            for server in servers:
+                index = self._relay_index(server)
+                with lock:
+                    failure = failures[index]
+                    if failure is None:
+                        pending[index].add(server)
+                if failure is not None:
+                    events.put(('failed', server, failure))
+                    continue
+                chunks[index].append(server)
+                if len(chunks[index]) >= SHARD_CHUNK:
+                    self._send(index, ('servers', chunks[index]), conns)
+                    chunks[index] = []
+        except Exception as error:
+            # Raised by the iterable of servers, the launch is aborted
+            events.put(('fed', error))
+            return
+        for index, chunk in enumerate(chunks):
+            if conns[index] is not None:
+                if chunk:
+                    self._send(index, ('servers', chunk), conns)
+                self._send(index, ('end',), conns)
+        events.put(('fed', None))
+
+    @staticmethod
+    def _send(index, message, conns):
+        # A relay lost is reported by its reader
+        try:
+            conns[index].send(message)
+        except (EOFError, IOError):
+            pass
+
+    @staticmethod
+    def _receive(index, conn, events):
+        '''Puts the messages of a relay in the queue events, until it finishes'''
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'results':
+                    events.put(('results', index, message[1]))
+                else:
+                    events.put((message[0], index, message[1]))
+                    return
+        except (EOFError, IOError) as error:
+            events.put(('error', index, 'connection lost '+str(error)))
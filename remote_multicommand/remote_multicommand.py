@@ -1,9 +1,145 @@
+import binascii
+import os
+import signal
 import time
-from collections import OrderedDict
+import threading
+import Queue
+import heapq
+import math
+from collections import OrderedDict, deque
 from copy import copy
+from itertools import count
 from loggers import Loggers
-from pathos.multiprocessing import ProcessingPool as Pool
-from ssh_paramiko import RemoteServer
+from .hosts import NOT_RESOLVED, resolve
+from .metrics import PhaseTimer, RunStats
+from .output import OutputCapture, ScriptOutput, stream_command
+from .journal import Journal, read_journal
+from .relay import RelayFanout, unpack_result
+from .results import OutputInterner, ResultStore, dedup_output, group_outputs
+from .transfer import PEER_COMMAND, download, file_sha1, map_file, peer_command, peer_timeout, \
+     remote_sha1, upload
+
+# Bytes of the standard error kept in memory when the output is not kept as a whole
+STDERR_MAX_BYTES = 65536
+# Default timeout of RemoteServer.execute_cmd
+COMMAND_TIMEOUT = 20
+# Shell code running a command of a script sent by execute_script, formatted with the
+# command, its index in the script and a random token. The standard error of the command is
+# captured through the file descriptor 3, opened on the standard output, with its exit
+# status appended; the script stops after a command writing to its standard error
+SCRIPT_STEP = '''printf '%%s %%d\\n' %(token)s %(index)d
+err=$( { %(cmd)s
+} 2>&1 1>&3 3>&-; printf '%%s%%d' %(token)s $? )
+status=${err##*%(token)s}; err=${err%%%(token)s*}
+printf '\\n%%s %%d %%s\\n' %(token)s %(index)d "$status"
+if [ -n "$err" ]; then printf '%%s' "$err" >&2; exit 1; fi
+'''
+# Tasks held back at most by the scheduler while it looks for tasks of groups below their cap
+MAX_HELD_TASKS = 10000
+# Seconds the scheduler waits beyond the timeouts of a task in a worker process before
+# abandoning it
+TIMEOUT_GRACE = 5
+
+
+# RemoteServer instances kept by each worker between tasks
+_worker_state = threading.local()
+# RemoteServer instances connected by each task, keyed by its server and command, used to
+# abandon hung threads
+_active_sessions = {}
+
+
+def _session_key(server, cmd):
+    '''Returns the key in _active_sessions of the task running cmd in server'''
+    return server, tuple(cmd) if isinstance(cmd, list) else cmd
+
+
+class CommandTimeout(Exception):
+    '''Raised in a worker when a connection or a command exceeds its timeout'''
+    pass
+
+
+class _Deadline(object):
+    '''Interrupts the block it guards after a number of seconds
+
+    Relies on SIGALRM, so it is only armed in the main thread of a process, as in the workers
+    of the process engine. Elsewhere the timeouts are enforced by the scheduler. The
+    interruption is not propagated: the expired attribute tells if it happened, even when
+    the code interrupted caught the exception.
+
+    Arguments:
+        seconds(:obj:`float`): timeout (the block is not guarded if None)
+
+    '''
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expired = False
+        self.finished = False
+        self.previous_handler = None
+
+    def _expire(self, signum, frame):
+        if not self.finished:
+            self.expired = True
+            raise CommandTimeout('Timed out after '+str(self.seconds)+' seconds')
+
+    def __enter__(self):
+        if self.seconds:
+            try:
+                self.previous_handler = signal.signal(signal.SIGALRM, self._expire)
+            except ValueError:
+                # Not the main thread
+                return self
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finished = True
+        if self.previous_handler is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous_handler)
+        return exc_type is not None and issubclass(exc_type, CommandTimeout)
+
+
+def _call(func, args):
+    '''Calls func in a worker, handing any exception back instead of raising it'''
+    try:
+        return True, func(*args)
+    except Exception as error:
+        return False, error
+
+
+def _call_seeded(func, args, host_cache, entry):
+    '''Calls func in a worker process, once its host cache knows what the parent knows of the
+    server of the task'''
+    if entry is not None:
+        host_cache.seed(args[0], entry)
+    return _call(func, args)
+
+
+class _TaskFeed(object):
+    '''Iterator of tasks that also accepts new tasks while it is being consumed
+
+    Pushed tasks are returned before the remaining initial ones, so servers already in
+    progress go on with their commands before new servers are started.
+
+    '''
+    def __init__(self, tasks):
+        self.pending = deque()
+        self.tasks = iter(tasks)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.pending:
+            return self.pending.popleft()
+        return next(self.tasks)
+
+    __next__ = next
+
+    def push(self, task):
+        '''Adds a task to be returned before the initial ones'''
+        self.pending.append(task)
+
 
 class RemoteMultiCommand(Loggers):
     '''Execute commands in parallel in remote servers
@@ -24,23 +160,274 @@ class RemoteMultiCommand(Loggers):
             in a DNS domain and/or has not its DNS name equals to its hostname, this flag must
             de set to False, otherwise this condition will be checked to certify we are trully
             connected to the right server.
+        engine(:obj:`str`, optional, *default* ='processes'): 'processes' runs each server in
+            a separated process; 'threads' runs them in threads of the current process, which
+            is much lighter when keeping hundreds or thousands of servers in flight, since
+            the ssh sessions spend most of their time waiting for the network (ValueError
+            is raised for any other value)
+        connect_timeout(:obj:`float`, optional, *default* =None): maximum time to connect and
+            authenticate in a server
+        command_timeout(:obj:`float`, optional, *default* =None): maximum time of the
+            execution of each command
+        run_timeout(:obj:`float`, optional, *default* =None): maximum time of each launch of
+            commands; the servers not finished by then are reported as timed out
+        metrics_sink(:obj:`callable`, optional, *default* =None): function called with the
+            statistics of each launch (see :class:`metrics.StatsdSink`)
+        remote_server_class(:obj:`type`, optional, *default* =RemoteServer): class used to
+            connect to the servers, which receives the ssh key and the remaining options; it
+            allows replacing the ssh connections by a simulation, as in the benchmarks
+        retry(:obj:`retry.RetryPolicy`, optional, *default* =None): how the servers whose
+            connection failed with a transient error are retried (never if None)
+        circuit_breaker(:obj:`retry.CircuitBreaker`, optional, *default* =None): gives up,
+            during each launch, the servers and subnets that keep failing to connect
+        relays(:obj:`list`, optional, *default* =None): addresses of :class:`relay.RelayAgent`
+            instances, as (host, port) or 'host:port'; if given, the servers are handed to
+            these relays, which run the commands with their own ssh key and options, instead
+            of being connected from here
+        relay_authkey(:obj:`str`, optional, *default* =None): key shared with the relays,
+            required with relays
+        relay_of(:obj:`callable`, optional, *default* =None): function returning the address
+            of the relay of a server, one of relays (the servers are spread by a stable hash
+            if None)
+        result_cache(:obj:`cache.ResultCache`, optional, *default* =None): cache of the
+            results of the read-only commands launched with use_cache
+        concurrency(:obj:`concurrency.AdaptiveConcurrency`, optional, *default* =None):
+            adjusts the number of servers in flight, up to num_of_process, to the connection
+            times and errors observed, and caps the servers in flight in each group
+        host_cache(:obj:`hosts.HostCache`, optional, *default* =None): addresses of the
+            servers, resolved in batches before they are connected, and whether their
+            hostname was verified; the servers that cannot be resolved fail without being
+            submitted, and the ones verified are connected by their address without checking
+            their hostname again
+
+    Servers exceeding a timeout get a result with 'timeout' set to True. If both
+    connect_timeout and command_timeout are set, a server still running after them is
+    abandoned, and its worker slot is given to the next server.
+
+    Each result carries in 'timing' the start and end timestamps of the command and the
+    duration of its phases: 'dns', 'connect' (including the authentication and the check of
+    the hostname), 'exec' and 'close'. The statistics of the last launch, as returned by
+    :meth:`metrics.RunStats.summary`, are kept in self.last_run_stats.
+
+    When the results of a launch are kept, equal outputs returned by several servers share a
+    single string, and each worker process sends a given output only once, referring to it by
+    its digest afterwards.
+    :func:`results.group_outputs` groups the servers by their output.
+
+    :meth:`push_file` and :meth:`pull_file` transfer files through SFTP sessions opened on
+    the ssh connections.
+
+    :meth:`launch_rolling_commands` runs a list of commands in growing waves of servers,
+    stopping when too many servers of a wave fail; how each wave went is kept in
+    self.last_rollout.
+
+    The workers are created on the first launch and reused by all the following
+    ones until :meth:`close` is called, which also happens when leaving a ``with`` block::
+
+        with RemoteMultiCommand('/tmp/sshkey') as rm_cmd:
+            rm_cmd.launch_list_of_commands(cmds_list, num_of_process, servers_list)
 
     '''
     def __init__(self, ssh_key, **kwargs):
         self.cmd = None
         self.ssh_key_path = ssh_key
-        self.servers_cmd_dict = {}
+        self.results = ResultStore()
         self.ssh_log_level = 'ERROR'
+        self.output = None
+        self.engine = kwargs.pop('engine', 'processes')
+        if self.engine not in ('processes', 'threads'):
+            raise ValueError('Invalid engine '+str(self.engine)+
+                             " (must be 'processes' or 'threads')")
+        self.connect_timeout = kwargs.pop('connect_timeout', None)
+        self.command_timeout = kwargs.pop('command_timeout', None)
+        self.run_timeout = kwargs.pop('run_timeout', None)
+        self.metrics_sink = kwargs.pop('metrics_sink', None)
+        self.remote_server_class = kwargs.pop('remote_server_class', None)
+        if self.remote_server_class is None:
+            # Imported when needed, as pathos, so importing the package stays fast
+            from ssh_paramiko import RemoteServer
+            self.remote_server_class = RemoteServer
+        self.retry = kwargs.pop('retry', None)
+        self.circuit_breaker = kwargs.pop('circuit_breaker', None)
+        self.relays = kwargs.pop('relays', None)
+        self.relay_authkey = kwargs.pop('relay_authkey', None)
+        if self.relays and not self.relay_authkey:
+            raise ValueError('The relays can only be used with a relay_authkey')
+        self.relay_of = kwargs.pop('relay_of', None)
+        self.result_cache = kwargs.pop('result_cache', None)
+        self.concurrency = kwargs.pop('concurrency', None)
+        self.host_cache = kwargs.pop('host_cache', None)
+        self.last_run_stats = None
+        self.last_rollout = None
+        # Deadline and statistics of the launch in progress
+        self._deadline = None
+        self._stats = None
+        # Outputs of the launch in progress, and its identifier as seen by the workers
+        self._outputs = None
+        self._dedup_token = None
+        # Journal of the launch in progress
+        self._journal = None
+        # File transferred by the launch in progress
+        self._transfer = None
         self.ssh_opt_args = kwargs
-        self.ssh = RemoteServer(self.ssh_key_path, **self.ssh_opt_args)
-        self.ssh.set_log_level(self.ssh_log_level)
+        self._pool = None
+        self._pool_size = 0
+        # Pools no longer given tasks, whose workers may be held by abandoned tasks
+        self._retired_pools = []
+        # Tasks in flight of the launch in progress, by identifier
+        self._in_flight = {}
+        self.ssh = self._remote_server()
         if 'logFolder' in kwargs:
             super(RemoteMultiCommand, self).__init__('RemoteMultiCommand',
                                                      log_folder=kwargs['log_folder'])
         else:
             super(RemoteMultiCommand, self).__init__('RemoteMultiCommand')
 
-    def execute_command(self, server):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getstate__(self):
+        # Only the configuration travels to the workers: the pool cannot be pickled, the
+        # results are not needed there and each worker keeps its own RemoteServer
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        state['_retired_pools'] = []
+        state['_in_flight'] = {}
+        state['results'] = None
+        state['ssh'] = None
+        state['metrics_sink'] = None
+        state['_stats'] = None
+        state['circuit_breaker'] = None
+        state['result_cache'] = None
+        state['concurrency'] = None
+        state['_journal'] = None
+        state['_outputs'] = None
+        state['_dedup_token'] = self._outputs.token if self._outputs is not None else None
+        return state
+
+    @property
+    def servers_cmd_dict(self):
+        '''Dictionary of the servers and the list of the results of their commands
+
+        Built from self.results, a :class:`results.ResultStore` which keeps the results
+        compactly and can look them up by server, command or status, on the first access,
+        and kept: the next accesses only add the results stored since then (see
+        :meth:`results.ResultStore.as_dict`). Changes made to the dictionary are kept in it
+        until self.results is replaced, as by :meth:`launch_list_of_commands`, but are not
+        made in self.results, and the dictionaries
+        returned by :meth:`launch_multicommand`, :meth:`push_file` and :meth:`pull_file` are
+        copies of the results, not shared with it. self.results.view() gives a read-only
+        view of the results without copying them.
+
+        '''
+        return self.results.as_dict()
+
+    @servers_cmd_dict.setter
+    def servers_cmd_dict(self, servers_cmd_dict):
+        self.results = ResultStore()
+        for server, results in servers_cmd_dict.iteritems():
+            for cmd_results in results:
+                self.results.add(server, cmd_results)
+
+    def close(self):
+        '''Terminates the workers
+
+        The workers are started again if another command is launched afterwards. If tasks
+        are still in flight, as the ones abandoned by the scheduler, the workers are
+        terminated without waiting for them.
+
+        '''
+        if self._in_flight or self._retired_pools:
+            self._terminate_pools()
+        elif self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            self._pool_size = 0
+        self._in_flight = {}
+
+    def _retire_pool(self):
+        '''Stops giving tasks to the current pool, which goes on with its tasks in flight
+
+        Its workers exit as their tasks finish, except the ones held by abandoned tasks,
+        which are terminated by :meth:`_terminate_pools`.
+
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._retired_pools.append(self._pool)
+            self._pool = None
+            self._pool_size = 0
+
+    def _terminate_pools(self, retired_only=False):
+        '''Terminates the retired pools, and the current one unless retired_only, without
+        waiting for their tasks
+
+        Arguments:
+            retired_only (:obj:`bool`, *default* = False): if True, the current pool is kept
+
+        '''
+        if not retired_only:
+            self._retire_pool()
+        for pool in self._retired_pools:
+            pool.terminate()
+            if self.engine == 'processes':
+                # The threads of the thread engine cannot be stopped, they are left to end
+                pool.join()
+        self._retired_pools = []
+
+    def _get_pool(self, num_of_process):
+        '''Returns the pool of workers, creating it if it is missing or too small
+
+        Arguments:
+            num_of_process (:obj:`int`): number of workers needed
+
+        '''
+        if self._pool_size < num_of_process:
+            self.close()
+            self.log.debug('Starting a pool of '+str(num_of_process)+' '+self.engine+'.')
+            if self.engine == 'threads':
+                from pathos.threading import _ThreadPool as ThreadPool
+                self._pool = ThreadPool(num_of_process)
+            else:
+                from pathos.multiprocessing import _ProcessPool as Pool
+                self._pool = Pool(num_of_process)
+            self._pool_size = num_of_process
+        return self._pool
+
+    def _remote_server(self, renew=False, server_has_dns=None):
+        '''Returns the RemoteServer instance of the calling worker
+
+        Each worker keeps its instance between tasks, so it is neither pickled with this
+        object nor rebuilt (loading the ssh key again) for every server.
+
+        Arguments:
+            renew (:obj:`bool`, *default* = False): replaces the current instance, which is
+                needed after a failed connection
+            server_has_dns (:obj:`bool`, *default* = None): overrides the server_has_dns
+                option of the instance (a separate instance is kept for each value)
+
+        '''
+        servers = _worker_state.__dict__.setdefault('servers', {})
+        opt_args = self.ssh_opt_args
+        if server_has_dns is not None and \
+           server_has_dns != opt_args.get('server_has_dns', True):
+            opt_args = dict(opt_args, server_has_dns=server_has_dns)
+        key = (self.remote_server_class, self.ssh_key_path, tuple(sorted(opt_args.items())))
+        if renew or key not in servers:
+            servers[key] = [self.remote_server_class(self.ssh_key_path, **opt_args), None]
+            if self.connect_timeout:
+                servers[key][0].ssh_time_out = self.connect_timeout
+        ssh, log_level = servers[key]
+        if log_level != self.ssh_log_level:
+            ssh.set_log_level(self.ssh_log_level)
+            servers[key][1] = self.ssh_log_level
+        return ssh
+
+    def execute_command(self, server, cmd=None):
         ''' Execute a command in a remote server
 
         Issues a command in the server and updates the dictionary self.servers_cmd_dict,
@@ -48,86 +435,1067 @@ class RemoteMultiCommand(Loggers):
 
         Arguments:
             server (:obj:`str`): server where the command will be executed
+            cmd (:obj:`str`, *default* = None): command to be executed (the command of the
+                current launch, self.cmd, if None)
 
         Returns:
             dictionary containing the server, the command executed, the result of the
             connection attempt and the result of the command issued
 
         '''
-        ret, output_msg = self.ssh.connect_server(server, False)
-        if ret:
-            cmd_ret, std_out, std_error = self.ssh.execute_cmd(self.cmd)
-            self.ssh.close_connection()
-            if cmd_ret:
-                std = std_out
+        return self._execute_command(server, self.cmd if cmd is None else cmd)
+
+    def copy_to_peer(self, server, cmd):
+        ''' Execute in a server holding the file of the current transfer the command copying it
+        to a peer
+
+        The copy prints nothing until it is done, so it is given the timeout of the transfer,
+        set from the size of the file, instead of self.command_timeout.
+
+        Arguments:
+            server (:obj:`str`): server holding the file
+            cmd (:obj:`str`): command copying the file, see :meth:`push_file`
+
+        Returns:
+            dictionary in the format returned by :meth:`execute_command`
+
+        '''
+        return self._execute_command(server, cmd, self._transfer['timeout'])
+
+    def _execute_command(self, server, cmd, command_timeout=None):
+        '''Executes a command in a remote server, see :meth:`execute_command`
+
+        Arguments:
+            server (:obj:`str`): server where the command will be executed
+            cmd (:obj:`str`): command to be executed
+            command_timeout (:obj:`float`, *default* = None): timeout of the command
+                (self.command_timeout if None)
+
+        '''
+        timer = PhaseTimer()
+        try:
+            ssh, ret, output_msg, timed_out = self._connect(server, timer, cmd)
+            if ret:
+                cmd_ret, std, timed_out = self._issue_command(ssh, server, cmd, timer,
+                                                              command_timeout)
+                self._disconnect(ssh, timed_out, timer)
             else:
-                self.log.error('Error executing command: "'+self.cmd+'" in server '+server
-                               +' :'+std_error)
-                std = std_error
-        else:
-            cmd_ret = ret
-            std = output_msg
-            if not output_msg == 'Host is not registered in DNS domain':
-                # Need to reinstantiate the class in this cases
-                self.ssh = RemoteServer(self.ssh_key_path, **self.ssh_opt_args)
-                self.ssh.set_log_level(self.ssh_log_level)
-                self.log.error('Cannot connect to server '+server+' :'+output_msg)
+                cmd_ret = ret
+                std = output_msg
+        finally:
+            _active_sessions.pop(_session_key(server, cmd), None)
+        return {server:self._dedup(self._result_dict(cmd, ret, cmd_ret, std, timed_out,
+                                                     timer.as_dict()))}
+
+    def execute_commands(self, server, cmds_list):
+        ''' Execute a sequence of commands in a remote server through a single connection
+
+        Opens one ssh session with the server, issues the commands in order and closes it
+        once. As in :meth:`launch_list_of_commands`, the commands following a failed one
+        are not issued.
+
+        Arguments:
+            server (:obj:`str`): server where the commands will be executed
+            cmds_list (:obj:`list`): commands to be executed
+
+        Returns:
+            dictionary containing the server and the list of the results of the commands
+            issued, each one in the format returned by :meth:`execute_command`
+
+        '''
+        timer = PhaseTimer()
+        try:
+            ssh, ret, output_msg, timed_out = self._connect(server, timer, cmds_list)
+            if not ret:
+                return {server:[self._dedup(self._result_dict(cmds_list[0], ret, ret,
+                                                              output_msg, timed_out,
+                                                              timer.as_dict()))]}
+            results = []
+            for cmd in cmds_list:
+                if results:
+                    # The connection is accounted in the timing of the first command only
+                    timer = PhaseTimer()
+                cmd_ret, std, timed_out = self._issue_command(ssh, server, cmd, timer)
+                results.append(self._dedup(self._result_dict(cmd, ret, cmd_ret, std, timed_out,
+                                                             timer.as_dict())))
+                if not cmd_ret:
+                    break
+            self._disconnect(ssh, timed_out, timer)
+        finally:
+            _active_sessions.pop(_session_key(server, cmds_list), None)
+        return {server:results}
+
+    def execute_script(self, server, cmds_list):
+        ''' Execute a sequence of commands in a remote server in a single round trip
+
+        The commands are sent together as one shell script (a POSIX shell is needed in the
+        server), which marks the beginning and the end of each command, with its exit
+        status, in the output. As in :meth:`execute_commands`, a command writing to its
+        standard error fails and the following ones are not run. The time spent running the
+        script is accounted in the timing of the first command. The output of each command is
+        split from the one of the script as it is received, and kept as for
+        :meth:`execute_commands`.
+
+        Arguments:
+            server (:obj:`str`): server where the commands will be executed
+            cmds_list (:obj:`list`): commands to be executed
+
+        Returns:
+            dictionary containing the server and the list of the results of the commands
+            run, each one in the format returned by :meth:`execute_command`
+
+        '''
+        timer = PhaseTimer()
+        try:
+            ssh, ret, output_msg, timed_out = self._connect(server, timer, cmds_list)
+            if not ret:
+                return {server:[self._dedup(self._result_dict(cmds_list[0], ret, ret,
+                                                              output_msg, timed_out,
+                                                              timer.as_dict()))]}
+            token = 'RMC'+binascii.hexlify(os.urandom(8))
+            script = 'exec 3>&1\n'+''.join(SCRIPT_STEP % {'cmd': cmd, 'index': index,
+                                                          'token': token}
+                                           for index, cmd in enumerate(cmds_list))
+            output_file = None
+            if self.output == 'file':
+                file_path = os.path.join(self.ssh_opt_args['log_folder'], server+'.output')
+                output_file = open(file_path, 'ab')
+            stdout = ScriptOutput(token, len(cmds_list),
+                                  lambda index: self._step_capture(cmds_list[index], output_file))
+            stderr = OutputCapture(STDERR_MAX_BYTES)
+            timeout = self.command_timeout or COMMAND_TIMEOUT
+            script_timeout = self.command_timeout*len(cmds_list) if self.command_timeout \
+                             else None
+            try:
+                with timer.phase('exec'), _Deadline(script_timeout) as deadline:
+                    stream_command(ssh.transport, script, stdout, stderr, timeout)
+            finally:
+                if output_file is not None:
+                    output_file.close()
+            timed_out = deadline.expired
+            std_error = stderr.getvalue()
+            if timed_out:
+                std_error = 'Script timed out after '+str(script_timeout)+' seconds'
+            results = []
+            for cmd, (cmd_ret, std, status) in zip(cmds_list, stdout.steps(std_error)):
+                if not cmd_ret:
+                    self.log.error('Error executing command: "'+cmd+'" in server '+server
+                                   +' (exit status '+str(status)+') :'+std)
+                elif self.output == 'file':
+                    std = file_path
+                elif self.output == 'discard':
+                    std = ''
+                results.append(self._dedup(self._result_dict(
+                    cmd, ret, cmd_ret, std, timed_out and not cmd_ret,
+                    timer.as_dict() if not results else PhaseTimer().as_dict())))
+            if not results:
+                results.append(self._dedup(self._result_dict(cmds_list[0], ret, False,
+                                                              std_error or 'Script not run',
+                                                              timed_out, timer.as_dict())))
+            self._disconnect(ssh, timed_out, timer)
+        finally:
+            _active_sessions.pop(_session_key(server, cmds_list), None)
+        return {server:results}
+
+    def _step_capture(self, cmd, output_file):
+        '''Returns the capture of the output of a command of a script, as set in self.output
+
+        Arguments:
+            cmd (:obj:`str`): command
+            output_file (:obj:`file`): file of the output of the server, if self.output is
+                'file'
+
+        '''
+        if self.output is None:
+            return OutputCapture()
+        if self.output == 'file':
+            output_file.write('# '+cmd+'\n')
+            return OutputCapture(0, output_file)
+        if self.output == 'discard':
+            return OutputCapture(0)
+        return OutputCapture(self.output)
+
+    def _connect(self, server, timer, cmd):
+        '''Connects to a server within self.connect_timeout
+
+        With self.host_cache, or without server_has_dns, the server is resolved once in the
+        'dns' phase and connected by its address, and a server that cannot be resolved fails
+        at once. Otherwise it is resolved by RemoteServer while connecting, as its hostname
+        is checked against its name. Once its hostname has been verified, the server is
+        connected by its address through an instance with server_has_dns disabled, which
+        does not check the hostname again at each connection and command.
+
+        Arguments:
+            server (:obj:`str`): server to connect to
+            timer (:obj:`metrics.PhaseTimer`): timer of the 'dns' and 'connect' phases
+            cmd (:obj:`str` or :obj:`list`): command or list of commands of the task, which
+                identify its session along with the server
+
+        Returns:
+            ssh (:obj:`RemoteServer`): instance of the calling worker used to connect
+        Returns:
+            ret (:obj:`bool`): True if successfully connected, False otherwise
+        Returns:
+            output_msg (:obj:`str`): message of error if cannot connect
+        Returns:
+            timed_out (:obj:`bool`): True if the connection exceeded its timeout
+
+        '''
+        address = server
+        verified = False
+        server_has_dns = self.ssh_opt_args.get('server_has_dns', True)
+        if self.host_cache is not None:
+            with timer.phase('dns'):
+                address, verified = self.host_cache.lookup(server)
+        elif not server_has_dns:
+            with timer.phase('dns'):
+                address = resolve(server)
+        verify = server_has_dns and not verified
+        ssh = self._remote_server(server_has_dns=False if verified else None)
+        _active_sessions[_session_key(server, cmd)] = ssh
+        if address is None:
+            # Failed before any connection attempt, the instance is still usable
+            self.log.error('Cannot connect to server '+server+' :'+NOT_RESOLVED)
+            return ssh, False, NOT_RESOLVED, False
+        if verify:
+            # The hostname is checked against the name of the server
+            address = server
+        with timer.phase('connect'):
+            with _Deadline(self.connect_timeout) as deadline:
+                ret, output_msg = ssh.connect_server(address, False)
+        if deadline.expired:
+            ret = False
+            output_msg = 'Connection timed out after '+str(self.connect_timeout)+' seconds'
+            ssh.ssh_client.close()
+        if not ret:
+            self._connection_failed(ssh, server, output_msg)
+        elif verify and self.host_cache is not None:
+            self.host_cache.verify(server)
+        return ssh, ret, output_msg, deadline.expired
+
+    def _disconnect(self, ssh, timed_out, timer):
+        '''Closes the connection of a worker
+
+        Arguments:
+            ssh (:obj:`RemoteServer`): instance of the calling worker
+            timed_out (:obj:`bool`): if the last command exceeded its timeout, in which case
+                the session can not be trusted anymore and the instance is replaced
+            timer (:obj:`metrics.PhaseTimer`): timer of the 'close' phase
+
+        '''
+        with timer.phase('close'):
+            if timed_out:
+                ssh.ssh_client.close()
+                self._remote_server(renew=True, server_has_dns=ssh.server_has_dns)
+            else:
+                ssh.close_connection()
+
+    def _issue_command(self, ssh, server, cmd, timer, command_timeout=None):
+        '''Issues a command through an open connection, handling its output as set in self.output
+
+        Arguments:
+            ssh (:obj:`RemoteServer`): instance connected to the server
+            server (:obj:`str`): server where the command will be executed
+            cmd (:obj:`str`): command to be executed
+            timer (:obj:`metrics.PhaseTimer`): timer of the 'exec' phase
+            command_timeout (:obj:`float`, *default* = None): timeout of the command
+                (self.command_timeout if None)
+
+        Returns:
+            cmd_ret (:obj:`bool`): True if command successfully executed, False otherwise
+        Returns:
+            std (:obj:`str`): what is kept of the standard output if the command succeeded,
+                the standard error otherwise
+        Returns:
+            timed_out (:obj:`bool`): True if the command exceeded its timeout
+
+        '''
+        command_timeout = command_timeout or self.command_timeout
+        timeout = command_timeout or COMMAND_TIMEOUT
+        with timer.phase('exec'), _Deadline(command_timeout) as deadline:
+            if self.output is None:
+                cmd_ret, std_out, std_error = ssh.execute_cmd(cmd, timeout)
+            else:
+                stderr = OutputCapture(STDERR_MAX_BYTES)
+                if self.output == 'file':
+                    file_path = os.path.join(self.ssh_opt_args['log_folder'], server+'.output')
+                    with open(file_path, 'ab') as output_file:
+                        output_file.write('# '+cmd+'\n')
+                        cmd_ret = stream_command(ssh.transport, cmd,
+                                                 OutputCapture(0, output_file), stderr, timeout)
+                    std_out = file_path
+                elif self.output == 'discard':
+                    cmd_ret = stream_command(ssh.transport, cmd, OutputCapture(0), stderr,
+                                             timeout)
+                    std_out = ''
+                else:
+                    stdout = OutputCapture(self.output)
+                    cmd_ret = stream_command(ssh.transport, cmd, stdout, stderr, timeout)
+                    std_out = stdout.getvalue()
+                std_error = stderr.getvalue()
+        if deadline.expired:
+            cmd_ret = False
+            std_error = 'Command timed out after '+str(command_timeout)+' seconds'
+        if cmd_ret:
+            return cmd_ret, std_out, False
+        self.log.error('Error executing command: "'+cmd+'" in server '+server+' :'+std_error)
+        return cmd_ret, std_error, deadline.expired
+
+    def _set_output(self, output):
+        '''Validates and sets how the output of the next commands will be handled
+
+        Arguments:
+            output (:obj:`int` or :obj:`str`): see :meth:`iter_multicommand`
+
+        '''
+        if output == 'file' and not self.ssh_opt_args.get('log_folder'):
+            raise ValueError('The output can only be written to files if log_folder is set')
+        if not (output is None or output in ('file', 'discard') or isinstance(output, int)):
+            raise ValueError('Invalid output option '+str(output))
+        self.output = output
+
+    def _connection_failed(self, ssh, server, output_msg):
+        '''Logs a failed connection and renews the RemoteServer instance when needed
+
+        Arguments:
+            ssh (:obj:`RemoteServer`): instance that could not connect
+            server (:obj:`str`): server that could not be reached
+            output_msg (:obj:`str`): error message returned by the connection attempt
+
+        '''
+        if not output_msg == 'Host is not registered in DNS domain':
+            # Need to reinstantiate the class in this cases
+            self._remote_server(renew=True, server_has_dns=ssh.server_has_dns)
+            self.log.error('Cannot connect to server '+server+' :'+output_msg)
+
+    @staticmethod
+    def _result_dict(cmd, access, result, output, timeout=False, timing=None):
+        '''Builds the dictionary describing the execution of a command in a server'''
         cmd_dict = OrderedDict()
-        cmd_dict['command'] = self.cmd
-        cmd_dict['access'] = ret
-        cmd_dict['result'] = cmd_ret
-        cmd_dict['output'] = std
-        return {server:cmd_dict}
+        cmd_dict['command'] = cmd
+        cmd_dict['access'] = access
+        cmd_dict['result'] = result
+        cmd_dict['output'] = output
+        cmd_dict['timeout'] = timeout
+        cmd_dict['timing'] = timing if timing is not None else PhaseTimer().as_dict()
+        return cmd_dict
+
+    def _dedup(self, cmd_dict):
+        '''Replaces the output of a result by a reference if this worker already sent it
+
+        Only done in the workers of the process engine, where the results are serialised.
+
+        '''
+        if self._dedup_token is not None:
+            dedup_output(cmd_dict, self._dedup_token)
+        return cmd_dict
+
+    def _abandon(self, server, cmd, output_msg, start=None):
+        '''Builds the result of a task given up by the scheduler
+
+        With the thread engine, the connection of the worker is closed, which unblocks it.
+
+        Arguments:
+            server (:obj:`str`): server of the task
+            cmd (:obj:`str` or :obj:`list`): command or list of commands of the task
+            output_msg (:obj:`str`): reason why the task was given up
+            start (:obj:`float`, *default* = None): timestamp when the task was submitted
+                (now if None, for tasks not started)
+
+        Returns:
+            the result of the task, in the format returned by the function of the task
+
+        '''
+        self.log.error('Server '+server+': '+output_msg)
+        ssh = _active_sessions.pop(_session_key(server, cmd), None)
+        if ssh is not None and self.engine == 'threads':
+            ssh.ssh_client.close()
+        return self._failed_task(server, cmd, output_msg, True, start)
+
+    def _skip(self, server, cmd, output_msg):
+        '''Builds the result of a task whose server was given up by the circuit breaker, or
+        is known not to be resolvable
+
+        Arguments:
+            server (:obj:`str`): server of the task
+            cmd (:obj:`str` or :obj:`list`): command or list of commands of the task
+            output_msg (:obj:`str`): reason why the server was given up
+
+        '''
+        self.log.error('Server '+server+': '+output_msg)
+        return self._failed_task(server, cmd, output_msg, False)
+
+    @classmethod
+    def _failed_task(cls, server, cmd, output_msg, timeout, start=None):
+        '''Builds the result of a task that could not connect to its server'''
+        cmd_dict = cls._result_dict(cmd[0] if isinstance(cmd, list) else cmd, False, False,
+                                    output_msg, timeout, PhaseTimer(start).as_dict())
+        return {server:[cmd_dict] if isinstance(cmd, list) else cmd_dict}
+
+    @staticmethod
+    def _connection_error(server_results):
+        '''Returns the message of the connection error of a task, or None if it connected'''
+        for results in server_results.itervalues():
+            cmd_dict = results[0] if isinstance(results, list) else results
+            if not cmd_dict['access']:
+                return cmd_dict['output']
+        return None
+
+    @staticmethod
+    def _connect_time(server_results):
+        '''Returns the seconds a task took to connect, or None if it is unknown'''
+        for results in server_results.itervalues():
+            cmd_dict = results[0] if isinstance(results, list) else results
+            return cmd_dict['timing']['connect']
+        return None
+
+    @staticmethod
+    def _check_window(num_of_process):
+        '''Raises ValueError if num_of_process does not let any server be processed'''
+        if num_of_process < 1:
+            raise ValueError('Invalid number of processes '+str(num_of_process)+
+                             ', at least one server must be processed at a time')
+
+    @staticmethod
+    def _next_task(tasks, delayed, held, control, max_held):
+        '''Returns the next task to submit and its number of retries
+
+        The tasks held back whose group has room come first, then the tasks whose retry is
+        due and then the new ones. New tasks of a group at its cap are held back, up to
+        max_held of them.
+
+        Returns:
+            :obj:`tuple`: the arguments of the task and its number of retries, or None if no
+                task can be submitted for now
+
+        '''
+        for group, group_tasks in held.iteritems():
+            if control.has_room(group):
+                args, attempt = group_tasks.popleft()
+                if not group_tasks:
+                    del held[group]
+                return args, attempt
+        if delayed and delayed[0][0] <= time.time():
+            _, _, args, attempt = heapq.heappop(delayed)
+            group = control.group(args[0]) if control is not None else None
+            if group is None or control.has_room(group):
+                return args, attempt
+            held.setdefault(group, deque()).append((args, attempt))
+        num_of_held = sum(len(group_tasks) for group_tasks in held.itervalues())
+        while num_of_held < max_held:
+            args = next(tasks, None)
+            if args is None:
+                return None
+            group = control.group(args[0]) if control is not None else None
+            if group is None or control.has_room(group):
+                return args, 0
+            held.setdefault(group, deque()).append((args, 0))
+            num_of_held += 1
+        return None
+
+    def _task_timeout(self, num_of_cmds, command_timeout=None):
+        '''Returns how long the scheduler waits for a task before abandoning it
+
+        Arguments:
+            num_of_cmds (:obj:`int`): number of commands issued by the task
+            command_timeout (:obj:`float`, *default* = None): timeout of each command
+                (self.command_timeout if None)
+
+        '''
+        if not (self.connect_timeout and self.command_timeout):
+            return None
+        task_timeout = self.connect_timeout+num_of_cmds*(command_timeout or self.command_timeout)
+        if self.engine == 'processes':
+            # The workers enforce the timeouts themselves, the scheduler is only a fallback
+            task_timeout += TIMEOUT_GRACE
+        return task_timeout
+
+    def _sliding_window(self, func, tasks, num_of_process, task_timeout=None):
+        '''Runs func over a sequence of tasks keeping num_of_process of them in flight
+
+        A new task is submitted as soon as any running one finishes, so a slow or hung
+        server only holds its own worker instead of stalling a whole batch of servers.
+
+        Tasks running for more than task_timeout are abandoned and their slots are given to
+        the next tasks. When the deadline of the launch is reached, the tasks in flight and
+        the ones not started yet are reported as timed out. With the process engine, the
+        workers held by abandoned tasks are terminated: the pool is replaced as soon as a task
+        is abandoned, and terminated once the tasks it still runs are done.
+
+        Tasks whose connection failed with a transient error are submitted again after the
+        backoff of self.retry, while their slots go to the next tasks, and the servers given
+        up by self.circuit_breaker, as well as the ones self.host_cache could not resolve, are
+        reported as failed without being submitted.
+
+        With self.concurrency, the number of calls running at the same time is the limit it
+        sets, up to num_of_process, and the tasks of a group at its cap are held back while
+        the following ones are submitted.
+
+        Arguments:
+            func (:obj:`callable`): function executed in the workers
+            tasks (:obj:`iterable`): tuples with the server and the command (or list of
+                commands) of each call of func
+            num_of_process (:obj:`int`): maximum number of calls running at the same time
+            task_timeout (:obj:`float`, *default* = None): maximum time of each call
+
+        Yields:
+            the value returned by each call of func, in completion order
+
+        '''
+        self._check_window(num_of_process)
+        pool = self._get_pool(num_of_process)
+        done = Queue.Queue()
+        tasks = iter(tasks)
+        task_ids = count()
+        # Arguments, deadline, submission time and number of retries of each task in flight
+        running = {}
+        # Tasks waiting to be retried, by the time they can be submitted again
+        delayed = []
+        # Tasks held back because their group is at its cap, with their number of retries,
+        # by group
+        held = OrderedDict()
+        control = self.concurrency
+        if control is not None:
+            control.begin()
+        deadline = self._deadline
+        if deadline is None and self.run_timeout:
+            deadline = time.time()+self.run_timeout
+        hosts = self.host_cache
+        breaker = self.circuit_breaker
+        if breaker is not None and self._stats is None:
+            # A launch of its own, not a command of launch_list_of_commands
+            breaker.reset()
+        stats = self._stats if self._stats is not None else RunStats()
+        outputs = self._outputs
+        window_start = time.time()
+        self._in_flight = running
+        try:
+            while True:
+                if deadline is not None and time.time() >= deadline:
+                    for args, _, task_start, _ in running.values():
+                        yield self._account(stats, self._abandon(
+                            *(args+('Run deadline reached', task_start))))
+                    for _, _, args, _ in delayed:
+                        yield self._account(stats, self._abandon(
+                            *(args+('Run deadline reached',))))
+                    for group_tasks in held.itervalues():
+                        for args, _ in group_tasks:
+                            yield self._account(stats, self._abandon(
+                                *(args+('Run deadline reached',))))
+                    for args in tasks:
+                        yield self._account(stats, self._abandon(
+                            *(args+('Run deadline reached',))))
+                    return
+                limit = num_of_process
+                if control is not None:
+                    limit = max(min(num_of_process, control.limit()), 1)
+                while len(running) < limit:
+                    args = self._next_task(tasks, delayed, held, control, MAX_HELD_TASKS)
+                    if not args:
+                        # No new tasks, or only tasks held back or waiting to be retried
+                        break
+                    args, attempt = args
+                    reason = breaker.is_open(args[0]) if breaker is not None else None
+                    if not reason and hosts is not None and hosts.unresolvable(args[0]):
+                        reason = NOT_RESOLVED
+                    if reason:
+                        yield self._account(stats, self._skip(*(args+(reason,))))
+                        continue
+                    if control is not None:
+                        control.started(control.group(args[0]))
+                    task_id = next(task_ids)
+                    if hosts is not None and self.engine == 'processes':
+                        # The worker process does not share the host cache of this one
+                        call = _call_seeded, (func, args, hosts, hosts.entry(args[0]))
+                    else:
+                        call = _call, (func, args)
+                    pool.apply_async(*call,
+                                     callback=lambda result, task_id=task_id: done.put((task_id,
+                                                                                       result)))
+                    task_start = time.time()
+                    running[task_id] = (args, task_start+task_timeout if task_timeout else None,
+                                        task_start, attempt)
+                if not running and not delayed and not held:
+                    break
+                deadlines = [task_deadline for _, task_deadline, _, _ in running.values()
+                             if task_deadline is not None]
+                if deadline is not None:
+                    deadlines.append(deadline)
+                if delayed:
+                    deadlines.append(delayed[0][0])
+                journal = self._journal
+                if journal is not None and journal.due() is not None:
+                    # The records kept in memory are written while waiting for results
+                    deadlines.append(journal.due())
+                try:
+                    if deadlines:
+                        task_id, (success, result) = done.get(True,
+                                                              max(min(deadlines)-time.time(), 0))
+                    else:
+                        task_id, (success, result) = done.get()
+                except Queue.Empty:
+                    if journal is not None:
+                        journal.flush_due()
+                    now = time.time()
+                    for task_id, (args, task_deadline, task_start, _) in running.items():
+                        if task_deadline is not None and now >= task_deadline:
+                            del running[task_id]
+                            if self.engine == 'processes' and self._pool is pool:
+                                # The abandoned task may hold its worker for good: the next
+                                # tasks go to a new pool
+                                self._retire_pool()
+                                pool = self._get_pool(num_of_process)
+                            if breaker is not None:
+                                breaker.record(args[0], False)
+                            if control is not None:
+                                control.finished(control.group(args[0]), False)
+                            yield self._account(stats, self._abandon(
+                                *(args+('Timed out after '+str(task_timeout)+' seconds',
+                                        task_start))))
+                    continue
+                if success and outputs is not None:
+                    # Also done for late results, which may hold outputs referenced later
+                    outputs.resolve(result)
+                if task_id not in running:
+                    # Late result of an abandoned task
+                    continue
+                args, _, _, attempt = running.pop(task_id)
+                if not success:
+                    raise result
+                error = self._connection_error(result)
+                if control is not None:
+                    control.finished(control.group(args[0]), error is None,
+                                     self._connect_time(result))
+                retrying = error is not None and self.retry is not None and \
+                           self.retry.should_retry(error, attempt)
+                if breaker is not None:
+                    breaker.record(args[0], error is None, retrying)
+                    retrying = retrying and not breaker.is_open(args[0])
+                if hosts is not None and error is None and \
+                   self.ssh_opt_args.get('server_has_dns', True):
+                    # Also known to this process when the worker is another one
+                    hosts.verify(args[0])
+                if retrying:
+                    retry_delay = self.retry.delay(attempt)
+                    self.log.info('Retrying server '+args[0]+' in '+str(round(retry_delay, 3))+
+                                  ' seconds ('+str(attempt+1)+'/'+str(self.retry.retries)+')')
+                    heapq.heappush(delayed, (time.time()+retry_delay, next(task_ids), args,
+                                             attempt+1))
+                    continue
+                yield self._account(stats, result)
+        finally:
+            if running and self.engine == 'processes':
+                # Abandoned, or not waited for, the tasks in flight still hold their workers
+                self._terminate_pools()
+            elif self._retired_pools:
+                self._terminate_pools(retired_only=True)
+            stats.add_capacity(num_of_process, time.time()-window_start)
+            if stats is not self._stats:
+                self._finish_stats(stats)
+
+    @staticmethod
+    def _account(stats, server_results):
+        '''Adds the results of a task to the statistics of the launch and returns them'''
+        for server, results in server_results.iteritems():
+            for cmd_results in (results if isinstance(results, list) else [results]):
+                stats.add(server, cmd_results)
+        return server_results
 
-    def launch_multicommand(self, cmd, num_of_process, servers_list, ssh_log_level='CRITICAL'):
+    def _finish_stats(self, stats):
+        '''Publishes the statistics of a launch in self.last_run_stats and self.metrics_sink'''
+        self.last_run_stats = stats.summary()
+        self.log.debug('Statistics of the launch: '+str(self.last_run_stats))
+        if self.metrics_sink:
+            self.metrics_sink(self.last_run_stats)
+
+    def _store_result(self, server, cmd_results):
+        '''Appends the result of a command to self.results and to the journal, if any'''
+        self.results.add(server, cmd_results)
+        if self._journal is not None:
+            self._journal.record(server, cmd_results)
+
+    def iter_multicommand(self, cmd, num_of_process, servers_list, ssh_log_level='CRITICAL',
+                          keep_results=False, output=None, use_cache=False, refresh=False):
+        '''Executes the command in a list of servers, yielding each result as soon as it is ready
+
+        The servers are consumed from servers_list only when a worker is available, so it can
+        be any iterable, including a generator reading them from a file.
+
+        Arguments:
+            cmd (:obj:`str`): command to be executed in each server of the list
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
+            servers_list (:obj:`iterable`): servers list
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            keep_results (:obj:`bool`, *default* = False): if True, the results are also
+                appended to self.results
+            output (:obj:`int` or :obj:`str`, *default* = None): how the standard output of
+                the command is handled. None keeps it as a whole; an int is the maximum
+                number of bytes kept, taken from its beginning and its end; 'file' writes it
+                to <log_folder>/<server>.output and keeps the path of this file; 'discard'
+                does not keep it. Except for None, the output is read as it arrives and is
+                never held as a whole in memory
+            use_cache (:obj:`bool`, *default* = False): if True, the command is read-only:
+                the servers with a valid result in self.result_cache get it without being
+                connected, and the new successful results are kept there. Only allowed when
+                output is None
+            refresh (:obj:`bool`, *default* = False): if True, with use_cache, all the
+                servers are connected and their results replace the ones in the cache
+
+        Yields:
+            tuple containing the server and the dictionary with the result of the command, in
+            the format returned by :meth:`execute_command`, in completion order
+
+        '''
+        self.ssh_log_level = ssh_log_level
+        cache = self.result_cache if use_cache else None
+        if use_cache and (cache is None or output is not None):
+            raise ValueError('The results can only be cached with a result_cache and the '
+                             'whole output')
+        # Results answered by the cache, yielded along with the ones of the servers connected
+        cached = deque()
+        if cache is not None and not refresh:
+            servers_list = self._filter_cached(cmd, servers_list, cached)
+        if self.relays:
+            results = self._iter_relayed({'cmd': cmd, 'num_of_process': num_of_process,
+                                          'ssh_log_level': ssh_log_level, 'output': output},
+                                         servers_list)
+        else:
+            self._set_output(output)
+            self.cmd = cmd
+            tasks = ((server, cmd) for server in self._resolved(servers_list))
+            results = self._iter_tasks(self._sliding_window(self.execute_command, tasks,
+                                                            num_of_process,
+                                                            self._task_timeout(1)))
+        for server, cmd_results, hit in self._with_cached(self._interned(results,
+                                                                         keep_results),
+                                                          cached):
+            if cache is not None and not hit:
+                cache.put(server, cmd_results)
+            if keep_results:
+                self._store_result(server, cmd_results)
+            yield server, cmd_results
+        if cache is not None:
+            cache.sync()
+
+    def _filter_cached(self, cmd, servers_list, cached):
+        '''Yields the servers without a valid result of cmd in self.result_cache
+
+        The results found are appended to cached, as tuples of the server and the result.
+
+        '''
+        for server in servers_list:
+            cmd_results = self.result_cache.get(server, cmd)
+            if cmd_results is None:
+                yield server
+            else:
+                cached.append((server, cmd_results))
+
+    def _interned(self, results, keep_results):
+        '''Yields the results of a launch, interning their outputs if they are kept
+
+        The outputs are only interned, and each worker process sends a given output only once,
+        when the results are kept: otherwise every distinct output would be held until the end
+        of the launch, making the memory grow with the number of servers.
+
+        '''
+        interning = keep_results and self._outputs is None
+        if interning:
+            self._outputs = OutputInterner()
+        try:
+            for result in results:
+                yield result
+        finally:
+            if interning:
+                self._outputs = None
+
+    @staticmethod
+    def _with_cached(results, cached):
+        '''Yields the results of the servers connected and the ones found in the cache
+
+        Yields:
+            tuple containing the server, the dictionary with the result and whether it was
+            found in the cache
+
+        '''
+        for server, cmd_results in results:
+            while cached:
+                yield cached.popleft()+(True,)
+            yield server, cmd_results, False
+        while cached:
+            yield cached.popleft()+(True,)
+
+    def _resolved(self, servers_list):
+        '''Returns the servers list, resolved in batches ahead of the workers with self.host_cache
+
+        The servers that cannot be resolved are then reported as failed by the scheduler
+        without using a worker.
+
+        '''
+        if self.host_cache is None:
+            return servers_list
+        return self.host_cache.resolve_ahead(servers_list)
+
+    @staticmethod
+    def _iter_tasks(tasks_results):
+        '''Yields the server and the result of each command from the results of the tasks'''
+        for server_results in tasks_results:
+            for server, cmd_results in server_results.iteritems():
+                yield server, cmd_results
+
+    def _iter_relayed(self, job, servers_list):
+        '''Runs a launch through the relays
+
+        The servers the relays have not returned anything of when the deadline of the launch
+        is reached are reported as timed out.
+
+        Arguments:
+            job (:obj:`dict`): launch, as run by :class:`relay.RelayAgent`
+            servers_list (:obj:`iterable`): servers list
+
+        Yields:
+            tuple containing the server and the dictionary with the result of each command
+            issued, in the format returned by :meth:`execute_command`
+
+        '''
+        self._check_window(job['num_of_process'])
+        fanout = RelayFanout(self.relays, self.relay_authkey, self.relay_of, self.log)
+        first_cmd = job['script'][0] if 'script' in job else job['cmd']
+        stats = self._stats if self._stats is not None else RunStats()
+        outputs = self._outputs
+        # The relays send each output once only if this process keeps them
+        job = dict(job, dedup=outputs is not None)
+        start = time.time()
+        deadline = self._deadline
+        if deadline is None and self.run_timeout:
+            deadline = start+self.run_timeout
+        try:
+            for event in fanout.run(job, servers_list, deadline):
+                if event[0] == 'stats':
+                    self.log.debug('Statistics of relay '+str(event[1])+': '+str(event[2]))
+                    continue
+                if event[0] == 'result':
+                    server, cmd_results = unpack_result(event[1])
+                else:
+                    server = event[1]
+                    cmd_results = self._result_dict(first_cmd, False, False, event[2],
+                                                    event[0] == 'timeout')
+                if outputs is not None:
+                    outputs.resolve({server:cmd_results})
+                self._account(stats, {server:cmd_results})
+                yield server, cmd_results
+        finally:
+            stats.add_capacity(job['num_of_process']*len(self.relays), time.time()-start)
+            if stats is not self._stats:
+                self._finish_stats(stats)
+
+    def launch_multicommand(self, cmd, num_of_process, servers_list, ssh_log_level='CRITICAL',
+                            on_result=None, output=None, group_output=False, use_cache=False,
+                            refresh=False):
         '''Launches several processes that execute the command in a list of servers
 
         Arguments:
             cmd (:obj:`str`): command to be executed in each server of the list
-            num_of_process (:obj:`int`): number of separated process launched in each iteration
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
             servers_list (:obj:`list`): servers list
             ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
                 Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with its result as soon as each server finishes
+            output (:obj:`int` or :obj:`str`, *default* = None): how the standard output of
+                the command is handled (see :meth:`iter_multicommand`)
+            group_output (:obj:`bool`, *default* = False): if True, the servers are returned
+                grouped by their output (see :func:`results.group_outputs`)
+            use_cache (:obj:`bool`, *default* = False): if True, the command is read-only and
+                its results are taken from and kept in self.result_cache (see
+                :meth:`iter_multicommand`)
+            refresh (:obj:`bool`, *default* = False): if True, with use_cache, the results in
+                the cache are replaced instead of used
 
         Returns:
-            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the result of
-                the command
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and a copy of
+                the result of the command (see :attr:`servers_cmd_dict`), or the distinct
+                outputs and the servers that returned each one if group_output is True
 
         '''
-        self.ssh_log_level = ssh_log_level
-        cmd_servers_dict = {}
+        self._check_window(num_of_process)
+        first = len(self.results)
         num_of_servers = len(servers_list)
         if num_of_process > num_of_servers:
-            num_of_process = num_of_servers
-        numb_of_iterations, servers_left = divmod(num_of_servers, num_of_process)
+            num_of_process = max(num_of_servers, 1)
         start = time.time()
         counter = 0
-        self.cmd = cmd
-        self.log.info('Processing in the '+str(num_of_servers)+' servers will be done in '
-                      +str(numb_of_iterations+(0 if servers_left == 0 else 1))+' iterations.')
-        for iter_num in range(0, num_of_servers, num_of_process):
-            self.log.debug('Processing '+str(len(servers_list[iter_num:iter_num+(num_of_process)]))
-                           +' servers in this iteration.')
-            self.log.debug('Servers: '+str(servers_list[iter_num:iter_num+(num_of_process)]))
-            pool = Pool(num_of_process)
-            result = pool.map(self.execute_command,
-                              servers_list[iter_num:iter_num+(num_of_process)])
-            for server_results in result:
-                for server, cmd_results in server_results.iteritems():
-                    cmd_servers_dict[server] = cmd_results
-                    if not server in self.servers_cmd_dict:
-                        self.servers_cmd_dict[server] = []
-                    self.servers_cmd_dict[server].append(cmd_results)
-            counter = counter+num_of_process
+        self.log.info('Processing the '+str(num_of_servers)+' servers keeping '
+                      +str(num_of_process)+' of them in flight.')
+        self.log.debug('Servers: '+str(servers_list))
+        for server, cmd_results in self.iter_multicommand(cmd, num_of_process, servers_list,
+                                                          ssh_log_level, keep_results=True,
+                                                          output=output, use_cache=use_cache,
+                                                          refresh=refresh):
+            if on_result:
+                on_result(server, cmd_results)
+            counter = counter+1
             servers_to_process = num_of_servers - counter
             if not servers_to_process <= 0:
-                self.log.debug('Still has '+str(num_of_servers-counter)+' servers to process...')
+                self.log.debug('Still has '+str(servers_to_process)+' servers to process...')
         self.log.info("It took "+str(round(time.time()-start, 3))+" seconds to execute command '"
                       +cmd+"' in all "+str(num_of_servers)+" servers.")
+        cmd_servers_dict = self.results.snapshot(first, single=True)
+        if group_output:
+            return group_outputs(cmd_servers_dict)
         return cmd_servers_dict
 
+    @staticmethod
+    def _parse_script(script_cmds):
+        '''Turns a script into a list of commands
+
+        Arguments:
+            script_cmds (:obj:`str` or :obj:`list`): list or string containing the commands
+                (interprets ";", new line character and comments)
+
+        Returns:
+            cmds_list (:obj:`list`): commands, without empty and commented lines
+
+        '''
+        if type(script_cmds).__name__ != 'list':
+            # Turn script_cmds into a list
+            script_cmds = script_cmds.replace(';', '\n')
+            cmds_list = script_cmds.split('\n')
+        else:
+            cmds_list = script_cmds
+        # Filter null elements and commented lines
+        cmds_list = filter(lambda x: x, cmds_list)
+        cmds_list = filter(lambda x: x[0] != '#', cmds_list)
+        return cmds_list
+
+    def _iter_per_server(self, cmds_list, num_of_process, servers_list, start=None,
+                         as_script=False):
+        '''Executes the whole list of commands in each server with a single task
+
+        Arguments:
+            cmds_list (:obj:`list`): commands to be executed
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
+            servers_list (:obj:`iterable`): servers list
+            start (:obj:`dict`, *default* = None): index of the first command of the servers
+                not starting with the first one
+            as_script (:obj:`bool`, *default* = False): if True, the commands are sent as a
+                single script (see :meth:`execute_script`)
+
+        Yields:
+            tuple containing the server and the result of each command issued
+
+        '''
+        start = start or {}
+        tasks = ((server, cmds_list[start.get(server, 0):])
+                 for server in self._resolved(servers_list))
+        func = self.execute_script if as_script else self.execute_commands
+        for server_results in self._sliding_window(func, tasks, num_of_process,
+                                                   self._task_timeout(len(cmds_list))):
+            for server, results in server_results.iteritems():
+                if not results[-1]['result']:
+                    self.log.error('Command "'+results[-1]['command']+'" returned error. '
+                                   'Removing server '+server+' from execution list')
+                for cmd_results in results:
+                    yield server, cmd_results
+
+    def _iter_pipelined(self, cmds_list, num_of_process, servers_list, start=None):
+        '''Executes the list of commands letting each server progress on its own
+
+        Every successful command queues the next command of the same server, so the servers
+        are not synchronized at each command of the list.
+
+        Arguments:
+            cmds_list (:obj:`list`): commands to be executed
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
+            servers_list (:obj:`iterable`): servers list
+            start (:obj:`dict`, *default* = None): index of the first command of the servers
+                not starting with the first one
+
+        Yields:
+            tuple containing the server and the result of each command issued
+
+        '''
+        # Index of the last command issued, only for the servers still in progress
+        issued = {}
+        start = start or {}
+
+        def first_tasks():
+            for server in self._resolved(servers_list):
+                index = start.get(server, 0)
+                if index:
+                    issued[server] = index
+                yield server, cmds_list[index]
+        feed = _TaskFeed(first_tasks())
+        for server_results in self._sliding_window(self.execute_command, feed, num_of_process,
+                                                   self._task_timeout(1)):
+            for server, cmd_results in server_results.iteritems():
+                index = issued.pop(server, 0)+1
+                if not cmd_results['result']:
+                    self.log.error('Command "'+cmd_results['command']+'" returned error. '
+                                   'Removing server '+server+' from execution list')
+                elif index < len(cmds_list):
+                    issued[server] = index
+                    feed.push((server, cmds_list[index]))
+                yield server, cmd_results
+
+    def iter_list_of_commands(self, script_cmds, num_of_process, servers_list,
+                              ssh_log_level='CRITICAL', reuse_connection=False,
+                              keep_results=False, output=None, start=None, as_script=False):
+        '''Executes a sequence of commands in a list of servers, yielding each result when ready
+
+        Each server goes on with its next command as soon as the previous one succeeds there
+        (as in the pipeline mode of :meth:`launch_list_of_commands`), and the servers are
+        consumed from servers_list only when a worker is available.
+
+        Arguments:
+            script_cmds (:obj:`str` or :obj:`list`): list or string containing the commands
+                (interprets ";", new line character and comments)
+            num_of_process: (:obj:`int`) maximum number of servers processed at the same time
+            servers_list (:obj:`iterable`): servers list
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            reuse_connection (:obj:`bool`, *default* = False): if True, all the commands of a
+                server are issued through one ssh connection (see :meth:`execute_commands`)
+            keep_results (:obj:`bool`, *default* = False): if True, the results are also
+                appended to self.results
+            output (:obj:`int` or :obj:`str`, *default* = None): how the standard output of
+                the commands is handled (see :meth:`iter_multicommand`)
+            start (:obj:`dict`, *default* = None): index in the list of the first command to
+                be executed in the servers not starting with the first one
+            as_script (:obj:`bool`, *default* = False): if True, the commands of a server are
+                sent in a single round trip, as a script (see :meth:`execute_script`)
+
+        Yields:
+            tuple containing the server and the dictionary with the result of each command
+            issued, in the format returned by :meth:`execute_command`
+
+        '''
+        cmds_list = self._parse_script(script_cmds)
+        if not cmds_list:
+            return
+        self.ssh_log_level = ssh_log_level
+        if self.relays:
+            results = self._iter_relayed({'script': cmds_list, 'num_of_process': num_of_process,
+                                          'ssh_log_level': ssh_log_level,
+                                          'reuse_connection': reuse_connection,
+                                          'output': output, 'start': start,
+                                          'as_script': as_script}, servers_list)
+        else:
+            self._set_output(output)
+            if reuse_connection or as_script:
+                results = self._iter_per_server(cmds_list, num_of_process, servers_list, start,
+                                                as_script)
+            else:
+                results = self._iter_pipelined(cmds_list, num_of_process, servers_list, start)
+        for server, cmd_results in self._interned(results, keep_results):
+            if keep_results:
+                self._store_result(server, cmd_results)
+            yield server, cmd_results
+
     def launch_list_of_commands(self, script_cmds, num_of_process, servers_list,
-                                ssh_log_level='CRITICAL'):
+                                ssh_log_level='CRITICAL', reuse_connection=False,
+                                pipeline=False, on_result=None, output=None, journal=None,
+                                as_script=False):
         ''' Launch a list of parallel commands
 
         Launches several processes that execute a sequence of commands in a list of servers
@@ -137,48 +1505,503 @@ class RemoteMultiCommand(Loggers):
         Arguments:
             script_cmds (:obj:`str` or :obj:`list`): list or string containing the commands
                 (interprets ";", new line character and comments)
-            num_of_process: (:obj:`int`) number of separated process launched in each iteration
+            num_of_process: (:obj:`int`) maximum number of servers processed at the same time
             servers_list (:obj:`list`): servers list
             ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
                 Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            reuse_connection (:obj:`bool`, *default* = False): if True, each server is handled
+                by a single worker that issues all the commands through one ssh connection
+                (see :meth:`execute_commands`) instead of connecting once per command. Implies
+                pipeline
+            pipeline (:obj:`bool`, *default* = False): if True, each server goes on with its
+                next command as soon as the previous one succeeds there, instead of waiting
+                for the command to finish in all the servers
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with the result of each command as soon as it finishes
+            output (:obj:`int` or :obj:`str`, *default* = None): how the standard output of
+                the commands is handled (see :meth:`iter_multicommand`)
+            journal (:obj:`str`, *default* = None): path of a file, usually in the log folder,
+                where the launch and the result of each command are recorded as they finish,
+                so the launch can be continued by :meth:`resume_list_of_commands` if it is
+                interrupted
+            as_script (:obj:`bool`, *default* = False): if True, the commands of each server
+                are sent together in a single round trip, as a script, and split back into a
+                result per command (see :meth:`execute_script`). Implies reuse_connection
 
         Returns:
-            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the result of
-                the command
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the list of
+                the results of their commands
 
         '''
-        start = time.time()
-        self.servers_cmd_dict = {}
+        cmds_list = self._parse_script(script_cmds)
+        self.results = ResultStore()
+        if journal is not None:
+            self._journal = Journal(journal)
+            self._journal.start({'script': cmds_list, 'servers': list(servers_list),
+                                 'reuse_connection': reuse_connection, 'pipeline': pipeline,
+                                 'output': output, 'as_script': as_script})
+        return self._run_list_of_commands(cmds_list, num_of_process, servers_list,
+                                          ssh_log_level, reuse_connection, pipeline, on_result,
+                                          output, as_script=as_script)
+
+    def resume_list_of_commands(self, journal, num_of_process, ssh_log_level='CRITICAL',
+                                on_result=None):
+        ''' Continues a launch of a list of commands recorded in a journal
+
+        The results recorded are loaded in self.results, and each server goes on from the
+        command following its last one recorded, except for the servers removed from the
+        execution list by a failed command. The new results are appended to the journal.
+
+        Arguments:
+            journal (:obj:`str`): path of the journal given to :meth:`launch_list_of_commands`
+            num_of_process: (:obj:`int`) maximum number of servers processed at the same time
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with the result of each new command as soon as it finishes
+
+        Returns:
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the list of
+                the results of their commands, recorded or new
+
+        '''
+        launch, results = read_journal(journal)
+        cmds_list = launch['script']
+        self.results = ResultStore()
+        # Index of the next command of each server, and the servers removed
+        start = {}
+        removed = set()
+        for server, cmd_results in results:
+            self.results.add(server, cmd_results)
+            start[server] = start.get(server, 0)+1
+            if cmd_results['result']:
+                removed.discard(server)
+            else:
+                removed.add(server)
+        servers_list = [server for server in launch['servers'] if server not in removed and
+                        start.get(server, 0) < len(cmds_list)]
+        self.log.info('Resuming the list of commands: '+str(len(removed))+' servers removed, '
+                      +str(len(launch['servers'])-len(servers_list)-len(removed))
+                      +' finished, '+str(len(servers_list))+' to go on.')
+        self._journal = Journal(journal)
+        self._journal.resume()
+        return self._run_list_of_commands(cmds_list, num_of_process, servers_list,
+                                          ssh_log_level, launch['reuse_connection'],
+                                          launch['pipeline'], on_result, launch['output'],
+                                          start, launch.get('as_script', False))
+
+    def launch_rolling_commands(self, script_cmds, num_of_process, servers_list,
+                                waves=(1, 0.1, 0.5, 1.0), max_failure_rate=0.1,
+                                ssh_log_level='CRITICAL', reuse_connection=False,
+                                pipeline=False, on_result=None, output=None, pause=0,
+                                as_script=False):
+        ''' Launch a list of parallel commands in waves of servers, starting with a canary
+
+        The list of commands is executed, as in :meth:`launch_list_of_commands`, in a wave of
+        servers after the other. If the fraction of the servers of a wave where a command
+        failed, or that could not be reached, exceeds max_failure_rate, the following waves
+        are not run. The timeouts and the statistics apply to each wave.
+
+        Arguments:
+            script_cmds (:obj:`str` or :obj:`list`): list or string containing the commands
+                (interprets ";", new line character and comments)
+            num_of_process: (:obj:`int`) maximum number of servers processed at the same time
+            servers_list (:obj:`list`): servers list, in the order they are rolled out
+            waves (:obj:`list`, *default* = (1, 0.1, 0.5, 1.0)): size of each wave, as a number
+                of servers (:obj:`int`) or a fraction of servers_list (:obj:`float`). The last
+                size is repeated until all the servers are covered
+            max_failure_rate (:obj:`float`, *default* = 0.1): maximum fraction of failed servers
+                in a wave for the next one to be run
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            reuse_connection (:obj:`bool`, *default* = False): see
+                :meth:`launch_list_of_commands`
+            pipeline (:obj:`bool`, *default* = False): see :meth:`launch_list_of_commands`
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with the result of each command as soon as it finishes
+            output (:obj:`int` or :obj:`str`, *default* = None): how the standard output of
+                the commands is handled (see :meth:`iter_multicommand`)
+            pause (:obj:`float`, *default* = 0): seconds to wait between two waves
+            as_script (:obj:`bool`, *default* = False): see :meth:`launch_list_of_commands`
+
+        Returns:
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers of the waves
+                run and the list of the results of their commands. How each wave went, and the
+                servers left out if the rollout was aborted, are kept in self.last_rollout
+
+        '''
+        cmds_list = self._parse_script(script_cmds)
+        servers_list = list(servers_list)
+        self.results = ResultStore()
+        self.last_rollout = {'waves': [], 'aborted': False, 'remaining': []}
+        begin = 0
+        for number, size in enumerate(self._wave_sizes(waves, len(servers_list))):
+            if begin >= len(servers_list):
+                break
+            if number and pause:
+                time.sleep(pause)
+            wave = servers_list[begin:begin+size]
+            begin += size
+            self.log.info('Wave '+str(number+1)+': '+str(len(wave))+' servers, '
+                          +str(len(servers_list)-begin)+' left.')
+            self._run_list_of_commands(cmds_list, num_of_process, wave, ssh_log_level,
+                                       reuse_connection, pipeline, on_result, output,
+                                       as_script=as_script)
+            failed = 0
+            for server in wave:
+                results = self.results.by_server(server)
+                if not results or not results[-1].result:
+                    failed += 1
+            failure_rate = float(failed)/len(wave)
+            self.last_rollout['waves'].append({'servers': len(wave), 'failed': failed,
+                                               'failure_rate': failure_rate})
+            if failure_rate > max_failure_rate and begin < len(servers_list):
+                self.last_rollout['aborted'] = True
+                self.last_rollout['remaining'] = servers_list[begin:]
+                self.log.error('Aborting the rollout: '+str(failed)+' of the '+str(len(wave))
+                               +' servers of wave '+str(number+1)+' failed. '
+                               +str(len(servers_list)-begin)+' servers were not run.')
+                break
+        return self.servers_cmd_dict
+
+    @staticmethod
+    def _wave_sizes(waves, num_of_servers):
+        '''Yields the number of servers of each wave, repeating the last one forever'''
+        size = 1
+        for size in waves:
+            if isinstance(size, float):
+                size = int(math.ceil(size*num_of_servers))
+            size = max(1, size)
+            yield size
+        while True:
+            yield size
+
+    def _run_list_of_commands(self, cmds_list, num_of_process, servers_list, ssh_log_level,
+                              reuse_connection, pipeline, on_result, output, start=None,
+                              as_script=False):
+        '''Executes the list of commands, as described in :meth:`launch_list_of_commands`
+
+        Arguments:
+            start (:obj:`dict`, *default* = None): index in the list of the first command to
+                be executed in the servers not starting with the first one
+            as_script (:obj:`bool`, *default* = False): see :meth:`launch_list_of_commands`
+
+        '''
+        self._check_window(num_of_process)
+        start_time = time.time()
+        start = start or {}
         num_of_servers = len(servers_list)
         servers_list_temp = copy(servers_list)
-        if type(script_cmds).__name__ != 'list':
-            # Turn script_cmds into a list
-            script_cmds = script_cmds.replace(';', '\n')
-            cmds_list = script_cmds.split('\n')
-        else:
-            cmds_list = script_cmds
-        # Filter null elements and commented lines
-        cmds_list = filter(lambda x: x, cmds_list)
-        cmds_list = filter(lambda x: x[0] != '#', cmds_list)
         self.log.info('Executing '+str(len(cmds_list))+' commands in the list of servers:')
-        for cmd in cmds_list:
-            if servers_list_temp:
-                result_dict = self.launch_multicommand(cmd, num_of_process,
-                                                       servers_list_temp, ssh_log_level)
-                for server, results in result_dict.iteritems():
-                    if not results['result']:
-                        # If this command fails, we remove the server from list
-                        servers_list_temp.remove(server)
-                        self.log.error('Command "'+cmd+'" returned error. Removing server '
-                                       +server+' from execution list')
-        for server, result_dict in self.servers_cmd_dict.iteritems():
+        try:
+            if reuse_connection or pipeline or as_script:
+                for server, cmd_results in self.iter_list_of_commands(
+                        cmds_list, max(min(num_of_process, num_of_servers), 1), servers_list,
+                        ssh_log_level, reuse_connection, keep_results=True, output=output,
+                        start=start, as_script=as_script):
+                    if on_result:
+                        on_result(server, cmd_results)
+            else:
+                self._run_barriers(cmds_list, num_of_process, servers_list_temp, ssh_log_level,
+                                   on_result, output, start, start_time)
+        finally:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        for server, positions in self.results.server_index.iteritems():
             log_message = 'Server '+server+':'
             log_message = log_message+'\n - All '+str(len(cmds_list))+' commands were issued: '\
-                         +('Yes' if len(result_dict) == len(cmds_list) else 'No')
-            log_message = log_message+'\n - Number of commands issued: '+str(len(result_dict))
+                         +('Yes' if len(positions) == len(cmds_list) else 'No')
+            log_message = log_message+'\n - Number of commands issued: '+str(len(positions))
             log_message = log_message+'\n - Number of commands bypassed: '\
-                         +str(len(cmds_list) - len(result_dict))
+                         +str(len(cmds_list) - len(positions))
             self.log.info(log_message)
-        self.log.info("It took "+str(round(time.time()-start, 3))+" seconds to execute the list"\
-                      " of commands in all "+str(num_of_servers)+" servers.")
+        self.log.info("It took "+str(round(time.time()-start_time, 3))+" seconds to execute the"\
+                      " list of commands in all "+str(num_of_servers)+" servers.")
         return self.servers_cmd_dict
+
+    def _run_barriers(self, cmds_list, num_of_process, servers_list_temp, ssh_log_level,
+                      on_result, output, start, start_time):
+        '''Executes each command of the list in all the servers before the next one
+
+        Arguments:
+            servers_list_temp (:obj:`list`): servers list, from which the servers where a
+                command fails are removed
+            start (:obj:`dict`): index in the list of the first command to be executed in the
+                servers not starting with the first one
+            start_time (:obj:`float`): timestamp when the launch started
+
+        '''
+        # The deadline and the statistics cover the whole list, not each command
+        if self.run_timeout:
+            self._deadline = start_time+self.run_timeout
+        self._stats = RunStats()
+        self._outputs = OutputInterner()
+        try:
+            for index, cmd in enumerate(cmds_list):
+                servers = [server for server in servers_list_temp
+                           if start.get(server, 0) <= index]
+                if servers:
+                    result_dict = self.launch_multicommand(cmd, num_of_process, servers,
+                                                           ssh_log_level, on_result, output)
+                    for server, results in result_dict.iteritems():
+                        if not results['result']:
+                            # If this command fails, we remove the server from list
+                            servers_list_temp.remove(server)
+                            self.log.error('Command "'+cmd+'" returned error. Removing '
+                                           'server '+server+' from execution list')
+        finally:
+            self._deadline = None
+            self._outputs = None
+            stats, self._stats = self._stats, None
+            self._finish_stats(stats)
+
+    def push_file(self, local_path, remote_path, num_of_process, servers_list,
+                  ssh_log_level='CRITICAL', mode=None, peers=None, peer_cmd=PEER_COMMAND,
+                  on_result=None):
+        ''' Copies a local file to a list of servers
+
+        The file is mapped in memory once and streamed from there to the servers, through an
+        SFTP session opened on the ssh connection of each one. The servers already holding a
+        file with the same sha1 are left untouched.
+
+        With peers, the file is only sent from here to the first peers servers; then, in each
+        round, every server holding the file copies it to up to peers other servers, running
+        peer_cmd in it, so the number of servers holding the file grows (peers+1) times per
+        round. The servers must be able to reach each other through ssh. Each copy is
+        written to the path followed by '.part' and moved into place once complete; as it
+        prints nothing until it is done, it is given the time to copy the file at
+        transfer.PEER_MIN_RATE instead of self.command_timeout, if longer. The servers whose
+        copy fails get the file directly from here at the end.
+
+        Files are not transferred through relays: ValueError is raised if self.relays is set.
+
+        Arguments:
+            local_path (:obj:`str`): path of the local file
+            remote_path (:obj:`str`): path of the file in the servers
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
+            servers_list (:obj:`list`): servers list
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            mode (:obj:`int`, *default* = None): permissions of the remote file
+            peers (:obj:`int`, *default* = None): number of servers each server holding the
+                file copies it to in each round (only copied from here if None)
+            peer_cmd (:obj:`str`, *default* = transfer.PEER_COMMAND): command copying the
+                file to a peer, formatted with the path, the path of the partial copy, the
+                sha1 of the file and the peer
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with its result as soon as each server finishes
+
+        Returns:
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the result
+                of the transfer, whose output tells if the file was 'unchanged',
+                'pushed <bytes> bytes' from here or 'copied from <server>'
+
+        '''
+        if self.relays:
+            raise ValueError('Files are not transferred through relays')
+        data = map_file(local_path)
+        cmd = 'push '+local_path+' '+remote_path
+        self._transfer = {'local_path': local_path, 'remote_path': remote_path,
+                          'sha1': file_sha1(data), 'mode': mode,
+                          'timeout': peer_timeout(len(data),
+                                                  self.command_timeout or COMMAND_TIMEOUT)}
+        return self._launch_transfer(cmd, num_of_process, servers_list, ssh_log_level,
+                                     on_result, peers, peer_cmd)
+
+    def pull_file(self, remote_path, local_folder, num_of_process, servers_list,
+                  ssh_log_level='CRITICAL', on_result=None):
+        ''' Copies a file of a list of servers to local files
+
+        The file of each server is written, as it is received, to
+        <local_folder>/<server>/<name of the file>.
+
+        Files are not transferred through relays: ValueError is raised if self.relays is set.
+
+        Arguments:
+            remote_path (:obj:`str`): path of the file in the servers
+            local_folder (:obj:`str`): folder where the files are written
+            num_of_process (:obj:`int`): maximum number of servers processed at the same time
+            servers_list (:obj:`list`): servers list
+            ssh_log_level (:obj:`str`, *default* = 'CRITICAL'): log level of the ssh connection.
+                Could be 'DEBUG', 'INFO', 'ERROR' or 'CRITICAL'
+            on_result (:obj:`callable`, *default* = None): function called with the server and
+                the dictionary with its result as soon as each server finishes
+
+        Returns:
+            servers_cmd_dict (:obj:`dict`): dictionary containing the servers and the result
+                of the transfer, whose output is the path of the local file
+
+        '''
+        if self.relays:
+            raise ValueError('Files are not transferred through relays')
+        cmd = 'pull '+remote_path+' '+local_folder
+        self._transfer = {'remote_path': remote_path, 'local_folder': local_folder}
+        return self._launch_transfer(cmd, num_of_process, servers_list, ssh_log_level,
+                                     on_result)
+
+    def _launch_transfer(self, cmd, num_of_process, servers_list, ssh_log_level, on_result,
+                         peers=None, peer_cmd=None):
+        '''Runs the transfer set in self._transfer in a list of servers
+
+        Arguments:
+            cmd (:obj:`str`): description of the transfer, kept as the command of the results
+
+        '''
+        first = len(self.results)
+        servers_list = list(self._resolved(servers_list))
+        start = time.time()
+        self.ssh_log_level = ssh_log_level
+        self._set_output(None)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.reset()
+        # The statistics cover all the rounds of the transfer
+        self._stats = RunStats()
+        self._outputs = OutputInterner()
+        func = self.push_to_server if 'sha1' in self._transfer else self.pull_from_server
+        try:
+            if peers:
+                results = self._iter_peer_transfer(cmd, num_of_process, servers_list, peers,
+                                                   peer_cmd)
+            else:
+                results = self._iter_tasks(self._sliding_window(
+                    func, ((server, cmd) for server in servers_list), num_of_process))
+            for server, cmd_results in results:
+                self._store_result(server, cmd_results)
+                if on_result:
+                    on_result(server, cmd_results)
+        finally:
+            self._transfer = None
+            self._outputs = None
+            stats, self._stats = self._stats, None
+            self._finish_stats(stats)
+        self.log.info("It took "+str(round(time.time()-start, 3))+" seconds to "+cmd+" in all "
+                      +str(len(servers_list))+" servers.")
+        return self.results.snapshot(first, single=True)
+
+    def _iter_peer_transfer(self, cmd, num_of_process, servers_list, peers, peer_cmd):
+        '''Pushes the file of self._transfer to the first servers, then from server to server
+
+        Yields:
+            tuple containing the server and the dictionary with the result of the transfer
+
+        '''
+        tasks = ((server, cmd) for server in servers_list[:peers])
+        holders = []
+        failed = []
+        for server, cmd_results in self._iter_tasks(self._sliding_window(
+                self.push_to_server, tasks, num_of_process)):
+            if cmd_results['result']:
+                holders.append(server)
+            yield server, cmd_results
+        left = servers_list[peers:]
+        while left and holders:
+            targets, left = left[:len(holders)*peers], left[len(holders)*peers:]
+            # Each holder copies the file to peers targets at most, running a command
+            # whose results are accounted to the target
+            copies = {}
+            for index, target in enumerate(targets):
+                copies[peer_command(self._transfer['remote_path'], self._transfer['sha1'],
+                                    target, peer_cmd)] = (holders[index % len(holders)], target)
+            tasks = ((holder, copy_cmd) for copy_cmd, (holder, _) in copies.iteritems())
+            for holder, cmd_results in self._iter_tasks(self._sliding_window(
+                    self.copy_to_peer, tasks, num_of_process,
+                    self._task_timeout(1, self._transfer['timeout']))):
+                _, target = copies[cmd_results['command']]
+                if not cmd_results['result']:
+                    self.log.error('Could not copy the file from '+holder+' to '+target+': '
+                                   +str(cmd_results['output']))
+                    failed.append(target)
+                    continue
+                holders.append(target)
+                cmd_results['command'] = cmd
+                cmd_results['output'] = 'copied from '+holder
+                yield target, cmd_results
+        failed.extend(left)
+        if failed:
+            self.log.info('Pushing the file directly to '+str(len(failed))+' servers.')
+            for server, cmd_results in self._iter_tasks(self._sliding_window(
+                    self.push_to_server, ((server, cmd) for server in failed), num_of_process)):
+                yield server, cmd_results
+
+    def push_to_server(self, server, cmd):
+        '''Copies the file of the current transfer to a server, unless it already holds it
+
+        Arguments:
+            server (:obj:`str`): server receiving the file
+            cmd (:obj:`str`): description of the transfer
+
+        Returns:
+            dictionary containing the server and the result of the transfer, in the format
+            returned by :meth:`execute_command`
+
+        '''
+        return self._transfer_file(server, cmd, self._push)
+
+    def pull_from_server(self, server, cmd):
+        '''Copies the file of the current transfer from a server to a local file
+
+        Arguments:
+            server (:obj:`str`): server sending the file
+            cmd (:obj:`str`): description of the transfer
+
+        Returns:
+            dictionary containing the server and the result of the transfer, in the format
+            returned by :meth:`execute_command`
+
+        '''
+        return self._transfer_file(server, cmd, self._pull)
+
+    def _transfer_file(self, server, cmd, transfer):
+        '''Connects to a server and runs transfer(ssh, server) through the connection'''
+        timer = PhaseTimer()
+        try:
+            ssh, ret, output_msg, timed_out = self._connect(server, timer, cmd)
+            if ret:
+                with timer.phase('exec'):
+                    try:
+                        cmd_ret, std = True, transfer(ssh, server)
+                    except Exception as error:
+                        cmd_ret, std = False, str(error)
+                        self.log.error('Error in '+cmd+' in server '+server+' :'+std)
+                self._disconnect(ssh, timed_out, timer)
+            else:
+                cmd_ret = ret
+                std = output_msg
+        finally:
+            _active_sessions.pop(_session_key(server, cmd), None)
+        return {server:self._dedup(self._result_dict(cmd, ret, cmd_ret, std, timed_out,
+                                                     timer.as_dict()))}
+
+    def _push(self, ssh, server):
+        '''Copies the file of self._transfer to the connected server, returning what was done'''
+        transfer = self._transfer
+        if remote_sha1(ssh, transfer['remote_path'],
+                       self.command_timeout or COMMAND_TIMEOUT) == transfer['sha1']:
+            return 'unchanged'
+        sftp = ssh.ssh_client.open_sftp()
+        try:
+            size = upload(sftp, map_file(transfer['local_path']), transfer['remote_path'],
+                          transfer['mode'])
+        finally:
+            sftp.close()
+        return 'pushed '+str(size)+' bytes'
+
+    def _pull(self, ssh, server):
+        '''Copies the file of self._transfer from the connected server, returning its path'''
+        transfer = self._transfer
+        local_folder = os.path.join(transfer['local_folder'], server)
+        if not os.path.isdir(local_folder):
+            try:
+                os.makedirs(local_folder)
+            except OSError:
+                # Created by another worker in the meantime
+                if not os.path.isdir(local_folder):
+                    raise
+        local_path = os.path.join(local_folder, os.path.basename(transfer['remote_path']))
+        sftp = ssh.ssh_client.open_sftp()
+        try:
+            download(sftp, transfer['remote_path'], local_path)
+        finally:
+            sftp.close()
+        return local_path
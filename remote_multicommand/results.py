@@ -0,0 +1,318 @@
+import hashlib
+import threading
+from array import array
+from collections import Mapping, OrderedDict
+from itertools import count, islice
+from .metrics import PHASES
+
+# Outputs shorter than this are always sent by the workers, since a digest is not smaller
+DEDUP_MIN_BYTES = 64
+
+# Digests of the outputs already sent by each worker, along with the launch they belong to
+_sent_outputs = threading.local()
+
+
+class OutputRef(object):
+    '''Output of a command as sent by a worker, identified by its digest
+
+    The output itself is only sent the first time; afterwards the digest is enough for the
+    parent, which keeps the outputs already received.
+
+    Arguments:
+        digest (:obj:`str`): sha1 of the output
+        output (:obj:`str`, optional, *default* =None): the output, if not sent before
+
+    '''
+    def __init__(self, digest, output=None):
+        self.digest = digest
+        self.output = output
+
+
+def dedup_output(cmd_dict, token):
+    '''Replaces, in a worker, the output of a result by an OutputRef
+
+    Arguments:
+        cmd_dict (:obj:`dict`): result of a command
+        token: identifier of the launch, whose outputs are tracked apart from the other ones
+
+    '''
+    output = cmd_dict['output']
+    if not isinstance(output, str) or len(output) < DEDUP_MIN_BYTES:
+        return
+    if getattr(_sent_outputs, 'token', None) != token:
+        _sent_outputs.token = token
+        _sent_outputs.digests = set()
+    digest = hashlib.sha1(output).digest()
+    if digest in _sent_outputs.digests:
+        cmd_dict['output'] = OutputRef(digest)
+    else:
+        _sent_outputs.digests.add(digest)
+        cmd_dict['output'] = OutputRef(digest, output)
+
+
+class OutputInterner(object):
+    '''Keeps a single copy of each distinct output and command of a launch
+
+    The results of the workers go through :meth:`resolve`, which replaces the references
+    sent by the workers with the outputs and makes the equal strings share one object, so
+    thousands of servers returning the same output hold it only once in memory.
+
+    '''
+    _tokens = count(1)
+
+    def __init__(self):
+        self.token = next(self._tokens)
+        self.strings = {}
+        self.digests = {}
+
+    def intern(self, value):
+        '''Returns the copy kept of value'''
+        return self.strings.setdefault(value, value)
+
+    def resolve(self, server_results):
+        '''Interns the commands and outputs of the results of a task
+
+        Arguments:
+            server_results (:obj:`dict`): server and result (or list of results) of a task
+
+        '''
+        for results in server_results.itervalues():
+            for cmd_dict in (results if isinstance(results, list) else [results]):
+                cmd_dict['command'] = self.intern(cmd_dict['command'])
+                output = cmd_dict['output']
+                if isinstance(output, OutputRef):
+                    if output.output is not None:
+                        self.digests.setdefault(output.digest, self.intern(output.output))
+                    cmd_dict['output'] = self.digests[output.digest]
+                elif isinstance(output, str):
+                    cmd_dict['output'] = self.intern(output)
+        return server_results
+
+
+def group_outputs(results):
+    '''Groups servers by the output of their command
+
+    Arguments:
+        results (:obj:`iterable`): pairs of server and result of a command, as yielded by
+            :meth:`RemoteMultiCommand.iter_multicommand`, or a mapping of servers and results,
+            as returned by :meth:`RemoteMultiCommand.launch_multicommand`
+
+    Returns:
+        :obj:`OrderedDict`: each distinct output (the error message for the servers where
+            the command failed) with a dict holding the 'result' of the command, the 'count'
+            of servers and the set of 'servers' that returned it, the most common first
+
+    '''
+    if isinstance(results, Mapping):
+        results = results.iteritems()
+    groups = {}
+    for server, cmd_dict in results:
+        group = groups.get(cmd_dict['output'])
+        if group is None:
+            group = groups[cmd_dict['output']] = {'result': True, 'count': 0,
+                                                  'servers': set()}
+        group['result'] = group['result'] and cmd_dict['result']
+        group['count'] += 1
+        group['servers'].add(server)
+    return OrderedDict(sorted(groups.items(), key=lambda item: -item[1]['count']))
+
+
+# Statuses by which the results are indexed in a ResultStore
+STATUSES = ('success', 'failed', 'unreachable', 'timeout')
+# Fields of the timing of a result, kept as a tuple
+TIMING_FIELDS = ('start',)+PHASES+('end',)
+
+
+class CommandResult(object):
+    '''Result of a command in a server, as kept by a ResultStore
+
+    Has the keys of the dictionaries returned by :meth:`RemoteMultiCommand.execute_command` as
+    attributes, except for timing, which is kept as a tuple in the order of TIMING_FIELDS.
+
+    '''
+    __slots__ = ('server', 'command', 'access', 'result', 'output', 'timeout', 'timing')
+
+    def __init__(self, server, cmd_dict):
+        self.server = server
+        self.command = cmd_dict['command']
+        self.access = cmd_dict['access']
+        self.result = cmd_dict['result']
+        self.output = cmd_dict['output']
+        self.timeout = cmd_dict['timeout']
+        self.timing = tuple(cmd_dict['timing'][field] for field in TIMING_FIELDS)
+
+    @property
+    def status(self):
+        '''One of STATUSES (a timeout prevails over an unreachable server, and this one over a
+        failed command)'''
+        if self.timeout:
+            return 'timeout'
+        if not self.access:
+            return 'unreachable'
+        if not self.result:
+            return 'failed'
+        return 'success'
+
+    def as_dict(self):
+        '''Returns the result in the format of :meth:`RemoteMultiCommand.execute_command`'''
+        cmd_dict = OrderedDict()
+        cmd_dict['command'] = self.command
+        cmd_dict['access'] = self.access
+        cmd_dict['result'] = self.result
+        cmd_dict['output'] = self.output
+        cmd_dict['timeout'] = self.timeout
+        cmd_dict['timing'] = OrderedDict(zip(TIMING_FIELDS, self.timing))
+        return cmd_dict
+
+
+class ResultStore(object):
+    '''Compact store of the results of the commands executed in the servers
+
+    Each result is kept in a CommandResult, with the names of the servers and the commands
+    interned, and is indexed by server, by command and by status. :meth:`view` gives the
+    results in the format of the dictionaries returned by the launch methods.
+
+    '''
+    def __init__(self):
+        self.records = []
+        self.strings = {}
+        self.server_index = {}
+        self.command_index = {}
+        self.status_index = dict((status, array('l')) for status in STATUSES)
+        # Dictionary returned by as_dict, and number of results it holds
+        self._dict = None
+        self._dict_size = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def add(self, server, cmd_dict):
+        '''Stores the result of a command
+
+        Arguments:
+            server (:obj:`str`): server where the command was executed
+            cmd_dict (:obj:`dict`): result of the command, as returned by
+                :meth:`RemoteMultiCommand.execute_command`
+
+        '''
+        server = self.strings.setdefault(server, server)
+        record = CommandResult(server, cmd_dict)
+        record.command = self.strings.setdefault(record.command, record.command)
+        position = len(self.records)
+        self.records.append(record)
+        self.server_index.setdefault(server, array('l')).append(position)
+        self.command_index.setdefault(record.command, array('l')).append(position)
+        self.status_index[record.status].append(position)
+
+    def by_server(self, server):
+        '''Returns the results of a server, in the order they were stored'''
+        return [self.records[position] for position in self.server_index.get(server, ())]
+
+    def by_command(self, cmd):
+        '''Returns the results of a command in all the servers'''
+        return [self.records[position] for position in self.command_index.get(cmd, ())]
+
+    def by_status(self, status):
+        '''Returns the results with a status (one of STATUSES)'''
+        return [self.records[position] for position in self.status_index[status]]
+
+    def servers(self):
+        '''Returns the servers with results stored'''
+        return self.server_index.keys()
+
+    def commands(self):
+        '''Returns the commands with results stored'''
+        return self.command_index.keys()
+
+    def as_dict(self):
+        '''Returns the dictionary of the servers and the list of their results
+
+        The dictionary is built on the first call and kept: each call only appends to it the
+        results stored since the previous one. Changes made to it are thus kept in it, but
+        are not made in the store.
+
+        '''
+        if self._dict is None:
+            self._dict = {}
+        for record in islice(self.records, self._dict_size, None):
+            self._dict.setdefault(record.server, []).append(record.as_dict())
+        self._dict_size = len(self.records)
+        return self._dict
+
+    def view(self, first=0, single=False):
+        '''Returns a ResultView of the results stored from position first on'''
+        return ResultView(self, first, single)
+
+    def snapshot(self, first=0, single=False):
+        '''Returns a dictionary of the servers and the results stored from position first on
+
+        Unlike :meth:`view`, the dictionary is built at once and is not tied to the store.
+
+        Arguments:
+            first (:obj:`int`, *default* = 0): position of the first result included
+            single (:obj:`bool`, *default* = False): if True, each server is mapped to its
+                last result instead of the list of its results
+
+        '''
+        servers_cmd_dict = {}
+        for record in islice(self.records, first, None):
+            if single:
+                servers_cmd_dict[record.server] = record.as_dict()
+            else:
+                servers_cmd_dict.setdefault(record.server, []).append(record.as_dict())
+        return servers_cmd_dict
+
+
+class ResultView(Mapping):
+    '''Read-only dictionary of servers and results, built on demand from a ResultStore
+
+    The dictionaries of the results are built on each access, so changing them does not
+    change the store. The view covers the results stored when it was created, and not the
+    ones added afterwards.
+
+    Arguments:
+        store (:obj:`ResultStore`): store of the results
+        first (:obj:`int`, optional, *default* =0): position of the first result covered
+        single (:obj:`bool`, optional, *default* =False): if True, each server is mapped to
+            its last result, as returned by :meth:`RemoteMultiCommand.launch_multicommand`,
+            instead of the list of its results
+
+    '''
+    def __init__(self, store, first=0, single=False):
+        self.store = store
+        self.first = first
+        self.last = len(store)
+        self.single = single
+
+    def _positions(self, server):
+        return [position for position in self.store.server_index.get(server, ())
+                if self.first <= position < self.last]
+
+    def __getitem__(self, server):
+        positions = self._positions(server)
+        if not positions:
+            raise KeyError(server)
+        if self.single:
+            return self.store.records[positions[-1]].as_dict()
+        return [self.store.records[position].as_dict() for position in positions]
+
+    def __contains__(self, server):
+        return bool(self._positions(server))
+
+    def _servers(self):
+        if not self.first and self.last == len(self.store):
+            return self.store.server_index.keys()
+        return OrderedDict.fromkeys(record.server for record in
+                                    islice(self.store.records, self.first, self.last)).keys()
+
+    def __iter__(self):
+        return iter(self._servers())
+
+    def __len__(self):
+        return len(self._servers())
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
@@ -0,0 +1,142 @@
+import random
+import socket
+import struct
+
+# Parts of the messages of the connection errors worth retrying (compared in lower case)
+TRANSIENT_ERRORS = ('connection refused', 'connection reset', 'timed out',
+                    'error reading ssh protocol banner', 'authentication timeout',
+                    'no existing session')
+
+
+class RetryPolicy(object):
+    '''Retries the connections that failed with a transient error
+
+    The retries are scheduled after an exponential backoff, with part of it drawn at random,
+    so the retries of many servers failing together do not arrive together either.
+
+    Arguments:
+        retries(:obj:`int`, optional, *default* =3): maximum number of retries of a server
+        backoff(:obj:`float`, optional, *default* =1): seconds before the first retry,
+            doubled at each of the following ones
+        max_backoff(:obj:`float`, optional, *default* =30): maximum seconds before a retry
+        jitter(:obj:`float`, optional, *default* =0.5): fraction of the backoff drawn at
+            random
+        transient_errors(:obj:`tuple`, optional, *default* =TRANSIENT_ERRORS): parts of the
+            messages of the errors considered transient
+
+    '''
+    def __init__(self, retries=3, backoff=1, max_backoff=30, jitter=0.5,
+                 transient_errors=TRANSIENT_ERRORS):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.transient_errors = tuple(error.lower() for error in transient_errors)
+
+    def should_retry(self, output_msg, attempt):
+        '''Tells if a failed connection is retried
+
+        Arguments:
+            output_msg (:obj:`str`): message of the connection error
+            attempt (:obj:`int`): number of retries already done
+
+        '''
+        if attempt >= self.retries:
+            return False
+        output_msg = str(output_msg).lower()
+        return any(error in output_msg for error in self.transient_errors)
+
+    def delay(self, attempt):
+        '''Returns the seconds to wait before a retry
+
+        Arguments:
+            attempt (:obj:`int`): number of retries already done
+
+        '''
+        backoff = min(self.max_backoff, self.backoff*2**attempt)
+        return backoff*(1-self.jitter*random.random())
+
+
+def ipv4_subnet(server, prefix=24):
+    '''Returns the subnet of a server given by its IPv4 address (None for a name)
+
+    Arguments:
+        server (:obj:`str`): server
+        prefix (:obj:`int`, *default* = 24): length of the prefix of the subnet
+
+    '''
+    if server.count('.') != 3:
+        return None
+    try:
+        address = struct.unpack('!I', socket.inet_aton(server))[0]
+    except socket.error:
+        return None
+    mask = (0xffffffff << (32-prefix)) & 0xffffffff
+    return socket.inet_ntoa(struct.pack('!I', address & mask))+'/'+str(prefix)
+
+
+class CircuitBreaker(object):
+    '''Stops trying, during a launch, the servers and subnets that keep failing to connect
+
+    A server is given up after a number of consecutive failed connections, and so is a
+    whole subnet when its servers fail one after the other. Only the failures that are not
+    going to be retried count for the subnet, so a burst of transient errors does not give
+    it up. The servers given up get a failed result without using a worker. The counts
+    start over at each launch.
+
+    Arguments:
+        host_failures(:obj:`int`, optional, *default* =3): consecutive failed connections
+            after which a server is not tried again
+        subnet_failures(:obj:`int`, optional, *default* =10): consecutive failed
+            connections in a subnet after which none of its servers is tried again (never
+            if None)
+        subnet_of(:obj:`callable`, optional, *default* =ipv4_subnet): function returning
+            the subnet of a server, or None if it is unknown
+
+    '''
+    def __init__(self, host_failures=3, subnet_failures=10, subnet_of=ipv4_subnet):
+        self.host_failures = host_failures
+        self.subnet_failures = subnet_failures
+        self.subnet_of = subnet_of
+        self.hosts = {}
+        self.subnets = {}
+
+    def reset(self):
+        '''Forgets the failures, at the beginning of a launch'''
+        self.hosts = {}
+        self.subnets = {}
+
+    def record(self, server, success, retrying=False):
+        '''Accounts the outcome of a connection
+
+        Arguments:
+            server (:obj:`str`): server
+            success (:obj:`bool`): if the connection succeeded
+            retrying (:obj:`bool`, *default* = False): if the failed connection is going to
+                be retried
+
+        '''
+        subnet = self.subnet_of(server) if self.subnet_failures else None
+        if success:
+            self.hosts.pop(server, None)
+            if subnet is not None:
+                self.subnets.pop(subnet, None)
+            return
+        self.hosts[server] = self.hosts.get(server, 0)+1
+        if subnet is not None and not retrying:
+            self.subnets[subnet] = self.subnets.get(subnet, 0)+1
+
+    def is_open(self, server):
+        '''Tells if a server is not tried anymore
+
+        Returns:
+            :obj:`str`: the reason why the server is not tried, or None if it can be
+
+        '''
+        if self.hosts.get(server, 0) >= self.host_failures:
+            return 'Circuit open after '+str(self.hosts[server])+' failed connections'
+        subnet = self.subnet_of(server) if self.subnet_failures else None
+        if subnet is not None and self.subnets.get(subnet, 0) >= self.subnet_failures:
+            return 'Circuit open for subnet '+subnet+' after '+str(self.subnets[subnet])+\
+                   ' failed connections'
+        return None
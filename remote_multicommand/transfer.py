@@ -0,0 +1,165 @@
+import hashlib
+import mmap
+import os
+import threading
+from pipes import quote
+
+# Bytes written or read in each SFTP request
+CHUNK_SIZE = 32768
+# Command run in a server holding the file to copy it to a peer. It is formatted with the
+# quoted path of the file, the quoted path of its partial copy, its sha1 and the peer, and
+# skips peers already holding the file. The file is copied to the partial path and moved into
+# place once complete, so an interrupted copy never leaves a truncated file at the path
+PEER_COMMAND = 'ssh -o BatchMode=yes %(server)s sha1sum %(path)s 2>/dev/null | '\
+               'grep -q ^%(sha1)s || { scp -p -q -o BatchMode=yes %(path)s %(server)s:%(part)s '\
+               '&& ssh -o BatchMode=yes %(server)s mv -f %(part)s %(path)s; }'
+# Slowest rate, in bytes per second, expected of a copy between peers, which prints nothing
+# until it is done and is given the time to copy the file at this rate
+PEER_MIN_RATE = 1048576
+
+# Local files mapped in memory by each process, shared by its workers
+_mapped_files = {}
+_mapped_lock = threading.Lock()
+
+
+def map_file(path):
+    '''Returns the contents of a local file, mapped in memory
+
+    The mapping is kept and shared by all the threads of the process until the file changes,
+    so the file is read from the page cache once, however many servers it is sent to.
+
+    Arguments:
+        path (:obj:`str`): path of the local file
+
+    '''
+    status = os.stat(path)
+    key = (status.st_size, status.st_mtime)
+    with _mapped_lock:
+        if path in _mapped_files and _mapped_files[path][0] == key:
+            return _mapped_files[path][1]
+        if not status.st_size:
+            # Empty files cannot be mapped
+            data = ''
+        else:
+            with open(path, 'rb') as local_file:
+                data = mmap.mmap(local_file.fileno(), 0, access=mmap.ACCESS_READ)
+        _mapped_files[path] = (key, data)
+        return data
+
+
+def file_sha1(data):
+    '''Returns the sha1 of the contents of a file, as returned by :func:`map_file`'''
+    sha1 = hashlib.sha1()
+    for offset in xrange(0, len(data), CHUNK_SIZE*32):
+        sha1.update(data[offset:offset+CHUNK_SIZE*32])
+    return sha1.hexdigest()
+
+
+def remote_sha1(ssh, path, timeout):
+    '''Returns the sha1 of a file in the connected server, or None if it cannot be read
+
+    Arguments:
+        ssh (:obj:`RemoteServer`): instance connected to the server
+        path (:obj:`str`): path of the remote file
+        timeout (:obj:`float`): timeout of the command
+
+    '''
+    ret, output, _ = ssh.execute_cmd('sha1sum '+quote(path), timeout)
+    if not ret or not output:
+        return None
+    return output.split(' ')[0]
+
+
+def upload(sftp, data, path, mode=None):
+    '''Writes data to a remote file
+
+    The data is written to a temporary file, renamed to path once complete, so the remote
+    file is never seen half written.
+
+    Arguments:
+        sftp (:obj:`paramiko.SFTPClient`): SFTP session with the server
+        data (:obj:`str` or :obj:`mmap.mmap`): contents of the file
+        path (:obj:`str`): path of the remote file
+        mode (:obj:`int`, *default* = None): permissions of the remote file
+
+    Returns:
+        :obj:`int`: bytes written
+
+    '''
+    temp_path = path+'.part'
+    remote_file = sftp.open(temp_path, 'wb')
+    try:
+        # Does not wait for the acknowledgement of each chunk before sending the next one
+        remote_file.set_pipelined(True)
+        for offset in xrange(0, len(data), CHUNK_SIZE):
+            remote_file.write(data[offset:offset+CHUNK_SIZE])
+    finally:
+        remote_file.close()
+    if mode is not None:
+        sftp.chmod(temp_path, mode)
+    if hasattr(sftp, 'posix_rename'):
+        sftp.posix_rename(temp_path, path)
+    else:
+        # The plain SFTP rename does not replace an existing file
+        try:
+            sftp.remove(path)
+        except IOError:
+            pass
+        sftp.rename(temp_path, path)
+    return len(data)
+
+
+def download(sftp, path, local_path):
+    '''Writes a remote file to a local file
+
+    Arguments:
+        sftp (:obj:`paramiko.SFTPClient`): SFTP session with the server
+        path (:obj:`str`): path of the remote file
+        local_path (:obj:`str`): path of the local file, written through a temporary file
+
+    Returns:
+        :obj:`int`: bytes read
+
+    '''
+    size = 0
+    temp_path = local_path+'.part'
+    remote_file = sftp.open(path, 'rb')
+    try:
+        # Requests the whole file ahead instead of one chunk at a time
+        remote_file.prefetch()
+        with open(temp_path, 'wb') as local_file:
+            while True:
+                data = remote_file.read(CHUNK_SIZE)
+                if not data:
+                    break
+                local_file.write(data)
+                size += len(data)
+    finally:
+        remote_file.close()
+    os.rename(temp_path, local_path)
+    return size
+
+
+def peer_command(path, sha1, server, command=PEER_COMMAND):
+    '''Returns the command copying a file from the server running it to another one
+
+    Arguments:
+        path (:obj:`str`): path of the file, the same in both servers
+        sha1 (:obj:`str`): sha1 of the file
+        server (:obj:`str`): server receiving the file
+        command (:obj:`str`, *default* = PEER_COMMAND): template of the command
+
+    '''
+    return command % {'path': quote(path), 'part': quote(path+'.part'), 'sha1': sha1,
+                      'server': quote(server)}
+
+
+def peer_timeout(size, command_timeout):
+    '''Returns the timeout of a copy between peers
+
+    Arguments:
+        size (:obj:`int`): size of the file
+        command_timeout (:obj:`float`): timeout of the commands, the minimum of the copy
+
+    '''
+    return max(command_timeout, float(size)/PEER_MIN_RATE)
@@ -21,6 +21,11 @@ setup(
      'Topic :: System :: Hardware :: Symmetric Multi-processing'
     ],
     keywords='ssh secure multi multi-processing parallel multiprocessing shell remote paramiko',
+    entry_points={
+        'console_scripts': [
+            'remote-multicommand = remote_multicommand.cli:main',
+        ],
+    },
     install_requires=[
         "paramiko<=1.17.2",
         "ssh_paramiko",
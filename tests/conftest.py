@@ -0,0 +1,42 @@
+import logging
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
+
+from mock_fleet import MockRemoteServer
+from remote_multicommand import RemoteMultiCommand
+from remote_multicommand.metrics import PhaseTimer
+
+TIMING = PhaseTimer().as_dict()
+
+
+def result(cmd='uptime', output='out', success=True, access=True, timeout=False):
+    '''Returns the result of a command, in the format of RemoteMultiCommand.execute_command'''
+    return {'command': cmd, 'access': access, 'result': success, 'output': output,
+            'timeout': timeout, 'timing': dict(TIMING)}
+
+
+@pytest.fixture
+def mock_multicommand(tmpdir):
+    '''Returns a function building RemoteMultiCommand instances connected to a simulated fleet,
+    closed at the end of the test'''
+    instances = []
+
+    def build(**kwargs):
+        options = {
+            'engine': 'threads',
+            'remote_server_class': MockRemoteServer,
+            'latency': 0.001,
+            'log_folder': str(tmpdir),
+            }
+        options.update(kwargs)
+        rm_cmd = RemoteMultiCommand(None, **options)
+        rm_cmd.log.setLevel(logging.CRITICAL)
+        instances.append(rm_cmd)
+        return rm_cmd
+    yield build
+    for rm_cmd in instances:
+        rm_cmd.close()
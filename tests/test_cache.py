@@ -0,0 +1,67 @@
+from conftest import result
+from remote_multicommand import cache
+from remote_multicommand.cache import ResultCache
+
+
+def test_get_returns_the_result_put():
+    results = ResultCache()
+    results.put('server', result('uptime'))
+    assert results.get('server', 'uptime')['output'] == 'out'
+    assert results.get('server', 'hostname') is None
+    assert results.get('other', 'uptime') is None
+    assert (results.hits, results.misses) == (1, 2)
+
+
+def test_failed_results_are_not_kept():
+    results = ResultCache()
+    results.put('server', result('uptime', success=False))
+    assert len(results) == 0
+
+
+def test_least_recently_used_evicted():
+    results = ResultCache(max_entries=2)
+    results.put('server1', result('cmd'))
+    results.put('server2', result('cmd'))
+    results.get('server1', 'cmd')
+    results.put('server3', result('cmd'))
+    assert len(results) == 2
+    assert results.get('server2', 'cmd') is None
+    assert results.get('server1', 'cmd') is not None
+    assert results.get('server3', 'cmd') is not None
+
+
+def test_results_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    results = ResultCache(ttl=10)
+    results.put('server1', result('cmd'))
+    now[0] += 5
+    results.put('server2', result('cmd'))
+    now[0] += 6
+    assert results.get('server1', 'cmd') is None
+    assert results.get('server2', 'cmd') is not None
+    now[0] += 10
+    results.prune()
+    assert len(results) == 0
+
+
+def test_invalidate():
+    results = ResultCache()
+    for server in ('server1', 'server2'):
+        for cmd in ('uptime', 'hostname'):
+            results.put(server, result(cmd))
+    results.invalidate(cmd='uptime')
+    assert len(results) == 2
+    results.invalidate(server='server1')
+    assert results.get('server2', 'hostname') is not None
+    assert len(results) == 1
+
+
+def test_shelve_file_shared_between_runs(tmpdir):
+    path = str(tmpdir.join('cache'))
+    results = ResultCache(path=path)
+    results.put('server', result('uptime'))
+    results.close()
+    results = ResultCache(path=path)
+    assert results.get('server', 'uptime')['output'] == 'out'
+    results.close()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import pytest
+from conftest import result
+from mock_fleet import MockRemoteServer
+from remote_multicommand import RemoteMultiCommand, cli
+from remote_multicommand.cli import parse_args, read_servers, result_line
+
+
+def test_result_line_decodes_utf8():
+    line = result_line('server', result('cat motd', 'caf\xc3\xa9 \xe2\x9c\x93\n'))
+    assert line.endswith('\n')
+    record = json.loads(line)
+    assert record['output'] == u'café ✓\n'
+    assert record['server'] == 'server'
+
+
+def test_result_line_replaces_invalid_bytes():
+    record = json.loads(result_line('server', result('cat motd', 'bad \xff\xfe end')))
+    assert record['output'] == u'bad �� end'
+
+
+def test_read_servers_skips_comments():
+    lines = ['server1\n', '\n', '# comment\n', ' server2  # rack 2\n']
+    assert list(read_servers(lines)) == ['server1', 'server2']
+
+
+def test_invalid_number_of_processes():
+    with pytest.raises(SystemExit) as error:
+        parse_args(['-k', 'key', '-c', 'uptime', '-n', '0'])
+    assert error.value.code == 2
+
+
+def test_main_restores_stdout(tmpdir, monkeypatch):
+    servers_file = tmpdir.join('servers.txt')
+    servers_file.write('server1\nserver2\n')
+    monkeypatch.setattr(cli, 'build_multicommand',
+                        lambda options: RemoteMultiCommand(None, engine='threads',
+                                                           remote_server_class=MockRemoteServer,
+                                                           latency=0.001))
+    stdout = os.fstat(1)
+    assert cli.main(['-k', 'key', '-c', 'uptime', '-f', str(servers_file)]) == 0
+    assert (os.fstat(1).st_ino, os.fstat(1).st_dev) == (stdout.st_ino, stdout.st_dev)
@@ -0,0 +1,79 @@
+from remote_multicommand.concurrency import AdaptiveConcurrency
+
+
+def test_slow_start_doubles_per_round():
+    control = AdaptiveConcurrency(initial=4)
+    for _ in range(4):
+        control.finished(None, True, 0.1)
+    assert control.limit() == 8
+    for _ in range(8):
+        control.finished(None, True, 0.1)
+    assert control.limit() == 16
+
+
+def test_maximum():
+    control = AdaptiveConcurrency(initial=4, maximum=6)
+    for _ in range(20):
+        control.finished(None, True, 0.1)
+    assert control.limit() == 6
+
+
+def test_errors_decrease_the_limit_once_per_round():
+    control = AdaptiveConcurrency(initial=16, max_error_rate=0.1, window=10)
+    for _ in range(16):
+        control.finished(None, True, 0.1)
+    assert control.limit() == 32
+    for _ in range(32):
+        control.finished(None, False)
+    assert control.limit() == 16
+    assert not control.slow_start
+
+
+def test_additive_increase_after_a_decrease():
+    control = AdaptiveConcurrency(initial=10, window=4, decrease=0.5)
+    for _ in range(10):
+        control.finished(None, False)
+    assert control.limit() == 5
+    # One server more per round of 5 connections
+    for _ in range(6):
+        control.finished(None, True, 0.1)
+    assert control.limit() == 6
+
+
+def test_slow_connections_decrease_the_limit():
+    control = AdaptiveConcurrency(initial=4, latency_factor=2)
+    for _ in range(4):
+        control.finished(None, True, 0.1)
+    for _ in range(8):
+        control.finished(None, True, 1.0)
+    assert control.limit() < 8
+
+
+def test_group_cap():
+    control = AdaptiveConcurrency(group_of=lambda server: server.split('.')[0],
+                                  group_limit=2)
+    group = control.group('bastion1.server1')
+    control.started(group)
+    assert control.has_room(group)
+    control.started(group)
+    assert not control.has_room(group)
+    assert control.has_room(control.group('bastion2.server1'))
+    control.finished(group, True, 0.1)
+    assert control.has_room(group)
+    control.begin()
+    assert control.in_flight == {}
+
+
+def test_no_group_without_group_limit():
+    control = AdaptiveConcurrency(group_of=lambda server: server)
+    assert control.group('server') is None
+    assert control.has_room(None)
+
+
+def test_reset_keeps_the_history():
+    control = AdaptiveConcurrency(initial=2)
+    for _ in range(2):
+        control.finished(None, True, 0.1)
+    control.reset()
+    assert control.limit() == 2
+    assert [limit for _, limit in control.history] == [2, 3, 4, 2]
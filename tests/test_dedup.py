@@ -0,0 +1,51 @@
+from conftest import result
+from remote_multicommand.results import DEDUP_MIN_BYTES, OutputInterner, OutputRef, \
+     dedup_output, group_outputs
+
+OUTPUT = 'x'*DEDUP_MIN_BYTES
+
+
+def test_group_outputs():
+    results = {'server1': result(output='a'), 'server2': result(output='b'),
+               'server3': result(output='a'), 'server4': result(output='b', success=False),
+               'server5': result(output='a')}
+    groups = group_outputs(results)
+    assert list(groups) == ['a', 'b']
+    assert groups['a'] == {'result': True, 'count': 3,
+                           'servers': set(['server1', 'server3', 'server5'])}
+    assert not groups['b']['result'] and groups['b']['count'] == 2
+    assert group_outputs(sorted(results.items())) == groups
+
+
+def test_worker_sends_each_output_once():
+    sent = [result(output=OUTPUT), result(output=OUTPUT), result(output='short')]
+    for cmd_dict in sent:
+        dedup_output(cmd_dict, 'launch1')
+    assert sent[0]['output'].output == OUTPUT
+    assert isinstance(sent[1]['output'], OutputRef) and sent[1]['output'].output is None
+    assert sent[2]['output'] == 'short'
+    # A new launch sends the outputs again
+    cmd_dict = result(output=OUTPUT)
+    dedup_output(cmd_dict, 'launch2')
+    assert cmd_dict['output'].output == OUTPUT
+    outputs = OutputInterner()
+    resolved = [outputs.resolve({'server'+str(index): cmd_dict})['server'+str(index)]
+                for index, cmd_dict in enumerate(sent)]
+    assert [cmd_dict['output'] for cmd_dict in resolved] == [OUTPUT, OUTPUT, 'short']
+    assert resolved[0]['output'] is resolved[1]['output']
+
+
+def test_launch_grouped_by_output(mock_multicommand):
+    servers = ['server'+str(index) for index in range(40)]
+    rm_cmd = mock_multicommand(distinct_outputs=2, output_size=200)
+    groups = rm_cmd.launch_multicommand('uptime', 4, servers, group_output=True)
+    assert len(groups) == 2
+    assert sum(group['count'] for group in groups.values()) == len(servers)
+
+
+def test_outputs_kept_once_across_worker_processes(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    rm_cmd = mock_multicommand(engine='processes', output_size=200)
+    rm_cmd.launch_multicommand('uptime', 4, servers)
+    outputs = set(id(record.output) for record in rm_cmd.results.by_command('uptime'))
+    assert len(outputs) == 1
@@ -0,0 +1,55 @@
+from remote_multicommand import hosts, remote_multicommand
+from remote_multicommand.hosts import NOT_RESOLVED, HostCache
+
+
+def fake_resolve(lookups):
+    def resolve(server):
+        lookups.append(server)
+        return None if server.endswith('.invalid') else '10.0.0.'+server[-1]
+    return resolve
+
+
+def test_resolved_once_without_server_has_dns(mock_multicommand, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(remote_multicommand, 'resolve', fake_resolve(lookups))
+    rm_cmd = mock_multicommand(server_has_dns=False)
+    results = rm_cmd.launch_multicommand('uptime', 2, ['server1', 'server2', 'bad.invalid'])
+    assert sorted(lookups) == ['bad.invalid', 'server1', 'server2']
+    assert results['server1']['result']
+    assert results['server1']['timing']['dns'] is not None
+    assert results['bad.invalid']['output'] == NOT_RESOLVED
+
+
+def test_resolved_while_connecting_with_server_has_dns(mock_multicommand, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(remote_multicommand, 'resolve', fake_resolve(lookups))
+    results = mock_multicommand(server_has_dns=True).launch_multicommand('uptime', 2,
+                                                                         ['server1'])
+    assert lookups == []
+    assert results['server1']['result']
+    assert results['server1']['timing']['dns'] is None
+
+
+def test_host_cache(monkeypatch):
+    lookups = []
+    monkeypatch.setattr(hosts, 'resolve', fake_resolve(lookups))
+    cache = HostCache()
+    assert list(cache.resolve_ahead(['server1', 'server2', 'bad.invalid', 'server1'])) == \
+        ['server1', 'server2', 'bad.invalid', 'server1']
+    assert sorted(lookups) == ['bad.invalid', 'server1', 'server2']
+    assert cache.lookup('server1') == ('10.0.0.1', False)
+    assert cache.unresolvable('bad.invalid')
+    cache.verify('server1')
+    assert cache.get('server1') == ('10.0.0.1', True)
+    assert cache.subnet('server2') == '10.0.0.0/24'
+    assert len(lookups) == 3
+
+
+def test_host_cache_seeded_by_another_process():
+    parent = HostCache()
+    parent._put('server1', '10.0.0.1')
+    parent.verify('server1')
+    worker = HostCache()
+    worker._put('server1', '10.0.0.1')
+    worker.seed('server1', parent.entry('server1'))
+    assert worker.get('server1') == ('10.0.0.1', True)
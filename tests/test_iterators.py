@@ -0,0 +1,49 @@
+import itertools
+
+
+def test_iter_multicommand_streams_the_servers(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    consumed = []
+
+    def servers():
+        for index in itertools.count():
+            consumed.append(index)
+            yield 'server'+str(index)
+    results = rm_cmd.iter_multicommand('uptime', 2, servers())
+    first = [next(results) for _ in range(5)]
+    assert all(cmd_dict['result'] for _, cmd_dict in first)
+    # The servers are read only as the workers become available
+    assert len(consumed) < 10
+    results.close()
+    assert len(rm_cmd.results) == 0
+
+
+def test_iter_multicommand_keeps_the_results_if_asked(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    servers = ['server1', 'server2', 'server3']
+    results = list(rm_cmd.iter_multicommand('uptime', 2, servers, keep_results=True))
+    assert sorted(server for server, _ in results) == servers
+    assert sorted(rm_cmd.results.servers()) == servers
+
+
+def test_iter_list_of_commands(mock_multicommand):
+    rm_cmd = mock_multicommand(failure_rate=0.3)
+    servers = ['server'+str(index) for index in range(20)]
+    results = {}
+    for server, cmd_dict in rm_cmd.iter_list_of_commands('a;b;c', 4, iter(servers)):
+        results.setdefault(server, []).append((cmd_dict['command'], cmd_dict['result']))
+    for server in servers:
+        # Each server stops at its first failed command
+        assert [cmd for cmd, _ in results[server]] == ['a', 'b', 'c'][:len(results[server])]
+        assert all(success for _, success in results[server][:-1])
+        assert len(results[server]) == 3 or not results[server][-1][1]
+
+
+def test_on_result_called_for_each_server(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    servers = ['server'+str(index) for index in range(10)]
+    called = []
+    results = rm_cmd.launch_multicommand(
+        'uptime', 3, servers, on_result=lambda server, cmd_dict: called.append(server))
+    assert sorted(called) == sorted(servers)
+    assert sorted(results) == sorted(servers)
@@ -0,0 +1,86 @@
+import json
+import time
+from conftest import result
+from mock_fleet import MockRemoteServer
+from remote_multicommand.journal import Journal, read_journal
+
+
+def outcomes(servers_cmd_dict):
+    return dict((server, [(cmd_dict['command'], cmd_dict['result'], cmd_dict['output'])
+                          for cmd_dict in results])
+                for server, results in servers_cmd_dict.items())
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('launch.journal'))
+    journal = Journal(path, batch=2)
+    journal.start({'script': ['uptime', 'date'], 'servers': ['server1', 'server2'],
+                   'output': None})
+    records = [('server1', result('uptime', 'up 1 day\n')),
+               ('server2', result('uptime', '\xe9\xff\x00 binary\n')),
+               ('server1', result('date', 'error', success=False))]
+    for server, cmd_dict in records:
+        journal.record(server, cmd_dict)
+    journal.close()
+    launch, results = read_journal(path)
+    assert launch['script'] == ['uptime', 'date']
+    assert launch['servers'] == ['server1', 'server2']
+    assert [(server, dict(cmd_dict)) for server, cmd_dict in results] == records
+
+
+def test_journal_cut_short(tmpdir):
+    path = str(tmpdir.join('launch.journal'))
+    journal = Journal(path)
+    journal.start({'script': ['uptime'], 'servers': ['server1', 'server2'], 'output': None})
+    journal.record('server1', result('uptime', 'out'))
+    journal.close()
+    with open(path, 'ab') as journal_file:
+        journal_file.write('{"server": "server2", "comm')
+    journal = Journal(path)
+    journal.record('server2', result('uptime', 'out'))
+    journal.close()
+    _, results = read_journal(path)
+    assert [server for server, cmd_dict in results] == ['server1', 'server2']
+
+
+def test_resume(tmpdir, mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    path = str(tmpdir.join('launch.journal'))
+    rm_cmd = mock_multicommand(failure_rate=0.2)
+    expected = outcomes(rm_cmd.launch_list_of_commands('a;b;c', 5, servers, journal=path))
+    with open(path, 'rb') as journal_file:
+        lines = journal_file.readlines()
+    # A crash after the first records, in the middle of a line
+    with open(path, 'wb') as journal_file:
+        journal_file.write(''.join(lines[:15])+lines[15][:10])
+    resumed = mock_multicommand(failure_rate=0.2).resume_list_of_commands(path, 5)
+    assert outcomes(resumed) == expected
+    _, results = read_journal(path)
+    assert len(list(results)) == len(lines)-1
+
+
+def recorded(path, server):
+    with open(path, 'rb') as journal_file:
+        return any(json.loads(line).get('server') == server for line in journal_file)
+
+
+class WatchingServer(MockRemoteServer):
+    '''Simulated server whose commands in server2 last until server1 is in the journal'''
+    journal = None
+    seen = []
+
+    def execute_cmd(self, cmd, timeout=20):
+        if self.server == 'server2':
+            limit = time.time()+3
+            while time.time() < limit and not recorded(self.journal, 'server1'):
+                time.sleep(0.05)
+            WatchingServer.seen.append(recorded(self.journal, 'server1'))
+        return MockRemoteServer.execute_cmd(self, cmd, timeout)
+
+
+def test_flush_while_waiting(tmpdir, mock_multicommand):
+    WatchingServer.journal = path = str(tmpdir.join('launch.journal'))
+    rm_cmd = mock_multicommand(remote_server_class=WatchingServer)
+    # The result of server1 is written while the launch waits for the one of server2
+    rm_cmd.launch_list_of_commands('uptime', 2, ['server1', 'server2'], journal=path)
+    assert WatchingServer.seen == [True]
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import Counter
+from mock_fleet import MockRemoteServer
+
+
+class CountingServer(MockRemoteServer):
+    '''Simulated server counting the connections to each server'''
+    lock = threading.Lock()
+    connections = Counter()
+
+    def connect_server(self, server, ping=True):
+        with self.lock:
+            CountingServer.connections[server] += 1
+        return MockRemoteServer.connect_server(self, server, ping)
+
+
+class SlowServer(MockRemoteServer):
+    '''Simulated server where each command of server0 takes a third of a second'''
+    def execute_cmd(self, cmd, timeout=20):
+        if self.server == 'server0':
+            time.sleep(0.3)
+        return MockRemoteServer.execute_cmd(self, cmd, timeout)
+
+
+def commands(servers_cmd_dict):
+    return dict((server, [(cmd_dict['command'], cmd_dict['result']) for cmd_dict in results])
+                for server, results in servers_cmd_dict.items())
+
+
+def test_one_connection_per_server(mock_multicommand):
+    servers = ['server'+str(index) for index in range(10)]
+    rm_cmd = mock_multicommand(remote_server_class=CountingServer)
+    CountingServer.connections.clear()
+    results = rm_cmd.launch_list_of_commands('a;b;c', 4, servers, reuse_connection=True)
+    assert set(CountingServer.connections.values()) == set([1])
+    assert all([cmd for cmd, _ in commands(results)[server]] == ['a', 'b', 'c']
+               for server in servers)
+    CountingServer.connections.clear()
+    rm_cmd.launch_list_of_commands('a;b;c', 4, servers)
+    assert set(CountingServer.connections.values()) == set([3])
+
+
+def test_reused_connection_stops_at_a_failed_command(mock_multicommand):
+    servers = ['server'+str(index) for index in range(30)]
+    expected = commands(mock_multicommand(failure_rate=0.3).launch_list_of_commands(
+        'a;b;c', 4, servers))
+    results = mock_multicommand(failure_rate=0.3).launch_list_of_commands(
+        'a;b;c', 4, servers, reuse_connection=True)
+    assert commands(results) == expected
+    assert any(len(results[server]) < 3 for server in servers)
+
+
+def test_pipeline_does_not_wait_for_the_slowest_server(mock_multicommand):
+    servers = ['server'+str(index) for index in range(10)]
+    rm_cmd = mock_multicommand(remote_server_class=SlowServer)
+    finished = []
+    results = rm_cmd.launch_list_of_commands(
+        'a;b;c', 4, servers, pipeline=True,
+        on_result=lambda server, cmd_dict: finished.append((server, cmd_dict['command'])))
+    # The other servers run all their commands while server0 runs its first one
+    assert finished.index(('server0', 'a')) > max(finished.index((server, 'c'))
+                                                  for server in servers[1:])
+    assert all([cmd for cmd, _ in commands(results)[server]] == ['a', 'b', 'c']
+               for server in servers)
+
+
+def test_pipeline_stops_at_a_failed_command(mock_multicommand):
+    servers = ['server'+str(index) for index in range(30)]
+    expected = commands(mock_multicommand(failure_rate=0.3).launch_list_of_commands(
+        'a;b;c', 4, servers))
+    results = mock_multicommand(failure_rate=0.3).launch_list_of_commands(
+        'a;b;c', 4, servers, pipeline=True)
+    assert commands(results) == expected
@@ -0,0 +1,63 @@
+import pytest
+from remote_multicommand import RemoteMultiCommand
+from remote_multicommand.output import OutputCapture
+
+
+def test_capture_without_limit():
+    stdout = OutputCapture()
+    for chunk in ('abc', 'def', ''):
+        stdout.write(chunk)
+    assert stdout.getvalue() == 'abcdef'
+    assert stdout.size == 6
+
+
+def test_capture_keeps_head_and_tail():
+    stdout = OutputCapture(10)
+    for _ in range(100):
+        stdout.write('0123456789')
+    assert stdout.getvalue() == '01234\n[... 990 bytes truncated ...]\n56789'
+    assert stdout.head_size+stdout.tail_size <= 20
+
+
+def test_capture_under_limit_is_not_truncated():
+    stdout = OutputCapture(10)
+    stdout.write('short')
+    assert stdout.getvalue() == 'short'
+
+
+def test_capture_keeping_nothing_writes_the_file(tmpdir):
+    path = tmpdir.join('output')
+    with open(str(path), 'wb') as output_file:
+        stdout = OutputCapture(0, output_file)
+        stdout.write('a'*1000)
+    assert not stdout.head and not stdout.tail
+    assert path.read() == 'a'*1000
+
+
+def test_bounded_output_of_a_launch(mock_multicommand):
+    rm_cmd = mock_multicommand(output_size=1000)
+    servers = ['server1', 'server2']
+    results = rm_cmd.launch_multicommand('uptime', 2, servers, output=10)
+    assert all(results[server]['output'] == 'xxxxx\n[... 990 bytes truncated ...]\nxxxxx'
+               for server in servers)
+    results = rm_cmd.launch_multicommand('uptime', 2, servers, output='discard')
+    assert all(results[server]['output'] == '' and results[server]['result']
+               for server in servers)
+
+
+def test_output_written_to_files(tmpdir, mock_multicommand):
+    rm_cmd = mock_multicommand(output_size=1000)
+    results = rm_cmd.launch_list_of_commands('a;b', 2, ['server1'], output='file')
+    path = str(tmpdir.join('server1.output'))
+    assert [cmd_dict['output'] for cmd_dict in results['server1']] == [path, path]
+    with open(path, 'rb') as output_file:
+        assert output_file.read() == '# a\n'+'x'*1000+'# b\n'+'x'*1000
+
+
+def test_invalid_output(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    with pytest.raises(ValueError):
+        rm_cmd.launch_multicommand('uptime', 2, ['server1'], output='all')
+    rm_cmd = RemoteMultiCommand(None)
+    with pytest.raises(ValueError):
+        rm_cmd.launch_multicommand('uptime', 2, ['server1'], output='file')
@@ -0,0 +1,50 @@
+from mock_fleet import MockRemoteServer
+
+
+class CountedServer(MockRemoteServer):
+    '''Simulated server counting the instances built'''
+    instances = [0]
+
+    def __init__(self, key_ssh, **kwargs):
+        CountedServer.instances[0] += 1
+        MockRemoteServer.__init__(self, key_ssh, **kwargs)
+
+
+def test_pool_kept_across_launches(mock_multicommand):
+    servers = ['server'+str(index) for index in range(10)]
+    rm_cmd = mock_multicommand()
+    rm_cmd.launch_multicommand('uptime', 4, servers)
+    pool = rm_cmd._pool
+    rm_cmd.launch_multicommand('date', 2, servers)
+    rm_cmd.launch_list_of_commands('a;b', 4, servers)
+    assert rm_cmd._pool is pool
+    # A larger window needs a larger pool
+    rm_cmd.launch_multicommand('uptime', 8, servers)
+    assert rm_cmd._pool is not pool and rm_cmd._pool_size == 8
+
+
+def test_close_and_launch_again(mock_multicommand):
+    servers = ['server1', 'server2']
+    with mock_multicommand() as rm_cmd:
+        rm_cmd.launch_multicommand('uptime', 2, servers)
+    assert rm_cmd._pool is None
+    results = rm_cmd.launch_multicommand('uptime', 2, servers)
+    assert all(cmd_dict['result'] for cmd_dict in results.values())
+
+
+def test_workers_keep_their_ssh_instance(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    rm_cmd = mock_multicommand(remote_server_class=CountedServer)
+    CountedServer.instances[0] = 0
+    rm_cmd.launch_multicommand('uptime', 2, servers)
+    rm_cmd.launch_multicommand('date', 2, servers)
+    # One instance per worker thread, not one per server
+    assert CountedServer.instances[0] <= 2
+
+
+def test_workers_get_the_configuration_only(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    rm_cmd.launch_multicommand('uptime', 2, ['server1'])
+    state = rm_cmd.__getstate__()
+    assert state['_pool'] is None and state['results'] is None
+    assert rm_cmd._pool is not None
@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+from mock_fleet import MockRemoteServer
+from remote_multicommand import RemoteMultiCommand
+from remote_multicommand.relay import RelayAgent
+
+
+def start_relay(**kwargs):
+    '''Starts a relay serving a launch in a thread, returning its address'''
+    options = {'engine': 'threads', 'remote_server_class': MockRemoteServer, 'latency': 0.001}
+    options.update(kwargs)
+    agent = RelayAgent(('127.0.0.1', 0), 'secret', None, **options)
+    agent.log.setLevel(logging.CRITICAL)
+    server = threading.Thread(target=agent.serve_once)
+    server.daemon = True
+    server.start()
+    return agent.address
+
+
+def test_run_timeout(tmpdir):
+    servers = ['server'+str(index) for index in range(10)]
+    rm_cmd = RemoteMultiCommand(None, relays=[start_relay(hang_rate=0.5, hang_time=30)],
+                                relay_authkey='secret', run_timeout=1, log_folder=str(tmpdir))
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    start = time.time()
+    results = rm_cmd.launch_multicommand('uptime', 10, servers)
+    assert time.time()-start < 5
+    assert sorted(results) == servers
+    timed_out = [server for server in servers if results[server]['timeout']]
+    assert timed_out and all(results[server]['output'] == 'Run deadline reached'
+                             for server in timed_out)
+    assert all(results[server]['result'] for server in servers if server not in timed_out)
+
+
+def outcomes(servers_cmd_dict):
+    return dict((server, (cmd_dict['command'], cmd_dict['result'], cmd_dict['output']))
+                for server, cmd_dict in servers_cmd_dict.items())
+
+
+def commands(servers_cmd_dict):
+    return dict((server, [(cmd_dict['command'], cmd_dict['result']) for cmd_dict in results])
+                for server, results in servers_cmd_dict.items())
+
+
+def test_launch_through_relays(mock_multicommand):
+    servers = ['server'+str(index) for index in range(40)]
+    options = {'failure_rate': 0.2, 'distinct_outputs': 3, 'output_size': 100}
+    expected = outcomes(mock_multicommand(**options).launch_multicommand('uptime', 4, servers))
+    relays = [start_relay(**options), start_relay(**options)]
+    rm_cmd = RemoteMultiCommand(None, relays=relays, relay_authkey='secret')
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    assert outcomes(rm_cmd.launch_multicommand('uptime', 4, servers)) == expected
+    assert rm_cmd.last_run_stats['servers'] == len(servers)
+
+
+def test_list_of_commands_through_a_relay(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    expected = mock_multicommand(failure_rate=0.2).launch_list_of_commands('a;b', 4, servers)
+    rm_cmd = RemoteMultiCommand(None, relays=[start_relay(failure_rate=0.2)],
+                                relay_authkey='secret')
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    assert commands(rm_cmd.launch_list_of_commands('a;b', 4, servers, pipeline=True)) == \
+        commands(expected)
+
+
+def test_servers_of_a_relay_not_reached():
+    relay = start_relay()
+    rm_cmd = RemoteMultiCommand(None, relays=[relay, ('127.0.0.1', 1)], relay_authkey='secret',
+                                relay_of=lambda server: relay if server == 'server1'
+                                else ('127.0.0.1', 1))
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    results = rm_cmd.launch_multicommand('uptime', 2, ['server1', 'server2'])
+    assert results['server1']['result']
+    assert not results['server2']['access']
+    assert results['server2']['output'].startswith("Cannot reach relay ('127.0.0.1', 1)")
+
+
+def test_relay_rejects_a_wrong_authkey():
+    rm_cmd = RemoteMultiCommand(None, relays=[start_relay()], relay_authkey='wrong')
+    rm_cmd.log.setLevel(logging.CRITICAL)
+    results = rm_cmd.launch_multicommand('uptime', 2, ['server1'])
+    assert results['server1']['output'].startswith('Cannot reach relay')
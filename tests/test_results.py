@@ -0,0 +1,89 @@
+import pytest
+from conftest import result
+from remote_multicommand.results import ResultStore
+
+@pytest.fixture
+def store():
+    results = ResultStore()
+    results.add('server1', result('uptime'))
+    results.add('server1', result('hostname', success=False))
+    results.add('server2', result('uptime', access=False, success=False))
+    results.add('server3', result('uptime', access=False, success=False, timeout=True))
+    return results
+
+
+def test_indexes(store):
+    assert len(store) == 4
+    assert [record.command for record in store.by_server('server1')] == ['uptime', 'hostname']
+    assert [record.server for record in store.by_command('uptime')] == \
+        ['server1', 'server2', 'server3']
+    assert [record.server for record in store.by_status('success')] == ['server1']
+    assert [record.command for record in store.by_status('failed')] == ['hostname']
+    assert [record.server for record in store.by_status('unreachable')] == ['server2']
+    assert [record.server for record in store.by_status('timeout')] == ['server3']
+    assert sorted(store.servers()) == ['server1', 'server2', 'server3']
+    assert sorted(store.commands()) == ['hostname', 'uptime']
+    assert store.by_server('missing') == []
+
+
+def test_names_are_interned(store):
+    store.add(''.join(['server', '1']), result(''.join(['up', 'time'])))
+    assert store.by_server('server1')[-1].server is store.by_server('server1')[0].server
+    assert store.by_server('server1')[-1].command is store.by_server('server1')[0].command
+
+
+def test_as_dict_round_trip(store):
+    cmd_dict = store.by_server('server1')[0].as_dict()
+    assert cmd_dict == result('uptime')
+    assert list(cmd_dict.keys()) == ['command', 'access', 'result', 'output', 'timeout',
+                                     'timing']
+
+
+def test_view(store):
+    view = store.view()
+    assert len(view) == 3
+    assert [cmd_dict['command'] for cmd_dict in view['server1']] == ['uptime', 'hostname']
+    assert 'server2' in view and 'missing' not in view
+    with pytest.raises(KeyError):
+        view['missing']
+    view['server1'][0]['output'] = 'changed'
+    assert store.by_server('server1')[0].output == 'out'
+
+
+def test_view_from_a_position(store):
+    view = store.view(first=1, single=True)
+    assert sorted(view) == ['server1', 'server2', 'server3']
+    assert view['server1']['command'] == 'hostname'
+    assert 'server1' not in store.view(first=2)
+
+
+def test_view_covers_the_results_stored_when_created(store):
+    view = store.view(first=2)
+    store.add('server4', result('uptime'))
+    store.add('server2', result('hostname'))
+    assert sorted(view) == ['server2', 'server3']
+    assert len(view['server2']) == 1
+    assert len(store.view()) == 4
+
+
+def test_snapshot(store):
+    snapshot = store.snapshot(first=1, single=True)
+    store.add('server1', result('date'))
+    assert snapshot['server1']['command'] == 'hostname'
+    assert isinstance(snapshot, dict)
+    assert [cmd_dict['command'] for cmd_dict in store.snapshot()['server1']] == \
+        ['uptime', 'hostname', 'date']
+
+
+def test_servers_cmd_dict_kept_between_accesses(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    rm_cmd.launch_multicommand('uptime', 2, ['server1', 'server2'])
+    servers_cmd_dict = rm_cmd.servers_cmd_dict
+    assert rm_cmd.servers_cmd_dict is servers_cmd_dict
+    servers_cmd_dict['server1'][0]['output'] = 'edited'
+    rm_cmd.launch_multicommand('date', 2, ['server1'])
+    assert rm_cmd.servers_cmd_dict['server1'][0]['output'] == 'edited'
+    assert [cmd_dict['command'] for cmd_dict in rm_cmd.servers_cmd_dict['server1']] == \
+           ['uptime', 'date']
+    # The edits are not made in the store
+    assert rm_cmd.results.by_server('server1')[0].output != 'edited'
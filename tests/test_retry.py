@@ -0,0 +1,67 @@
+from remote_multicommand.retry import CircuitBreaker, RetryPolicy, ipv4_subnet
+
+
+def test_ipv4_subnet():
+    assert ipv4_subnet('10.1.2.3') == '10.1.2.0/24'
+    assert ipv4_subnet('10.1.2.3', 16) == '10.1.0.0/16'
+    assert ipv4_subnet('server.example.com') is None
+    assert ipv4_subnet('300.1.2.3') is None
+
+
+def test_host_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(host_failures=3, subnet_failures=None)
+    for _ in range(2):
+        breaker.record('server', False)
+    assert breaker.is_open('server') is None
+    breaker.record('server', False)
+    assert breaker.is_open('server') == 'Circuit open after 3 failed connections'
+    assert breaker.is_open('other') is None
+
+
+def test_success_resets_the_failures():
+    breaker = CircuitBreaker(host_failures=2)
+    breaker.record('10.0.0.1', False)
+    breaker.record('10.0.0.1', True)
+    breaker.record('10.0.0.1', False)
+    assert breaker.is_open('10.0.0.1') is None
+
+
+def test_subnet_opens_after_failures_of_its_servers():
+    breaker = CircuitBreaker(host_failures=3, subnet_failures=3)
+    for index in range(3):
+        breaker.record('10.0.0.'+str(index), False)
+    assert breaker.is_open('10.0.0.200') == \
+        'Circuit open for subnet 10.0.0.0/24 after 3 failed connections'
+    assert breaker.is_open('10.0.1.1') is None
+
+
+def test_retried_failures_do_not_count_for_the_subnet():
+    breaker = CircuitBreaker(host_failures=5, subnet_failures=2)
+    for _ in range(3):
+        breaker.record('10.0.0.1', False, retrying=True)
+    assert breaker.is_open('10.0.0.2') is None
+    assert breaker.hosts['10.0.0.1'] == 3
+
+
+def test_reset():
+    breaker = CircuitBreaker(host_failures=1)
+    breaker.record('server', False)
+    breaker.reset()
+    assert breaker.is_open('server') is None
+
+
+def test_retry_policy():
+    policy = RetryPolicy(retries=2, backoff=1, max_backoff=3, jitter=0)
+    assert policy.should_retry('[Errno 111] Connection refused', 0)
+    assert not policy.should_retry('[Errno 111] Connection refused', 2)
+    assert not policy.should_retry('Authentication failed.', 0)
+    assert [policy.delay(attempt) for attempt in range(4)] == [1, 2, 3, 3]
+
+
+def test_breaker_stops_retrying_through_the_launch(mock_multicommand):
+    rm_cmd = mock_multicommand(unreachable_rate=1, retry=RetryPolicy(retries=5, backoff=0.01),
+                               circuit_breaker=CircuitBreaker(host_failures=2))
+    results = rm_cmd.launch_multicommand('uptime', 2, ['server1', 'server2'])
+    assert all(not cmd_dict['access'] for cmd_dict in results.values())
+    assert all(breaker_failures == 2
+               for breaker_failures in rm_cmd.circuit_breaker.hosts.values())
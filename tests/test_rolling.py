@@ -0,0 +1,39 @@
+from mock_fleet import MockRemoteServer
+from remote_multicommand import RemoteMultiCommand
+
+
+class FailingServer(MockRemoteServer):
+    '''Simulated server where the commands of the servers in failing fail'''
+    failing = set()
+
+    def execute_cmd(self, cmd, timeout=20):
+        if self.server in self.failing:
+            return False, 'mock: failed', 'mock: failed'
+        return MockRemoteServer.execute_cmd(self, cmd, timeout)
+
+
+def test_wave_sizes():
+    sizes = RemoteMultiCommand._wave_sizes((1, 0.1, 0.5, 3), 20)
+    assert [next(sizes) for _ in range(6)] == [1, 2, 10, 3, 3, 3]
+
+
+def test_rollout_in_waves(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    rm_cmd = mock_multicommand()
+    results = rm_cmd.launch_rolling_commands('a;b', 4, servers, waves=(1, 0.25, 1.0))
+    assert sorted(results) == sorted(servers)
+    assert [wave['servers'] for wave in rm_cmd.last_rollout['waves']] == [1, 5, 14]
+    assert not rm_cmd.last_rollout['aborted']
+
+
+def test_rollout_aborted_by_a_failed_wave(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    FailingServer.failing = set(['server2', 'server3'])
+    rm_cmd = mock_multicommand(remote_server_class=FailingServer)
+    results = rm_cmd.launch_rolling_commands('a;b', 4, servers, waves=(1, 4, 1.0),
+                                             max_failure_rate=0.25)
+    assert sorted(results) == sorted(servers[:5])
+    assert rm_cmd.last_rollout['aborted']
+    assert rm_cmd.last_rollout['remaining'] == servers[5:]
+    assert rm_cmd.last_rollout['waves'][-1] == {'servers': 4, 'failed': 2,
+                                                'failure_rate': 0.5}
@@ -0,0 +1,99 @@
+import threading
+import time
+import pytest
+from mock_fleet import MockRemoteServer
+
+
+class SlowServer(MockRemoteServer):
+    '''Simulated server where the commands of server0 take half a second, counting the
+    commands running at the same time'''
+    lock = threading.Lock()
+    running = [0]
+    most = [0]
+
+    def execute_cmd(self, cmd, timeout=20):
+        with self.lock:
+            self.running[0] += 1
+            self.most[0] = max(self.most[0], self.running[0])
+        try:
+            if self.server == 'server0':
+                time.sleep(0.5)
+            return MockRemoteServer.execute_cmd(self, cmd, timeout)
+        finally:
+            with self.lock:
+                self.running[0] -= 1
+
+
+def test_slow_server_holds_only_its_slot(mock_multicommand):
+    servers = ['server'+str(index) for index in range(30)]
+    rm_cmd = mock_multicommand(remote_server_class=SlowServer)
+    SlowServer.most[0] = 0
+    start = time.time()
+    finished = [server for server, _ in rm_cmd.iter_multicommand('uptime', 3, servers)]
+    # The other servers go on through the two free slots while server0 runs
+    assert time.time()-start < 1
+    assert finished[-1] == 'server0'
+    assert sorted(finished) == sorted(servers)
+    assert SlowServer.most[0] == 3
+
+
+def test_run_deadline_frees_the_workers(mock_multicommand):
+    servers = ['server'+str(index) for index in range(40)]
+    rm_cmd = mock_multicommand(engine='processes', hang_rate=0.2, hang_time=20, run_timeout=1)
+    results = rm_cmd.launch_multicommand('uptime', 8, servers)
+    hung = [server for server, cmd_dict in results.items() if cmd_dict['timeout']]
+    assert hung
+    assert all(results[server]['output'] == 'Run deadline reached' for server in hung)
+    # The next launch does not wait behind the workers of the hung servers
+    rm_cmd.ssh_opt_args['hang_rate'] = 0
+    rm_cmd.run_timeout = None
+    start = time.time()
+    results = rm_cmd.launch_multicommand('uptime', 8, servers)
+    assert time.time()-start < 5
+    assert all(cmd_dict['result'] for cmd_dict in results.values())
+    # Nor does closing the workers
+    rm_cmd.ssh_opt_args['hang_rate'] = 0.2
+    rm_cmd.run_timeout = 1
+    iter_results = rm_cmd.iter_multicommand('uptime', 8, servers)
+    next(iter_results)
+    start = time.time()
+    rm_cmd.close()
+    assert time.time()-start < 5
+
+
+def test_invalid_window(mock_multicommand):
+    rm_cmd = mock_multicommand()
+    with pytest.raises(ValueError):
+        rm_cmd.launch_multicommand('uptime', 0, ['server1'])
+    with pytest.raises(ValueError):
+        list(rm_cmd.iter_multicommand('uptime', -1, ['server1']))
+    with pytest.raises(ValueError):
+        rm_cmd.launch_list_of_commands('uptime;date', 0, ['server1'], pipeline=True)
+    # A launch without servers is still valid
+    assert rm_cmd.launch_multicommand('uptime', 5, []) == {}
+
+
+def test_hung_task_abandoned_by_the_scheduler(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    rm_cmd = mock_multicommand(hang_rate=0.2, hang_time=20, connect_timeout=0.3,
+                               command_timeout=0.3)
+    start = time.time()
+    results = rm_cmd.launch_multicommand('uptime', 4, servers)
+    hung = [server for server, cmd_dict in results.items() if cmd_dict['timeout']]
+    assert hung and len(hung) < len(servers)
+    assert all(results[server]['output'] == 'Timed out after 0.6 seconds' for server in hung)
+    assert all(cmd_dict['result'] for server, cmd_dict in results.items() if server not in hung)
+    # The connections of the hung threads are closed, which releases them
+    rm_cmd.close()
+    assert time.time()-start < 5
+
+
+def test_connect_timeout_in_the_workers(mock_multicommand):
+    servers = ['server'+str(index) for index in range(20)]
+    rm_cmd = mock_multicommand(engine='processes', hang_rate=0.2, hang_time=20,
+                               connect_timeout=0.3, command_timeout=0.3)
+    results = rm_cmd.launch_multicommand('uptime', 4, servers)
+    hung = [server for server, cmd_dict in results.items() if cmd_dict['timeout']]
+    assert hung
+    assert all(results[server]['output'] == 'Connection timed out after 0.3 seconds'
+               for server in hung)
@@ -0,0 +1,54 @@
+import pytest
+from remote_multicommand.output import OutputCapture, ScriptOutput
+
+TOKEN = 'RMC0123456789abcdef'
+
+
+def script_output(*steps):
+    '''Returns the standard output of a script with the given outputs and exit statuses'''
+    return ''.join(TOKEN+' '+str(index)+'\n'+output+'\n'+TOKEN+' '+str(index)+' '+status+'\n'
+                   for index, (output, status) in enumerate(steps))
+
+
+def split(stdout, num_of_cmds, std_error='', chunk_size=None, max_bytes=None):
+    script = ScriptOutput(TOKEN, num_of_cmds, lambda index: OutputCapture(max_bytes))
+    chunk_size = chunk_size or len(stdout) or 1
+    for position in range(0, len(stdout), chunk_size):
+        script.write(stdout[position:position+chunk_size])
+    return list(script.steps(std_error))
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 3, 7, 1000])
+def test_script_output_split_by_command(chunk_size):
+    stdout = script_output(('one', '0'), ('', '0'), ('x'*5000, '3'))+'trailing'
+    assert split(stdout, 3, chunk_size=chunk_size) == [
+        (True, 'one', '0'), (True, '', '0'), (True, 'x'*5000, '3')]
+
+
+def test_script_output_bounded_by_command():
+    steps = split(script_output(('a'*10000, '0'), ('b'*10000, '0')), 2, chunk_size=100,
+                  max_bytes=4)
+    assert steps == [(True, 'aa\n[... 9996 bytes truncated ...]\naa', '0'),
+                     (True, 'bb\n[... 9996 bytes truncated ...]\nbb', '0')]
+
+
+def test_script_output_failed_command():
+    stdout = script_output(('ok', '0'), ('', '1'))
+    assert split(stdout, 3, 'error') == [(True, 'ok', '0'), (False, 'error', '1')]
+
+
+def test_script_output_interrupted():
+    stdout = script_output(('ok', '0'))+TOKEN+' 1\npartial'
+    assert split(stdout, 2, chunk_size=2) == [(True, 'ok', '0'),
+                                              (False, 'Script interrupted', None)]
+    assert split('', 2) == []
+
+
+def test_script_through_mock_fleet(mock_multicommand):
+    rm_cmd = mock_multicommand(output_size=1000)
+    results = rm_cmd.launch_list_of_commands('a;b', 2, ['server1', 'server2'],
+                                             as_script=True, output=10)
+    for server in ('server1', 'server2'):
+        assert [cmd_dict['command'] for cmd_dict in results[server]] == ['a', 'b']
+        assert all(cmd_dict['result'] for cmd_dict in results[server])
+        assert results[server][0]['output'] == 'xxxxx\n[... 990 bytes truncated ...]\nxxxxx'
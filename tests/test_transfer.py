@@ -0,0 +1,89 @@
+import time
+import pytest
+from mock_fleet import MockRemoteServer
+from remote_multicommand import RemoteMultiCommand
+from remote_multicommand.transfer import PEER_MIN_RATE
+
+
+class PeerServer(MockRemoteServer):
+    '''Simulated server recording the commands it runs, with their timeout'''
+    commands = []
+
+    def execute_cmd(self, cmd, timeout=20):
+        PeerServer.commands.append((self.server, cmd, timeout))
+        return MockRemoteServer.execute_cmd(self, cmd, timeout)
+
+
+class HungPeerServer(MockRemoteServer):
+    '''Simulated server whose copies to server4 hang until the connection is closed'''
+    def execute_cmd(self, cmd, timeout=20):
+        if cmd.startswith('ssh ') and 'server4' in cmd:
+            self.closed.wait(30)
+            return False, 'Socket Timeout', 'Socket Timeout'
+        return MockRemoteServer.execute_cmd(self, cmd, timeout)
+
+
+def test_push_and_pull(tmpdir, mock_multicommand):
+    local_file = tmpdir.join('artifact.bin')
+    local_file.write('payload'*1000)
+    rm_cmd = mock_multicommand(remote_root=str(tmpdir.join('remote')))
+    servers = ['server1', 'server2']
+    results = rm_cmd.push_file(str(local_file), '/opt/artifact.bin', 2, servers)
+    assert [results[server]['output'] for server in servers] == ['pushed 7000 bytes']*2
+    results = rm_cmd.push_file(str(local_file), '/opt/artifact.bin', 2, servers)
+    assert [results[server]['output'] for server in servers] == ['unchanged']*2
+    results = rm_cmd.pull_file('/opt/artifact.bin', str(tmpdir.join('pulled')), 2, servers)
+    for server in servers:
+        assert open(results[server]['output'], 'rb').read() == 'payload'*1000
+
+
+def test_no_transfer_through_relays(tmpdir):
+    rm_cmd = RemoteMultiCommand(None, relays=[('127.0.0.1', 1)], relay_authkey='key')
+    with pytest.raises(ValueError):
+        rm_cmd.push_file(str(tmpdir.join('missing')), '/opt/artifact.bin', 2, ['server1'])
+    with pytest.raises(ValueError):
+        rm_cmd.pull_file('/opt/artifact.bin', str(tmpdir), 2, ['server1'])
+
+
+def test_push_through_peers(tmpdir, mock_multicommand):
+    local_file = tmpdir.join('artifact.bin')
+    local_file.write('x'*(PEER_MIN_RATE*3))
+    rm_cmd = mock_multicommand(remote_server_class=PeerServer,
+                               remote_root=str(tmpdir.join('remote')))
+    servers = ['server'+str(index) for index in range(7)]
+    del PeerServer.commands[:]
+    results = rm_cmd.push_file(str(local_file), '/opt/artifact.bin', 4, servers, peers=2)
+    assert [results[server]['output'] for server in servers[:2]] == \
+           ['pushed '+str(PEER_MIN_RATE*3)+' bytes']*2
+    # Two servers hold the file, which they copy to four servers, then to the last one
+    for server in servers[2:6]:
+        assert results[server]['output'] in ('copied from server0', 'copied from server1')
+    assert results['server6']['output'].startswith('copied from server')
+    copies = [(holder, cmd, timeout) for holder, cmd, timeout in PeerServer.commands
+              if cmd.startswith('ssh ')]
+    assert len(copies) == 5
+    for holder, cmd, timeout in copies:
+        assert 'scp' in cmd and '/opt/artifact.bin.part' in cmd and 'mv -f' in cmd
+        assert timeout == 20
+    # The copy is given the time to copy the file at the slowest rate expected, if longer
+    # than the timeout of the commands
+    rm_cmd.command_timeout = 1
+    del PeerServer.commands[:]
+    rm_cmd.push_file(str(local_file), '/opt/other.bin', 4, servers, peers=2)
+    assert set(timeout for _, cmd, timeout in PeerServer.commands if cmd.startswith('ssh ')) \
+           == set([3])
+
+
+def test_abandon_one_of_the_copies_of_a_holder(tmpdir, mock_multicommand):
+    local_file = tmpdir.join('artifact.bin')
+    local_file.write('payload')
+    rm_cmd = mock_multicommand(remote_server_class=HungPeerServer, connect_timeout=0.5,
+                               command_timeout=0.5, remote_root=str(tmpdir.join('remote')))
+    servers = ['server'+str(index) for index in range(6)]
+    start = time.time()
+    # server0 copies the file to server2 and to server4, whose copy is abandoned and closed
+    results = rm_cmd.push_file(str(local_file), '/opt/artifact.bin', 4, servers, peers=2)
+    rm_cmd.close()
+    assert time.time()-start < 10
+    assert results['server2']['output'] == 'copied from server0'
+    assert results['server4']['output'] == 'pushed 7 bytes'